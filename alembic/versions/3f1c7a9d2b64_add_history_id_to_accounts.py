@@ -0,0 +1,28 @@
+"""Add historyId column to accounts table
+
+Revision ID: 3f1c7a9d2b64
+Revises: 21052f556dbc
+Create Date: 2026-02-03 10:14:52.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f1c7a9d2b64'
+down_revision: Union[str, Sequence[str], None] = '21052f556dbc'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('accounts', sa.Column('historyId', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('accounts', 'historyId')
@@ -0,0 +1,31 @@
+"""Add fingerprint to order items
+
+Revision ID: 5a9c3e7f2b18
+Revises: 7d2e4b9a1c35
+Create Date: 2026-02-18 10:05:44.218361
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a9c3e7f2b18'
+down_revision: Union[str, Sequence[str], None] = '7d2e4b9a1c35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing items keep a null fingerprint, upsertOrders adds no items to orders that still have such items
+    op.add_column('order_items', sa.Column('fingerprint', sa.String(length=64), nullable=True))
+    op.create_index('uq_order_items_order_fingerprint', 'order_items', ['order_id', 'fingerprint'], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_order_items_order_fingerprint', table_name='order_items')
+    op.drop_column('order_items', 'fingerprint')
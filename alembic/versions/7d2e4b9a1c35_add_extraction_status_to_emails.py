@@ -0,0 +1,34 @@
+"""Add extraction status columns to emails table
+
+Revision ID: 7d2e4b9a1c35
+Revises: 3f1c7a9d2b64
+Create Date: 2026-02-10 11:42:07.531904
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7d2e4b9a1c35'
+down_revision: Union[str, Sequence[str], None] = '3f1c7a9d2b64'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('emails', sa.Column('extraction_status', sa.String(length=16), nullable=False, server_default='pending'))
+    op.add_column('emails', sa.Column('extraction_attempts', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('emails', sa.Column('extraction_error', sa.Text(), nullable=True))
+    op.create_index('ix_emails_account_extraction_status', 'emails', ['accountId', 'extraction_status'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_emails_account_extraction_status', table_name='emails')
+    op.drop_column('emails', 'extraction_error')
+    op.drop_column('emails', 'extraction_attempts')
+    op.drop_column('emails', 'extraction_status')
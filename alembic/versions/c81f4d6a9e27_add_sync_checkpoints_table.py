@@ -0,0 +1,42 @@
+"""Add sync checkpoints table
+
+Revision ID: c81f4d6a9e27
+Revises: 5a9c3e7f2b18
+Create Date: 2026-02-24 09:31:12.604118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c81f4d6a9e27'
+down_revision: Union[str, Sequence[str], None] = '5a9c3e7f2b18'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('sync_checkpoints',
+        sa.Column('account_id', sa.UUID(), nullable=False),
+        sa.Column('query', sa.Text(), nullable=True),
+        sa.Column('start_history_id', sa.String(), nullable=True),
+        sa.Column('sync_history_id', sa.String(), nullable=True),
+        sa.Column('page_token', sa.String(), nullable=True),
+        sa.Column('listing_complete', sa.Boolean(), server_default='false', nullable=False),
+        sa.Column('watermark', sa.DateTime(), nullable=True),
+        sa.Column('in_flight_ids', postgresql.ARRAY(sa.String()), server_default='{}', nullable=False),
+        sa.Column('pages_committed', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ),
+        sa.PrimaryKeyConstraint('account_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('sync_checkpoints')
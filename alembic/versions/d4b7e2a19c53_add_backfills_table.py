@@ -0,0 +1,38 @@
+"""Add backfills table
+
+Revision ID: d4b7e2a19c53
+Revises: c81f4d6a9e27
+Create Date: 2026-03-09 11:02:47.218530
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd4b7e2a19c53'
+down_revision: Union[str, Sequence[str], None] = 'c81f4d6a9e27'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('backfills',
+        sa.Column('account_id', sa.UUID(), nullable=False),
+        sa.Column('state', sa.String(), server_default='submitting', nullable=False),
+        sa.Column('owner', sa.String(), nullable=True),
+        sa.Column('jobs', postgresql.JSONB(astext_type=sa.Text()), server_default='[]', nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['account_id'], ['accounts.id'], ),
+        sa.PrimaryKeyConstraint('account_id')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('backfills')
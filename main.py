@@ -1,5 +1,4 @@
 import os
-import json
 import time
 from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
@@ -10,6 +9,7 @@ import secrets
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
 from src.api import router
+from src.utils.compression import RequestDecompressionMiddleware
 from src.utils.log import setup_logger
 # from app.ws import chat
 
@@ -23,39 +23,31 @@ app = FastAPI(
     openapi_version="3.0.2"
 )
 
+# Credentials never reach the logs
+REDACTED_HEADERS = {"authorization", "cookie", "set-cookie", "proxy-authorization", "x-api-key"}
+
+def redact_headers(headers) -> dict:
+    return {name: "[redacted]" if name.lower() in REDACTED_HEADERS else value for name, value in headers.items()}
+
 # Middleware to log all incoming requests and outgoing responses
 @app.middleware("http")
 async def log_requests_responses(request: Request, call_next):
     # Log incoming request
     start_time = time.time()
     
-    # Log structured request data
+    # Log structured request data, bodies are described rather than logged: bulk payloads are
+    # megabytes of email content, and reading them here would buffer and decode every request twice
     extra_fields = {
         "type": "REQUEST",
         "method": request.method,
         "path": request.url.path,
         "query_params": dict(request.query_params),
-        "headers": dict(request.headers),
+        "headers": redact_headers(request.headers),
         "client": f"{request.client.host}:{request.client.port}" if request.client else None,
     }
-    
-    # Get request body
     if request.method in ["POST", "PUT", "PATCH"]:
-        try:
-            body = await request.body()
-            # Store body so it can be read by the endpoint
-            async def receive():
-                return {"type": "http.request", "body": body}
-            request._receive = receive
-            
-            # Try to parse as JSON
-            try:
-                body_json = json.loads(body.decode())
-                extra_fields["body"] = body_json
-            except:
-                extra_fields["body"] = body.decode()
-        except Exception as e:
-            extra_fields["body_error"] = str(e)
+        extra_fields["body_bytes"] = request.headers.get("content-length")
+        extra_fields["content_type"] = request.headers.get("content-type")
     
     logger.info(f"Incoming request - {request.method} {request.url.path}", extra=extra_fields)
     
@@ -71,13 +63,16 @@ async def log_requests_responses(request: Request, call_next):
         "status_code": response.status_code,
         "path": request.url.path,
         "processing_time_seconds": round(process_time, 3),
-        "headers": dict(response.headers),
+        "headers": redact_headers(response.headers),
     }
     
     logger.info(f"Request completed - {request.method} {request.url.path}", extra=extra_fields)
     
     return response
 
+# Added after the logging middleware so it runs first, the worker compresses large bulk payloads
+app.add_middleware(RequestDecompressionMiddleware)
+
 app.include_router(router, prefix="/api")
 # app.include_router(chat.router, prefix="/ws")
 
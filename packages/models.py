@@ -56,6 +56,17 @@ class OrdersIntentModel(BaseModel):
 class OrdersListIntentModel(BaseModel):
     orders: list[OrdersIntentModel] = Field(..., description="List of orders extracted from emails")
 
+class MessageExtractionIntentModel(BaseModel):
+    model_config = ConfigDict(extra='ignore')
+
+    messageId: str = Field(..., description="Gmail message ID, maps to the \"ID\" in the message")
+    kind: str = Field(..., description="What the message is, strictly one of 'transaction' | 'order' | 'other'")
+    transactions: list[Transaction] = Field([], description="Transactions reported by the message, empty unless kind is 'transaction'")
+    order: Optional[OrdersIntentModel] = Field(None, description="The order in the message, null unless kind is 'order'")
+
+class ExtractionListIntentModel(BaseModel):
+    results: list[MessageExtractionIntentModel] = Field(..., description="One result per input message, in input order")
+
 class EmailSanitized(BaseModel):
     id: str
     threadId: str
@@ -0,0 +1,206 @@
+"""
+Micro-benchmark for email body extraction: the previous regex based EmailManager
+implementation against worker/body_extraction.py.
+
+The built-in corpus mimics bank alerts (plain text and html) and e-commerce order mails
+(table heavy html with inline css, tracking scripts and long legal footers). Real samples
+can be added with --corpus pointing at a directory of Gmail `format=full` message JSON files.
+
+Usage: python scripts/bench_body_extraction.py --rounds 20 [--corpus ./samples]
+"""
+
+import argparse
+import base64
+import glob
+import json
+import os
+import re
+import sys
+import time
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worker.body_extraction import extract_body_text
+
+FOOTER_HTML = (
+    "<p style='font-size:10px;color:#999'>This is a system generated mail. Please do not reply to this email.</p>"
+    "<p style='font-size:10px;color:#999'>Disclaimer: This communication is confidential and privileged. "
+    "If you are not the intended recipient, please notify the sender and delete it. Never share your OTP, "
+    "PIN or password with anyone. The bank will never ask for these details.</p>" * 3
+    + "<p><a href='https://example.com/unsubscribe'>Unsubscribe</a> | <a href='https://example.com/privacy'>Privacy Policy</a></p>"
+    "<p>&copy; 2025 Example Ltd. All rights reserved.</p>"
+)
+
+BANK_ALERT_HTML = (
+    "<html><head><meta charset='utf-8'><title>Alert</title>"
+    "<style>body {{ font-family: Arial; }} .amount {{ font-weight: bold; }} td {{ padding: 6px; }}</style>"
+    "<script>window.dataLayer = window.dataLayer || []; function gtag(){{dataLayer.push(arguments);}}</script>"
+    "</head><body><table width='600' cellpadding='0' cellspacing='0'><tr><td>"
+    "<img src='https://example.com/logo.png' alt='Bank'></td></tr><tr><td>Dear Customer,</td></tr>"
+    "<tr><td>Rs.<span class='amount'>{amount}.00</span> has been debited from account **{acct} to VPA "
+    "merchant{n}@ybl MERCHANT {n} on 04-07-25.</td></tr>"
+    "<tr><td>Your UPI transaction reference number is {ref}.</td></tr>"
+    "<tr><td>If you did not authorize this transaction, please report it immediately.</td></tr>"
+    "</table>" + FOOTER_HTML + "</body></html>"
+)
+
+BANK_ALERT_TEXT = (
+    "Dear Customer,\r\n\r\nRs.{amount}.00 has been debited from account **{acct} to VPA merchant{n}@ybl "
+    "MERCHANT {n} on 04-07-25.\r\n\r\nYour UPI transaction reference number is {ref}.\r\n\r\n"
+    "If you did not authorize this transaction, please report it immediately.\r\n\r\n"
+    "This is a system generated mail. Please do not reply.\r\n"
+    + "Disclaimer: This communication is confidential and privileged. " * 10
+)
+
+ORDER_ROW_HTML = (
+    "<tr><td style='padding:8px;border-bottom:1px solid #eee'><img src='https://example.com/item{i}.jpg' width='64'></td>"
+    "<td style='padding:8px;border-bottom:1px solid #eee'>Product {i} - Assorted pack, 500 g</td>"
+    "<td style='padding:8px;border-bottom:1px solid #eee'>{qty}</td>"
+    "<td style='padding:8px;border-bottom:1px solid #eee'>&#8377;{price}</td></tr>"
+)
+
+ORDER_HTML = (
+    "<!DOCTYPE html><html><head><meta name='viewport' content='width=device-width'>"
+    "<style>" + "".join(f".c{i} {{{{ margin: 0; padding: {i}px; color: #333; }}}}\n" for i in range(40)) + "</style>"
+    "<style>@media only screen and (max-width: 600px) {{ table {{ width: 100% !important; }} }}</style>"
+    "</head><body><!-- preheader --><div style='display:none'>Your order is confirmed</div>"
+    "<table role='presentation' width='100%'><tr><td><h1>Thanks for your order!</h1>"
+    "<p>Order <b>#{ref}</b> placed on 4 Jul 2025</p></td></tr></table>"
+    "<table role='presentation' width='100%'>{rows}"
+    "<tr><td colspan='3'>Delivery fee</td><td>&#8377;25</td></tr>"
+    "<tr><td colspan='3'><b>Order total</b></td><td><b>&#8377;{total}</b></td></tr></table>"
+    "<p>Download our app for faster checkout.</p>"
+    "<img src='https://example.com/track.gif?id={ref}' width='1' height='1'>"
+    + FOOTER_HTML + "<script type='application/ld+json'>{{\"@context\": \"http://schema.org\"}}</script></body></html>"
+)
+
+
+def encode_body(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def build_corpus(size: int) -> list[dict]:
+    """Synthetic Gmail payloads, a third each of plain text alerts, html alerts and html order mails."""
+    payloads = []
+    for n in range(size):
+        amount = 50 + (n * 37) % 4000
+        ref = str(250000000000 + n)
+        if n % 3 == 0:
+            payloads.append({
+                "mimeType": "text/plain",
+                "body": {"data": encode_body(BANK_ALERT_TEXT.format(amount=amount, acct=1531, n=n, ref=ref))},
+            })
+        elif n % 3 == 1:
+            html = BANK_ALERT_HTML.format(amount=amount, acct=1531, n=n, ref=ref)
+            payloads.append({
+                "mimeType": "multipart/alternative",
+                "parts": [{"mimeType": "text/html", "body": {"data": encode_body(html)}}],
+            })
+        else:
+            rows = "".join(ORDER_ROW_HTML.format(i=i, qty=1 + i % 3, price=40 + i * 13) for i in range(3 + n % 12))
+            html = ORDER_HTML.format(ref=ref, rows=rows, total=amount + 25)
+            payloads.append({
+                "mimeType": "multipart/mixed",
+                "parts": [
+                    {"mimeType": "multipart/alternative", "parts": [{"mimeType": "text/html", "body": {"data": encode_body(html)}}]},
+                    {"mimeType": "application/pdf", "filename": "invoice.pdf", "body": {"attachmentId": "att1", "size": 52311}},
+                ],
+            })
+    return payloads
+
+
+def load_corpus(directory: str) -> list[dict]:
+    payloads = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as f:
+            payloads.append(json.load(f).get("payload", {}))
+    return payloads
+
+
+# Previous EmailManager implementation, kept here as the baseline
+def legacy_decode_base64url(data: str) -> str:
+    if not data:
+        return ""
+    return base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+
+
+def legacy_extract_body_from_payload(payload: dict) -> dict:
+    result = {"text": None, "html": None}
+    mime_type = payload.get("mimeType", "")
+    data = payload.get("body", {}).get("data")
+    if mime_type == "text/plain" and data:
+        result["text"] = legacy_decode_base64url(data)
+        return result
+    if mime_type == "text/html" and data:
+        result["html"] = legacy_decode_base64url(data)
+        return result
+    for part in payload.get("parts", []):
+        sub = legacy_extract_body_from_payload(part)
+        if sub["text"] and not result["text"]:
+            result["text"] = sub["text"]
+        if sub["html"] and not result["html"]:
+            result["html"] = sub["html"]
+        if result["text"]:
+            break
+    return result
+
+
+def legacy_html_to_text(html: str) -> str:
+    text = re.sub(r"<script.*?>.*?</script>", " ", html, flags=re.S)
+    text = re.sub(r"<style.*?>.*?</style>", " ", html, flags=re.S)
+    text = re.sub(r"<[^>]+>", " ", text)
+    text = re.sub(r"\s+", " ", text)
+    return text.strip()
+
+
+def legacy_extract_body_text(payload: dict) -> str:
+    bodies = legacy_extract_body_from_payload(payload)
+    if bodies["text"]:
+        return bodies["text"].strip()
+    if bodies["html"]:
+        return legacy_html_to_text(bodies["html"])
+    return ""
+
+
+def bench(extract, payloads: list[dict], rounds: int, repeats: int = 5) -> tuple[float, float]:
+    """Best of `repeats` timings in microseconds per message, and average characters of output."""
+    chars = sum(len(extract(payload)) for payload in payloads) / len(payloads)
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for _ in range(rounds):
+            for payload in payloads:
+                extract(payload)
+        best = min(best, (time.perf_counter() - start) / (rounds * len(payloads)))
+    return best * 1e6, chars
+
+
+def report(name: str, payloads: list[dict], rounds: int):
+    legacy_us, legacy_chars = bench(legacy_extract_body_text, payloads, rounds)
+    current_us, current_chars = bench(extract_body_text, payloads, rounds)
+    print(
+        f"{name:>12}: legacy {legacy_us:7.1f} us, {legacy_chars:6.0f} chars | "
+        f"current {current_us:7.1f} us, {current_chars:6.0f} chars | "
+        f"{legacy_us / current_us:.2f}x faster, {legacy_chars / max(current_chars, 1):.1f}x less text"
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark email body extraction")
+    parser.add_argument("--messages", type=int, default=300)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--corpus", help="Directory of Gmail message JSON files to benchmark instead of the synthetic corpus")
+    args = parser.parse_args()
+
+    if args.corpus:
+        payloads = load_corpus(args.corpus)
+        print(f"{len(payloads)} messages from {args.corpus}, {args.rounds} rounds")
+        report("corpus", payloads, args.rounds)
+    else:
+        payloads = build_corpus(args.messages)
+        print(f"{len(payloads)} synthetic messages, {args.rounds} rounds")
+        report("text alerts", payloads[0::3], args.rounds)
+        report("html alerts", payloads[1::3], args.rounds)
+        report("html orders", payloads[2::3], args.rounds)
+        report("all", payloads, args.rounds)
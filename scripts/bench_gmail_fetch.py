@@ -0,0 +1,87 @@
+"""
+Benchmark serial vs batched Gmail message retrieval against the local fake Gmail server.
+Needs the worker environment (.env) to be present, same as running the worker locally.
+
+Usage: python scripts/bench_gmail_fetch.py --messages 500 --page-size 100 --latency-ms 80
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+# Add project root to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httplib2
+import googleapiclient.discovery_cache
+from googleapiclient.discovery import build_from_document
+
+from scripts.fake_gmail_server import start_server
+from worker.connectors import ENV_SETTINGS
+from worker.operations import EmailManager
+
+
+def build_fake_gmail_service(base_url: str):
+    """Build a Gmail Resource from the bundled discovery document pointed at the fake server."""
+    documents_dir = os.path.join(os.path.dirname(googleapiclient.discovery_cache.__file__), "documents")
+    with open(os.path.join(documents_dir, "gmail.v1.json")) as f:
+        discovery = json.load(f)
+    discovery["rootUrl"] = base_url
+    discovery["baseUrl"] = base_url
+    return build_from_document(discovery, http=httplib2.Http())
+
+
+def run_sync(email_manager: EmailManager, page_size: int) -> int:
+    next_page_token = None
+    fetched = 0
+    while True:
+        messages, next_page_token = email_manager.fetch_emails_messages_list("after:0", next_page_token, max_results=page_size)
+        fetched += len(messages)
+        if not next_page_token:
+            break
+    return fetched
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Gmail fetch modes")
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--latency-ms", type=float, default=80)
+    parser.add_argument("--item-ms", type=float, default=2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = start_server(
+        messages=args.messages,
+        latency_ms=args.latency_ms,
+        item_ms=args.item_ms,
+        failure_rate=args.failure_rate,
+    )
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/"
+    ENV_SETTINGS.GMAIL_BATCH_SIZE = args.batch_size
+
+    for mode in ["serial", "batch"]:
+        ENV_SETTINGS.GMAIL_FETCH_MODE = mode
+        for key in server.stats:
+            server.stats[key] = 0
+
+        email_manager = EmailManager(
+            gmail_service=build_fake_gmail_service(base_url),
+            email="me@example.com",
+            userId="bench-user",
+            accountId="bench-account",
+        )
+        start = time.perf_counter()
+        fetched = run_sync(email_manager, args.page_size)
+        elapsed = time.perf_counter() - start
+
+        print(
+            f"{mode:>6}: {fetched} messages in {elapsed:.2f}s "
+            f"({fetched / elapsed:.0f} msg/s), {server.stats['http_requests']} HTTP requests, "
+            f"{server.stats['injected_failures']} injected failures"
+        )
+
+    server.shutdown()
@@ -0,0 +1,256 @@
+"""
+Local stand-in for the parts of the Gmail REST API used by the sync worker.
+Serves synthetic bank alert and order receipt messages so Gmail fetching can be
+benchmarked offline, including the multipart batch endpoint.
+
+Usage: python scripts/fake_gmail_server.py --port 8765 --messages 500 --latency-ms 80
+"""
+
+import argparse
+import base64
+import json
+import random
+import threading
+import time
+import urllib.parse
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+BANK_ALERT = (
+    "Dear Customer, Rs.{amount}.00 has been debited from account 1531 to VPA "
+    "merchant{n}@ybl MERCHANT {n} on 04-07-25. Your UPI transaction reference number is {ref}."
+)
+
+ORDER_HTML = (
+    "<html><head><style>td {{ padding: 4px; }}</style></head><body>"
+    "<h1>Your order #{ref} is confirmed</h1>"
+    "<table><tr><td>Item {n}</td><td>1</td><td>Rs. {amount}</td></tr>"
+    "<tr><td>Delivery fee</td><td></td><td>Rs. 25</td></tr></table>"
+    "<p>Total: Rs. {total}</p><p>Unsubscribe | Privacy Policy</p></body></html>"
+)
+
+
+def encode_body(text: str) -> str:
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def build_message(n: int, history_id: int) -> dict:
+    """Build a synthetic Gmail message resource in `format=full` shape."""
+    amount = 50 + (n * 37) % 4000
+    ref = str(250000000000 + n)
+    received_ms = int((time.time() - n * 60) * 1000)
+    if n % 3 == 0:
+        html = ORDER_HTML.format(ref=ref, n=n, amount=amount, total=amount + 25)
+        payload = {
+            "mimeType": "multipart/alternative",
+            "headers": [
+                {"name": "From", "value": "Shop Orders <orders@shop.example.com>"},
+                {"name": "Subject", "value": f"Your order #{ref} is confirmed"},
+            ],
+            "parts": [
+                {"mimeType": "text/html", "body": {"data": encode_body(html), "size": len(html)}},
+            ],
+        }
+        snippet = f"Your order #{ref} is confirmed Item {n} Rs. {amount}"
+    else:
+        text = BANK_ALERT.format(amount=amount, n=n, ref=ref)
+        payload = {
+            "mimeType": "text/plain",
+            "headers": [
+                {"name": "From", "value": "HDFC Bank InstaAlerts <alerts@hdfcbank.net>"},
+                {"name": "Subject", "value": "You have done a UPI txn. Check details!"},
+            ],
+            "body": {"data": encode_body(text), "size": len(text)},
+        }
+        snippet = text[:200]
+    return {
+        "id": f"msg{n:06d}",
+        "threadId": f"thr{n:06d}",
+        "labelIds": ["INBOX"],
+        "snippet": snippet,
+        "historyId": str(history_id + n),
+        "internalDate": str(received_ms),
+        "payload": payload,
+        "sizeEstimate": len(json.dumps(payload)),
+    }
+
+
+class FakeGmailServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, messages: int, latency_ms: float, item_ms: float, failure_rate: float):
+        super().__init__(address, FakeGmailHandler)
+        self.history_id = 100000
+        self.messages = [build_message(n, self.history_id) for n in range(messages)]
+        self.messages_by_id = {msg["id"]: msg for msg in self.messages}
+        self.latency_seconds = latency_ms / 1000
+        self.item_seconds = item_ms / 1000
+        self.failure_rate = failure_rate
+        self.stats_lock = threading.Lock()
+        self.stats = {"http_requests": 0, "batch_requests": 0, "message_gets": 0, "injected_failures": 0, "bytes_sent": 0}
+
+    def count(self, key: str, value: int = 1):
+        with self.stats_lock:
+            self.stats[key] += value
+
+
+class FakeGmailHandler(BaseHTTPRequestHandler):
+    server: FakeGmailServer
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict):
+        data = json.dumps(body).encode("utf-8")
+        self.server.count("bytes_sent", len(data))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=UTF-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def route_get(self, path: str, params: dict) -> tuple[int, dict]:
+        """Resolve a Gmail API GET and return (status, json body)."""
+        parts = path.strip("/").split("/")
+        # gmail/v1/users/me/<resource>[/<id>]
+        if parts[:4] != ["gmail", "v1", "users", "me"] or len(parts) < 5:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+        if parts[4] == "profile":
+            return 200, {"emailAddress": "me@example.com", "historyId": str(self.server.history_id + len(self.server.messages))}
+
+        if parts[4] == "history":
+            start_history_id = int(params.get("startHistoryId", ["0"])[0])
+            if start_history_id < self.server.history_id:
+                return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+            max_results = int(params.get("maxResults", ["100"])[0])
+            offset = int(params.get("pageToken", ["0"])[0])
+            added = [msg for msg in self.server.messages if int(msg["historyId"]) > start_history_id]
+            page = added[offset:offset + max_results]
+            body = {
+                "history": [
+                    {
+                        "id": msg["historyId"],
+                        "messagesAdded": [{"message": {"id": msg["id"], "threadId": msg["threadId"], "labelIds": msg["labelIds"]}}],
+                    }
+                    for msg in page
+                ],
+                "historyId": str(self.server.history_id + len(self.server.messages)),
+            }
+            if offset + max_results < len(added):
+                body["nextPageToken"] = str(offset + max_results)
+            return 200, body
+
+        if parts[4] != "messages":
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+        if len(parts) == 5:
+            max_results = int(params.get("maxResults", ["100"])[0])
+            offset = int(params.get("pageToken", ["0"])[0])
+            page = self.server.messages[offset:offset + max_results]
+            body = {
+                "messages": [{"id": msg["id"], "threadId": msg["threadId"]} for msg in page],
+                "resultSizeEstimate": len(page),
+            }
+            if offset + max_results < len(self.server.messages):
+                body["nextPageToken"] = str(offset + max_results)
+            return 200, body
+
+        self.server.count("message_gets")
+        if self.server.item_seconds:
+            time.sleep(self.server.item_seconds)
+        if self.server.failure_rate and random.random() < self.server.failure_rate:
+            self.server.count("injected_failures")
+            return 429, {"error": {"code": 429, "message": "Too many concurrent requests for user"}}
+        msg = self.server.messages_by_id.get(parts[5])
+        if msg is None:
+            return 404, {"error": {"code": 404, "message": "Requested entity was not found."}}
+        if params.get("format", ["full"])[0] == "metadata":
+            wanted = {name.lower() for name in params.get("metadataHeaders", [])}
+            headers = [h for h in msg["payload"]["headers"] if not wanted or h["name"].lower() in wanted]
+            return 200, {
+                "id": msg["id"],
+                "threadId": msg["threadId"],
+                "snippet": msg["snippet"],
+                "internalDate": msg["internalDate"],
+                "payload": {"headers": headers},
+            }
+        return 200, msg
+
+    def do_GET(self):
+        self.server.count("http_requests")
+        time.sleep(self.server.latency_seconds)
+        parsed = urllib.parse.urlparse(self.path)
+        status, body = self.route_get(parsed.path, urllib.parse.parse_qs(parsed.query))
+        self.send_json(status, body)
+
+    def do_POST(self):
+        self.server.count("http_requests")
+        time.sleep(self.server.latency_seconds)
+        if not self.path.startswith("/batch"):
+            self.send_json(404, {"error": {"code": 404, "message": "Not Found"}})
+            return
+        self.server.count("batch_requests")
+
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        header = f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode("utf-8")
+        multipart = BytesParser(policy=HTTP).parsebytes(header + raw)
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        chunks = []
+        for part in multipart.iter_parts():
+            content_id = part["Content-ID"].strip()[1:-1]
+            request_line = part.get_payload().splitlines()[0]
+            method, target, _ = request_line.split(" ", 2)
+            parsed = urllib.parse.urlparse(target)
+            if method == "GET":
+                status, body = self.route_get(parsed.path, urllib.parse.parse_qs(parsed.query))
+            else:
+                status, body = 405, {"error": {"code": 405, "message": "Method Not Allowed"}}
+            reason = {200: "OK", 404: "Not Found", 405: "Method Not Allowed", 429: "Too Many Requests"}[status]
+            chunks.append(
+                f"--{boundary}\r\n"
+                "Content-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {reason}\r\n"
+                "Content-Type: application/json; charset=UTF-8\r\n\r\n"
+                f"{json.dumps(body)}\r\n"
+            )
+        chunks.append(f"--{boundary}--\r\n")
+        data = "".join(chunks).encode("utf-8")
+        self.server.count("bytes_sent", len(data))
+
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/mixed; boundary={boundary}")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def start_server(port: int = 0, messages: int = 500, latency_ms: float = 80, item_ms: float = 2, failure_rate: float = 0.0) -> FakeGmailServer:
+    """Start the fake server on a background thread and return it."""
+    server = FakeGmailServer(("127.0.0.1", port), messages, latency_ms, item_ms, failure_rate)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Gmail API server")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--messages", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=80, help="Simulated round trip per HTTP request")
+    parser.add_argument("--item-ms", type=float, default=2, help="Simulated server time per message get")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of message gets answered with 429")
+    args = parser.parse_args()
+
+    server = FakeGmailServer(("127.0.0.1", args.port), args.messages, args.latency_ms, args.item_ms, args.failure_rate)
+    print(f"Fake Gmail API listening on http://127.0.0.1:{args.port}/ with {args.messages} messages")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
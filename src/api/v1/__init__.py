@@ -1,5 +1,5 @@
 from fastapi import APIRouter
-from src.api.v1 import emails, admin, users, transactions, analytics, accounts, orders, chotu, budgets
+from src.api.v1 import emails, admin, users, transactions, analytics, accounts, orders, chotu, budgets, ingest
 
 api_router = APIRouter()
 api_router.include_router(emails.router, prefix="/emails", tags=["emails"])
@@ -10,4 +10,5 @@ api_router.include_router(transactions.router)
 api_router.include_router(analytics.router)
 api_router.include_router(orders.router)
 api_router.include_router(chotu.router)
-api_router.include_router(budgets.router)
\ No newline at end of file
+api_router.include_router(budgets.router)
+api_router.include_router(ingest.router)
@@ -1,8 +1,18 @@
 from fastapi.responses import JSONResponse
 from src.modules.users.operations import generateGmailAccessUrl
-from src.modules.accounts.models import AccountUpdatePayload
-from src.modules.accounts.operations import releaseSyncLock, updateAccountById
+from src.modules.accounts.models import AccountUpdatePayload, BackfillClaimPayload, BackfillPayload, SyncCheckpointPayload
+from src.modules.accounts.operations import (
+    claimBackfill,
+    deleteSyncCheckpoint,
+    getBackfill,
+    getSyncCheckpoint,
+    releaseSyncLock,
+    saveBackfill,
+    saveSyncCheckpoint,
+    updateAccountById,
+)
 from src.modules.accounts.schema import AccountsORM
+from src.modules.transactions.operations import get_account_financial_senders, get_global_financial_senders
 from fastapi import APIRouter, Depends
 from src.core.database import get_db
 from sqlalchemy.orm import Session
@@ -75,6 +85,166 @@ async def unlock_sync_route(id: str, db: Session = Depends(get_db)):
             content={"message": "Failed to release sync lock", "error": str(e)}
         )
 
+@router.get("/{id}/sync-checkpoint")
+async def get_sync_checkpoint_route(id: str, db: Session = Depends(get_db)):
+    """Checkpoint of an interrupted sync, the worker resumes from it instead of starting over."""
+    try:
+        checkpoint = getSyncCheckpoint(id, db)
+        if not checkpoint:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "No sync checkpoint for account"}
+            )
+        return {
+            "query": checkpoint.query,
+            "startHistoryId": checkpoint.start_history_id,
+            "syncHistoryId": checkpoint.sync_history_id,
+            "pageToken": checkpoint.page_token,
+            "listingComplete": checkpoint.listing_complete,
+            "watermark": checkpoint.watermark.isoformat() if checkpoint.watermark else None,
+            "inFlightIds": checkpoint.in_flight_ids,
+            "pagesCommitted": checkpoint.pages_committed,
+            "updatedAt": checkpoint.updated_at.isoformat(),
+        }
+    except Exception as e:
+        logger.exception(f"Error fetching sync checkpoint for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to fetch sync checkpoint", "error": str(e)}
+        )
+
+@router.put("/{id}/sync-checkpoint")
+async def save_sync_checkpoint_route(id: str, payload: SyncCheckpointPayload, db: Session = Depends(get_db)):
+    """Store the progress of a running sync, written by the worker after every stored page."""
+    try:
+        account = db.query(AccountsORM).filter(AccountsORM.id == id).first()
+        if not account:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "Account not found"}
+            )
+
+        saveSyncCheckpoint(id, payload, db)
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Sync checkpoint saved", "pagesCommitted": payload.pagesCommitted}
+        )
+    except Exception as e:
+        logger.exception(f"Error saving sync checkpoint for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to save sync checkpoint", "error": str(e)}
+        )
+
+@router.delete("/{id}/sync-checkpoint")
+async def delete_sync_checkpoint_route(id: str, db: Session = Depends(get_db)):
+    """Drop the checkpoint once a sync has completed."""
+    try:
+        deleted = deleteSyncCheckpoint(id, db)
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Sync checkpoint deleted" if deleted else "No sync checkpoint for account"}
+        )
+    except Exception as e:
+        logger.exception(f"Error deleting sync checkpoint for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to delete sync checkpoint", "error": str(e)}
+        )
+
+@router.post("/{id}/backfill")
+async def claim_backfill_route(id: str, payload: BackfillClaimPayload, db: Session = Depends(get_db)):
+    """Lock the onboarding backfill of an account to one task, a retry of that task resumes the months it submitted."""
+    try:
+        account = db.query(AccountsORM).filter(AccountsORM.id == id).first()
+        if not account:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "Account not found"}
+            )
+
+        backfill = claimBackfill(id, payload.owner, payload.leaseSeconds, db)
+        if not backfill:
+            return JSONResponse(
+                status_code=409,
+                content={"message": "Backfill already started for account"}
+            )
+        return {
+            "state": backfill.state,
+            "jobs": backfill.jobs,
+            "updatedAt": backfill.updated_at.isoformat(),
+        }
+    except Exception as e:
+        logger.exception(f"Error claiming backfill for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to claim backfill", "error": str(e)}
+        )
+
+@router.get("/{id}/backfill")
+async def get_backfill_route(id: str, db: Session = Depends(get_db)):
+    """Submitted months of the backfill, read by the worker task polling their batch jobs."""
+    try:
+        backfill = getBackfill(id, db)
+        if not backfill:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "No backfill for account"}
+            )
+        return {
+            "state": backfill.state,
+            "jobs": backfill.jobs,
+            "updatedAt": backfill.updated_at.isoformat(),
+        }
+    except Exception as e:
+        logger.exception(f"Error fetching backfill for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to fetch backfill", "error": str(e)}
+        )
+
+@router.put("/{id}/backfill")
+async def save_backfill_route(id: str, payload: BackfillPayload, db: Session = Depends(get_db)):
+    """Store the backfill progress, written by the worker after every submitted or ingested month."""
+    try:
+        if not saveBackfill(id, payload, db):
+            return JSONResponse(
+                status_code=404,
+                content={"message": "No backfill for account"}
+            )
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Backfill saved", "state": payload.state}
+        )
+    except Exception as e:
+        logger.exception(f"Error saving backfill for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to save backfill", "error": str(e)}
+        )
+
+@router.get("/{id}/financial-senders")
+async def get_financial_senders_route(id: str, db: Session = Depends(get_db)):
+    """Senders known to send transaction or order mails, used by the worker to narrow Gmail queries."""
+    try:
+        account = db.query(AccountsORM).filter(AccountsORM.id == id).first()
+        if not account:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "Account not found"}
+            )
+
+        return {
+            "accountSenders": get_account_financial_senders(id, db),
+            "globalSenders": get_global_financial_senders(db),
+        }
+    except Exception as e:
+        logger.exception(f"Error fetching financial senders for account {id}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to fetch financial senders", "error": str(e)}
+        )
+
 @router.get("/{id}/gmail-access-url", response_model=dict)
 async def get_refresh_token_route(id: str, db: Session = Depends(get_db)):
     """Get the Gmail refresh token for the account."""
@@ -1,16 +1,25 @@
 from fastapi import APIRouter
 from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
-from sqlalchemy.dialects.postgresql import insert
 from fastapi import Depends
 from src.modules.accounts.schema import AccountsORM
-from src.modules.accounts.operations import getAccountById
+from src.modules.accounts.operations import getAccountById, setSyncLock, releaseSyncLock
 from src.modules.users.operations import fetchUserById
-from src.modules.emails.model import EmailBulkInsertPayload, EmailMessageORM
+from src.modules.emails.model import (
+    DeadLetterReplayPayload,
+    EmailBulkInsertPayload,
+    EmailExistencePayload,
+    EmailExtractionStatusPayload,
+)
+from src.modules.emails.operations import getExistingEmailStatuses, getFailedEmails, insertEmails, updateExtractionStatus
 from src.core.database import get_db
+from src.core.environment import ENV_SETTINGS
+from src.utils.common import enqueue_worker_task
+from packages.models import TaskQueuePayload
+from src.utils.compression import MsgpackRoute
 from src.utils.log import setup_logger
 
-router = APIRouter()
+router = APIRouter(route_class=MsgpackRoute)
 logger = setup_logger(__name__)
 
 @router.get("/")
@@ -50,36 +59,8 @@ async def insert_bulk_emails(payload: EmailBulkInsertPayload, db: Session = Depe
             }
         )
 
-        # Create ORM objects for type safety
-        email_orm_list = []
-        for email in payload.emails:
-            email_orm = EmailMessageORM(
-                thread_id=email.threadId,
-                id=email.id,
-                snippet=email.snippet,
-                date_time=email.receivedAt,
-                emailSender=email.emailSender,
-                emailId=email.emailId,
-                accountId=payload.accountId,
-            )
-            email_orm_list.append(email_orm)
-        
-        # Convert ORM objects to dictionaries for bulk insert
-        email_data = []
-        for orm_obj in email_orm_list:
-            obj_dict = {}
-            for col in EmailMessageORM.__table__.columns:
-                obj_dict[col.name] = getattr(orm_obj, col.name)
-            email_data.append(obj_dict)
-        
-        # Use PostgreSQL's ON CONFLICT DO NOTHING to skip duplicates
-        stmt = insert(EmailMessageORM).values(email_data)
-        stmt = stmt.on_conflict_do_nothing(index_elements=['id'])
-        
-        result = db.execute(stmt)
+        inserted_count = insertEmails(payload.accountId, payload.emails, db)
         db.commit()
-        
-        inserted_count = result.rowcount
         skipped_count = len(payload.emails) - inserted_count
 
         logger.info(
@@ -88,7 +69,7 @@ async def insert_bulk_emails(payload: EmailBulkInsertPayload, db: Session = Depe
                 "inserted_count": inserted_count,
                 "skipped_count": skipped_count,
                 "total_count": len(payload.emails),
-                "email_id": email.emailId,
+                "email_id": payload.emailId,
                 "account_id": payload.accountId,
                 "user_id": payload.userId
             }
@@ -108,4 +89,127 @@ async def insert_bulk_emails(payload: EmailBulkInsertPayload, db: Session = Depe
         return JSONResponse(
             status_code=500,
             content={"message": "Failed to insert bulk emails", "error": str(e)}
-        )
\ No newline at end of file
+        )
+
+
+@router.post("/existing")
+async def get_existing_emails(payload: EmailExistencePayload, db: Session = Depends(get_db)):
+    """Return which of the given Gmail message ids are already stored, with their extraction status"""
+    try:
+        statuses = getExistingEmailStatuses(payload.accountId, payload.ids, db)
+        logger.info(
+            f"{len(statuses)}/{len(payload.ids)} emails already stored",
+            extra={"account_id": payload.accountId, "existing_count": len(statuses), "total_count": len(payload.ids)}
+        )
+        return JSONResponse(
+            status_code=200,
+            content={
+                "emails": [{"id": id, "extraction_status": status} for id, status in statuses.items()],
+                "total": len(statuses)
+            }
+        )
+    except Exception as e:
+        logger.exception(f"Error checking existing emails: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to check existing emails", "error": str(e)}
+        )
+
+
+@router.post("/extraction-status")
+async def update_extraction_status(payload: EmailExtractionStatusPayload, db: Session = Depends(get_db)):
+    """Record which emails were extracted and which failed, failed emails form the dead letter store"""
+    try:
+        parsed_count, failed_count = updateExtractionStatus(payload.accountId, payload.parsed, payload.failed, db)
+        db.commit()
+        logger.info(
+            f"Updated extraction status of {parsed_count} parsed and {failed_count} failed emails",
+            extra={"account_id": payload.accountId, "parsed_count": parsed_count, "failed_count": failed_count}
+        )
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Extraction status updated", "parsed": parsed_count, "failed": failed_count}
+        )
+    except Exception as e:
+        logger.exception(f"Error updating extraction status: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to update extraction status", "error": str(e)}
+        )
+
+
+@router.get("/dead-letter")
+async def get_dead_letter_emails(accountId: str, limit: int = None, db: Session = Depends(get_db)):
+    """List the emails of an account whose extraction failed and can still be replayed"""
+    try:
+        emails = getFailedEmails(accountId, ENV_SETTINGS.EXTRACTION_MAX_ATTEMPTS, db, limit)
+        return JSONResponse(
+            status_code=200,
+            content={
+                "emails": [
+                    {"id": email.id, "attempts": email.extraction_attempts, "error": email.extraction_error}
+                    for email in emails
+                ],
+                "total": len(emails)
+            }
+        )
+    except Exception as e:
+        logger.exception(f"Error fetching dead letter emails: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to fetch dead letter emails", "error": str(e)}
+        )
+
+
+@router.post("/dead-letter/replay")
+async def replay_dead_letter_emails(payload: DeadLetterReplayPayload, db: Session = Depends(get_db)):
+    """Reprocess only the failed emails of an account instead of re-syncing their whole window"""
+    try:
+        account: AccountsORM = getAccountById(payload.accountId, db)
+        if not account:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "Account not found"}
+            )
+        if not account.gmailRefreshToken:
+            return JSONResponse(
+                status_code=400,
+                content={"message": "Account does not have Gmail connected"}
+            )
+
+        failed_emails = getFailedEmails(payload.accountId, ENV_SETTINGS.EXTRACTION_MAX_ATTEMPTS, db)
+        if not failed_emails:
+            return JSONResponse(
+                status_code=200,
+                content={"message": "No failed emails to replay", "total": 0}
+            )
+
+        if not setSyncLock(payload.accountId, db):
+            return JSONResponse(
+                status_code=409,
+                content={"message": "Account is already syncing"}
+            )
+
+        try:
+            task: TaskQueuePayload = TaskQueuePayload(
+                email=account.emailId,
+                userId=str(account.userId),
+                accountId=str(account.id),
+                token=account.gmailRefreshToken
+            )
+            enqueue_worker_task(task.model_dump(), path="/tasks/replay-failed")
+        except Exception:
+            releaseSyncLock(payload.accountId, db)
+            raise
+
+        logger.info(f"Replay triggered for {len(failed_emails)} failed emails of account {payload.accountId}")
+        return JSONResponse(
+            status_code=200,
+            content={"message": "Replay triggered", "total": len(failed_emails)}
+        )
+    except Exception as e:
+        logger.exception(f"Error replaying dead letter emails: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to replay dead letter emails", "error": str(e)}
+        )
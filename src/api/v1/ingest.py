@@ -0,0 +1,57 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import JSONResponse
+from sqlalchemy.orm import Session
+
+from src.core.database import get_db
+from src.modules.accounts.operations import getAccountById
+from src.modules.ingest.models import IngestBatchPayload
+from src.modules.ingest.operations import ingestBatch
+from src.utils.compression import MsgpackRoute
+from src.utils.log import setup_logger
+
+router = APIRouter(prefix="/ingest", tags=["ingest"], route_class=MsgpackRoute)
+logger = setup_logger(__name__)
+
+
+@router.post("/batch")
+async def ingest_batch(payload: IngestBatchPayload, db: Session = Depends(get_db)):
+    """
+    Store the emails, transactions, orders and extraction status of one sync page in a single transaction.
+    Either everything of the page is stored or nothing is, so a retried page never leaves emails without their transactions.
+    """
+    try:
+        account = getAccountById(payload.accountId, db)
+        if not account or str(account.userId) != payload.userId:
+            return JSONResponse(
+                status_code=404,
+                content={"message": "Account not found"}
+            )
+
+        counts = ingestBatch(
+            payload.userId,
+            payload.accountId,
+            payload.emails,
+            payload.transactions,
+            payload.orders,
+            payload.parsed,
+            payload.failed,
+            payload.lastSyncedAt,
+            db,
+        )
+        db.commit()
+
+        logger.info(
+            f"Ingested batch of {len(payload.emails)} emails, {len(payload.transactions)} transactions and {len(payload.orders)} orders",
+            extra={"account_id": payload.accountId, "user_id": payload.userId, "counts": counts}
+        )
+        return JSONResponse(
+            status_code=200,
+            content={"status": "completed", **counts}
+        )
+    except Exception as e:
+        db.rollback()
+        logger.exception(f"Error ingesting batch for accountId {payload.accountId}: {e}")
+        return JSONResponse(
+            status_code=500,
+            content={"message": "Failed to ingest batch", "error": str(e)}
+        )
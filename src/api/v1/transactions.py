@@ -1,16 +1,16 @@
 from fastapi.responses import JSONResponse
 from packages.models import TransactionBulkInsertPayload
-from src.modules.transactions.schema import TransactionORM
+from src.modules.transactions.operations import insertTransactions
 from fastapi import APIRouter, Depends
 from fastapi.security import HTTPBasic
 
 from src.core.database import get_db
 from sqlalchemy.orm import Session
-from sqlalchemy.dialects.postgresql import insert
 
+from src.utils.compression import MsgpackRoute
 from src.utils.log import setup_logger
 
-router = APIRouter(prefix="/transactions", tags=["transactions"])
+router = APIRouter(prefix="/transactions", tags=["transactions"], route_class=MsgpackRoute)
 security = HTTPBasic()
 
 logger = setup_logger(__name__)
@@ -36,52 +36,11 @@ async def bulk_insert_transactions(transactionsPayload: TransactionBulkInsertPay
             }
         )
         
-        # Create ORM objects for type safety
-        txn_orm_list = []
-        failed_count = 0
-        for idx, transaction in enumerate(transactionsPayload.transactions):
-            try:
-                txn = TransactionORM(
-                    id=transaction.id, 
-                    amount=transaction.amount,
-                    transaction_type=transaction.transaction_type,
-                    source_identifier=transaction.source_identifier,
-                    destination=transaction.destination,
-                    mode=transaction.mode,
-                    reference_number=transaction.reference_number,
-                    email_sender=transaction.emailSender,
-                    email_id=transaction.emailId,
-                    date_time=transaction.date_time,
-                    user_id=transactionsPayload.userId,
-                    account_id=transactionsPayload.accountId,
-                    is_include_analytics=True
-                )
-                txn_orm_list.append(txn)
-            except Exception as e:
-                failed_count += 1
-                logger.warning(f"Failed to process transaction at index {idx}: {e}. Failed transaction ID: {transaction.id}")
-        
-        inserted_count = 0
-        skipped_count = 0
-        
-        if txn_orm_list:
-            # Convert ORM objects to dictionaries for bulk insert
-            txn_data = []
-            for orm_obj in txn_orm_list:
-                obj_dict = {}
-                for col in TransactionORM.__table__.columns:
-                    obj_dict[col.name] = getattr(orm_obj, col.name)
-                txn_data.append(obj_dict)
-            
-            # Use PostgreSQL's ON CONFLICT DO NOTHING to skip duplicates
-            stmt = insert(TransactionORM).values(txn_data)
-            stmt = stmt.on_conflict_do_nothing(index_elements=['id'])
-            
-            result = db.execute(stmt)
-            db.commit()
-            
-            inserted_count = result.rowcount
-            skipped_count = len(txn_orm_list) - inserted_count
+        inserted_count, failed_count = insertTransactions(
+            transactionsPayload.userId, transactionsPayload.accountId, transactionsPayload.transactions, db
+        )
+        db.commit()
+        skipped_count = len(transactionsPayload.transactions) - failed_count - inserted_count
         
         logger.info(
             f"Inserted {inserted_count} transactions, skipped {skipped_count} duplicates, failed {failed_count}",
@@ -13,6 +13,7 @@ from fastapi.security import HTTPBasic
 from src.core.database import get_db
 from sqlalchemy.orm import Session
 
+from src.core.environment import ENV_SETTINGS
 from src.utils.common import enqueue_worker_task
 from src.utils.log import setup_logger
 
@@ -202,6 +203,10 @@ async def scrapeEmailsRoute(id: str, db: Session = Depends(get_db)):
                 )
                 enqueue_worker_task(payload.model_dump())
                 logger.info(f"Sync triggered for account {account.id}")
+                # The first sync only looks back a week, older history is backfilled through batch prediction
+                if ENV_SETTINGS.BACKFILL_ON_FIRST_SYNC and not account.lastSyncedAt:
+                    enqueue_worker_task(payload.model_dump(), path="/tasks/backfill")
+                    logger.info(f"Backfill triggered for account {account.id}")
             except Exception as e:
                 logger.exception(f"Error enqueuing sync for account {account.id}: {e}")
                 releaseSyncLock(str(account.id), db)
@@ -13,6 +13,9 @@ class Settings(BaseSettings):
     LANGSMITH_API_KEY: str
     LANGSMITH_PROJECT: str = "MoneyBhai"
     LANGSMITH_TRACING: bool = True
+    BACKFILL_ON_FIRST_SYNC: bool = True
+    EXTRACTION_MAX_ATTEMPTS: int = 5
+    BULK_COPY_MIN_ROWS: int = 1000  # bulk inserts of at least this many rows go through COPY, 0 disables
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
@@ -4,6 +4,32 @@ from typing import Optional
 
 class AccountUpdatePayload(BaseModel):
     lastSyncedAt: Optional[datetime] = None
+    historyId: Optional[str] = None
     isSyncing: Optional[bool] = None
     gmailRefreshToken: Optional[str] = None
     gmailRefreshTokenCreatedAt: Optional[datetime] = None
+
+class SyncCheckpointPayload(BaseModel):
+    query: Optional[str] = None
+    startHistoryId: Optional[str] = None
+    syncHistoryId: Optional[str] = None
+    pageToken: Optional[str] = None
+    listingComplete: bool = False
+    watermark: Optional[datetime] = None
+    inFlightIds: list[str] = []
+    pagesCommitted: int = 0
+
+class BackfillClaimPayload(BaseModel):
+    owner: str
+    leaseSeconds: int
+
+class BackfillJobPayload(BaseModel):
+    label: str
+    name: Optional[str] = None
+    emailsUri: Optional[str] = None
+    requestCount: int = 0
+    state: str = "submitted"
+
+class BackfillPayload(BaseModel):
+    state: str
+    jobs: list[BackfillJobPayload] = []
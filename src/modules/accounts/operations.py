@@ -1,5 +1,8 @@
-from datetime import datetime, timezone
-from src.modules.accounts.schema import AccountsORM
+from datetime import datetime, timedelta, timezone
+from src.modules.accounts.models import BackfillPayload, SyncCheckpointPayload
+from src.modules.accounts.schema import AccountsORM, BackfillORM, SyncCheckpointORM
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.orm import Session
 
 from src.utils.log import setup_logger
@@ -70,4 +73,75 @@ def releaseSyncLock(accountId: str, db: Session) -> bool:
     account.isSyncing = False
     db.commit()
     logger.info(f"Sync lock released for account {accountId}.")
-    return True
\ No newline at end of file
+    return True
+
+def advanceLastSyncedAt(accountId: str, lastSyncedAt: datetime, db: Session) -> None:
+    """Move lastSyncedAt forward to the given time, never backwards. The caller commits."""
+    db.query(AccountsORM).filter(AccountsORM.id == accountId).update(
+        {AccountsORM.lastSyncedAt: func.greatest(func.coalesce(AccountsORM.lastSyncedAt, lastSyncedAt), lastSyncedAt)},
+        synchronize_session=False,
+    )
+
+
+def getSyncCheckpoint(accountId: str, db: Session) -> SyncCheckpointORM | None:
+    return db.query(SyncCheckpointORM).filter(SyncCheckpointORM.account_id == accountId).first()
+
+def saveSyncCheckpoint(accountId: str, payload: SyncCheckpointPayload, db: Session) -> None:
+    """Insert or replace the sync checkpoint of the account in one statement."""
+    values = {
+        "query": payload.query,
+        "start_history_id": payload.startHistoryId,
+        "sync_history_id": payload.syncHistoryId,
+        "page_token": payload.pageToken,
+        "listing_complete": payload.listingComplete,
+        "watermark": payload.watermark,
+        "in_flight_ids": payload.inFlightIds,
+        "pages_committed": payload.pagesCommitted,
+        "updated_at": datetime.now(),
+    }
+    stmt = insert(SyncCheckpointORM).values(account_id=accountId, **values)
+    db.execute(stmt.on_conflict_do_update(index_elements=["account_id"], set_=values))
+    db.commit()
+
+def deleteSyncCheckpoint(accountId: str, db: Session) -> bool:
+    deleted = db.query(SyncCheckpointORM).filter(SyncCheckpointORM.account_id == accountId).delete()
+    db.commit()
+    return deleted > 0
+
+
+def getBackfill(accountId: str, db: Session) -> BackfillORM | None:
+    return db.query(BackfillORM).filter(BackfillORM.account_id == accountId).first()
+
+def claimBackfill(accountId: str, owner: str, leaseSeconds: int, db: Session) -> BackfillORM | None:
+    """
+    Start the backfill of the account. A retry of the owning task gets it back, and another task takes over
+    one that is still submitting when its owner has not written for leaseSeconds.
+    Returns None when another task holds the backfill or the account was backfilled already.
+    """
+    now = datetime.now()
+    stmt = insert(BackfillORM).values(account_id=accountId, state="submitting", owner=owner, jobs=[], created_at=now, updated_at=now)
+    # One statement, two tasks claiming at the same time cannot both win
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["account_id"],
+        set_={"owner": owner, "updated_at": now},
+        where=(BackfillORM.owner == owner)
+        | ((BackfillORM.state == "submitting") & (BackfillORM.updated_at < now - timedelta(seconds=leaseSeconds))),
+    ).returning(BackfillORM.account_id)
+    claimed = db.execute(stmt).scalar_one_or_none()
+    db.commit()
+    if claimed is None:
+        logger.info(f"Backfill of account {accountId} is already claimed.")
+        return None
+    return getBackfill(accountId, db)
+
+def saveBackfill(accountId: str, payload: BackfillPayload, db: Session) -> bool:
+    updated = db.query(BackfillORM).filter(BackfillORM.account_id == accountId).update(
+        {
+            BackfillORM.state: payload.state,
+            BackfillORM.jobs: [job.model_dump() for job in payload.jobs],
+            BackfillORM.updated_at: datetime.now(),
+        },
+        synchronize_session=False,
+    )
+    db.commit()
+    return updated > 0
@@ -1,7 +1,7 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import ForeignKey, String, DateTime, Boolean
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import ForeignKey, String, DateTime, Boolean, Integer, Text
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, UUID
 from sqlalchemy import Column
 from src.core.database import DB_BASE
 
@@ -16,4 +16,38 @@ class AccountsORM(DB_BASE):
     gmailRefreshToken = Column(String, nullable=True)
     gmailRefreshTokenCreatedAt = Column(DateTime, nullable=True)
     isSyncing = Column(Boolean, default=False, nullable=False)
-    lastSyncedAt = Column(DateTime, nullable=True)
\ No newline at end of file
+    lastSyncedAt = Column(DateTime, nullable=True)
+    historyId = Column(String, nullable=True)
+
+
+class SyncCheckpointORM(DB_BASE):
+    """Progress of the running sync of an account, a restarted sync task resumes from it."""
+    __tablename__ = "sync_checkpoints"
+
+    account_id = Column(UUID(as_uuid=True), ForeignKey('accounts.id'), primary_key=True)
+    query = Column(Text, nullable=True)
+    start_history_id = Column(String, nullable=True)
+    sync_history_id = Column(String, nullable=True)
+    page_token = Column(String, nullable=True)
+    listing_complete = Column(Boolean, default=False, server_default="false", nullable=False)
+    # Highest receivedAt stored so far, becomes lastSyncedAt when the sync completes
+    watermark = Column(DateTime, nullable=True)
+    # Listed but not yet stored, processed first on resume
+    in_flight_ids = Column(ARRAY(String), default=list, server_default="{}", nullable=False)
+    pages_committed = Column(Integer, default=0, server_default="0", nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
+
+
+class BackfillORM(DB_BASE):
+    """Onboarding backfill of an account, the batch prediction jobs outlive the worker instance that submitted them."""
+    __tablename__ = "backfills"
+
+    account_id = Column(UUID(as_uuid=True), ForeignKey('accounts.id'), primary_key=True)
+    # "submitting" while months are submitted, "polling" until every job is ingested, then "completed"
+    state = Column(String, default="submitting", server_default="submitting", nullable=False)
+    # Task submitting the months, a retry of the same task resumes them
+    owner = Column(String, nullable=True)
+    # One entry per month: label, job name, emails file, request count and state
+    jobs = Column(JSONB, default=list, server_default="[]", nullable=False)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now, nullable=False)
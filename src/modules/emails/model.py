@@ -1,8 +1,12 @@
-from sqlalchemy import UUID, Column, ForeignKey, String, Text, DateTime
+from sqlalchemy import UUID, Column, ForeignKey, Index, Integer, String, Text, DateTime
 from pydantic import BaseModel
 from packages.models import EmailSanitized
 from src.core.database import DB_BASE
 
+EXTRACTION_STATUS_PENDING = "pending"
+EXTRACTION_STATUS_PARSED = "parsed"
+EXTRACTION_STATUS_FAILED = "failed"
+
 class EmailBulkInsertPayload(BaseModel):
     emails: list[EmailSanitized]
     userId: str
@@ -13,6 +17,22 @@ class EmailBulkInsertResponse(BaseModel):
     message: str
     status: str
 
+class EmailExtractionFailure(BaseModel):
+    id: str
+    error: str
+
+class EmailExtractionStatusPayload(BaseModel):
+    accountId: str
+    parsed: list[str] = []
+    failed: list[EmailExtractionFailure] = []
+
+class EmailExistencePayload(BaseModel):
+    accountId: str
+    ids: list[str]
+
+class DeadLetterReplayPayload(BaseModel):
+    accountId: str
+
 class EmailMessageORM(DB_BASE):
     __tablename__ = "emails"
 
@@ -22,4 +42,12 @@ class EmailMessageORM(DB_BASE):
     date_time = Column(DateTime)
     emailSender = Column(String(128))
     emailId = Column(String(128))
-    accountId = Column(UUID(as_uuid=True), ForeignKey('accounts.id'), nullable=False)
\ No newline at end of file
+    accountId = Column(UUID(as_uuid=True), ForeignKey('accounts.id'), nullable=False)
+    # Dead letter state, failed emails are replayed without re-syncing their window
+    extraction_status = Column(String(16), nullable=False, default=EXTRACTION_STATUS_PENDING, server_default=EXTRACTION_STATUS_PENDING)
+    extraction_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    extraction_error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index("ix_emails_account_extraction_status", "accountId", "extraction_status"),
+    )
@@ -0,0 +1,113 @@
+from sqlalchemy import String, any_, bindparam, select, update
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.orm import Session
+
+from packages.models import EmailSanitized
+from src.core.environment import ENV_SETTINGS
+from src.modules.emails.model import (
+    EXTRACTION_STATUS_FAILED,
+    EXTRACTION_STATUS_PARSED,
+    EXTRACTION_STATUS_PENDING,
+    EmailExtractionFailure,
+    EmailMessageORM,
+)
+from src.utils.bulk_copy import chunk_rows, copy_insert_ignore, use_copy
+from src.utils.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Errors are truncated, a dead letter only needs enough to tell the failure apart
+EXTRACTION_ERROR_MAX_LENGTH = 1000
+
+def insertEmails(accountId: str, emails: list[EmailSanitized], db: Session) -> int:
+    """
+    Insert emails skipping ids already stored. Large batches are streamed through COPY, the rest go
+    in multi-VALUES statements below the parameter limit. Returns the inserted count, the caller commits.
+    """
+    if not emails:
+        return 0
+    email_data = [
+        {
+            "id": email.id,
+            "thread_id": email.threadId,
+            "snippet": email.snippet,
+            "date_time": email.receivedAt,
+            "emailSender": email.emailSender,
+            "emailId": email.emailId,
+            "accountId": accountId,
+            "extraction_status": EXTRACTION_STATUS_PENDING,
+            "extraction_attempts": 0,
+            "extraction_error": None,
+        }
+        for email in emails
+    ]
+    if use_copy(db, len(email_data), ENV_SETTINGS.BULK_COPY_MIN_ROWS):
+        return copy_insert_ignore(db, EmailMessageORM.__table__, email_data, ['id'])
+    inserted = 0
+    for chunk in chunk_rows(email_data, len(email_data[0])):
+        # Use PostgreSQL's ON CONFLICT DO NOTHING to skip duplicates
+        stmt = insert(EmailMessageORM).values(chunk).on_conflict_do_nothing(index_elements=['id'])
+        inserted += db.execute(stmt).rowcount
+    return inserted
+
+def updateExtractionStatus(accountId: str, parsed: list[str], failed: list[EmailExtractionFailure], db: Session) -> tuple[int, int]:
+    """
+    Mark emails as parsed or failed. extraction_attempts counts failures only, replay stops once it
+    reaches EXTRACTION_MAX_ATTEMPTS. Returns the updated (parsed, failed) counts, the caller commits.
+    """
+    emails = EmailMessageORM.__table__
+    parsed_count = 0
+    if parsed:
+        result = db.execute(
+            update(emails)
+            .where(emails.c.accountId == accountId, emails.c.id.in_(parsed))
+            .values(
+                extraction_status=EXTRACTION_STATUS_PARSED,
+                extraction_error=None,
+            )
+        )
+        parsed_count = result.rowcount
+
+    failed_count = 0
+    if failed:
+        # One statement executed for every failed email, each with its own error
+        result = db.execute(
+            update(emails)
+            .where(emails.c.accountId == accountId, emails.c.id == bindparam("b_id"))
+            .values(
+                extraction_status=EXTRACTION_STATUS_FAILED,
+                extraction_attempts=emails.c.extraction_attempts + 1,
+                extraction_error=bindparam("b_error"),
+            ),
+            [{"b_id": failure.id, "b_error": failure.error[:EXTRACTION_ERROR_MAX_LENGTH]} for failure in failed],
+        )
+        failed_count = result.rowcount
+    return parsed_count, failed_count
+
+def getFailedEmails(accountId: str, maxAttempts: int, db: Session, limit: int = None) -> list[EmailMessageORM]:
+    """Emails of an account whose extraction failed and may be retried, oldest first."""
+    query = (
+        db.query(EmailMessageORM)
+        .filter(
+            EmailMessageORM.accountId == accountId,
+            EmailMessageORM.extraction_status == EXTRACTION_STATUS_FAILED,
+            EmailMessageORM.extraction_attempts < maxAttempts,
+        )
+        .order_by(EmailMessageORM.date_time)
+    )
+    if limit:
+        query = query.limit(limit)
+    return query.all()
+
+def getExistingEmailStatuses(accountId: str, ids: list[str], db: Session) -> dict[str, str]:
+    """Extraction status of the given message ids already stored for the account, in one `id = ANY(:ids)` query."""
+    if not ids:
+        return {}
+    emails = EmailMessageORM.__table__
+    rows = db.execute(
+        select(emails.c.id, emails.c.extraction_status).where(
+            emails.c.accountId == accountId,
+            emails.c.id == any_(bindparam("ids", value=list(ids), type_=ARRAY(String))),
+        )
+    )
+    return {row.id: row.extraction_status for row in rows}
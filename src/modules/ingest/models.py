@@ -0,0 +1,19 @@
+from datetime import datetime
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+from packages.models import EmailSanitized, OrdersIntentModel, Transaction
+from src.modules.emails.model import EmailExtractionFailure
+
+class IngestBatchPayload(BaseModel):
+    userId: str
+    accountId: str
+    emailId: str
+    emails: List[EmailSanitized] = []
+    transactions: List[Transaction] = []
+    orders: List[OrdersIntentModel] = []
+    parsed: List[str] = []
+    failed: List[EmailExtractionFailure] = []
+    # Only moves the account watermark forward, an older value is ignored
+    lastSyncedAt: Optional[datetime] = None
@@ -0,0 +1,41 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy.orm import Session
+
+from packages.models import EmailSanitized, OrdersIntentModel, Transaction
+from src.modules.accounts.operations import advanceLastSyncedAt
+from src.modules.emails.model import EmailExtractionFailure
+from src.modules.emails.operations import insertEmails, updateExtractionStatus
+from src.modules.orders.operations import upsertOrders
+from src.modules.transactions.operations import insertTransactions
+
+
+def ingestBatch(
+    userId: str,
+    accountId: str,
+    emails: list[EmailSanitized],
+    transactions: list[Transaction],
+    orders: list[OrdersIntentModel],
+    parsed: list[str],
+    failed: list[EmailExtractionFailure],
+    lastSyncedAt: Optional[datetime],
+    db: Session,
+) -> dict:
+    """Write every kind of a sync page with set-based statements. Returns per-kind counts, the caller commits."""
+    emails_inserted = insertEmails(accountId, emails, db)
+    transactions_inserted, transactions_failed = insertTransactions(userId, accountId, transactions, db)
+    order_counts = upsertOrders(accountId, orders, db)
+    parsed_count, failed_count = updateExtractionStatus(accountId, parsed, failed, db)
+    if lastSyncedAt:
+        advanceLastSyncedAt(accountId, lastSyncedAt, db)
+    return {
+        "emails": {"inserted": emails_inserted, "skipped": len(emails) - emails_inserted},
+        "transactions": {
+            "inserted": transactions_inserted,
+            "skipped": len(transactions) - transactions_failed - transactions_inserted,
+            "failed": transactions_failed,
+        },
+        "orders": order_counts,
+        "extractionStatus": {"parsed": parsed_count, "failed": failed_count},
+    }
@@ -0,0 +1,156 @@
+import hashlib
+import json
+from collections import Counter
+
+from sqlalchemy import func, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from packages.enums import TransactionCategory
+from packages.models import OrderItemsIntentModel, OrdersIntentModel
+from packages.utils import convert_iso_to_datetime
+from src.modules.orders.schema import OrdersORM, OrderItemsORM
+from src.utils.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Columns a re-ingested order may fill in, a missing value never clears a stored one
+ORDER_UPDATE_COLUMNS = ("vendor", "order_date", "currency", "sub_total", "total", "message_id")
+
+
+def orderItemFingerprint(item: OrderItemsIntentModel, occurrence: int) -> str:
+    """
+    Deterministic id of an item within its order. Identical lines of one receipt are told apart
+    by their occurrence, so re-ingesting the same order maps every item to the same fingerprint.
+    """
+    key = [item.name, item.itemType, item.quantity, item.unitType, item.unitPrice, item.total, item.category, occurrence]
+    return hashlib.sha256(json.dumps(key, default=str).encode("utf-8")).hexdigest()
+
+
+def upsertOrders(accountId: str, orders: list[OrdersIntentModel], db: Session) -> dict:
+    """
+    Insert new orders and fill in existing ones with one INSERT ... ON CONFLICT (order_id) DO UPDATE,
+    then insert their items with one statement that skips items already stored (same order and fingerprint).
+    Orders stored before fingerprints existed keep their items, nothing is added to them.
+    Orders that cannot be prepared are reported in `errors` and left out. When the statements fail, the batch
+    is rolled back to a savepoint and written order by order, so only the failing orders are reported.
+    The caller commits. Returns the inserted, updated, failed and itemsInserted counts and the per-row errors.
+    """
+    counts = {"inserted": 0, "updated": 0, "failed": 0, "itemsInserted": 0, "errors": []}
+    order_rows: dict[str, dict] = {}
+    order_items: dict[str, dict[str, dict]] = {}
+    order_indexes: dict[str, int] = {}
+    for idx, order in enumerate(orders):
+        try:
+            row = {
+                "order_id": order.orderId,
+                "vendor": order.vendor,
+                "order_date": convert_iso_to_datetime(order.orderDate),
+                "currency": order.currency,
+                "sub_total": order.subTotal,
+                "total": order.total,
+                "account_id": accountId,
+                "message_id": order.messageId,
+            }
+            items = {}
+            occurrences = Counter()
+            for item in order.items:
+                fingerprint = orderItemFingerprint(item, occurrences[item.model_dump_json()])
+                occurrences[item.model_dump_json()] += 1
+                items[fingerprint] = {
+                    "account_id": accountId,
+                    "name": item.name,
+                    "item_type": item.itemType,
+                    "quantity": item.quantity,
+                    "unit_price": item.unitPrice,
+                    "category": item.category or TransactionCategory.OTHER.value,
+                    "unit_type": item.unitType,
+                    "total": item.total,
+                    "fingerprint": fingerprint,
+                }
+        except Exception as e:
+            counts["failed"] += 1
+            counts["errors"].append({"index": idx, "orderId": order.orderId, "error": str(e)})
+            logger.warning(f"Failed to process order at index {idx}: {e}. Order ID: {order.orderId}")
+            continue
+
+        # A statement cannot update the same row twice, repeats of an order in the batch are merged in order
+        existing = order_rows.get(order.orderId)
+        if existing:
+            existing.update({key: value for key, value in row.items() if value is not None})
+        else:
+            order_rows[order.orderId] = row
+            order_indexes[order.orderId] = idx
+        order_items.setdefault(order.orderId, {}).update(items)
+
+    if not order_rows:
+        return counts
+
+    try:
+        with db.begin_nested():
+            written = writeOrders(list(order_rows.values()), order_items, db)
+    except Exception as e:
+        logger.warning(f"Bulk upsert of {len(order_rows)} orders failed, writing them one by one: {e}")
+    else:
+        for key, value in written.items():
+            counts[key] += value
+        return counts
+
+    for order_id, row in order_rows.items():
+        try:
+            with db.begin_nested():
+                written = writeOrders([row], {order_id: order_items[order_id]}, db)
+        except Exception as e:
+            counts["failed"] += 1
+            counts["errors"].append({"index": order_indexes[order_id], "orderId": order_id, "error": str(e)})
+            logger.warning(f"Failed to store order at index {order_indexes[order_id]}: {e}. Order ID: {order_id}")
+            continue
+        for key, value in written.items():
+            counts[key] += value
+    return counts
+
+
+def writeOrders(rows: list[dict], order_items: dict[str, dict[str, dict]], db: Session) -> dict:
+    """Upsert prepared order rows and insert their new items. Returns the inserted, updated and itemsInserted counts."""
+    written = {"inserted": 0, "updated": 0, "itemsInserted": 0}
+    stmt = insert(OrdersORM).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["order_id"],
+        set_={column: func.coalesce(stmt.excluded[column], OrdersORM.__table__.c[column]) for column in ORDER_UPDATE_COLUMNS},
+    ).returning(
+        OrdersORM.id,
+        OrdersORM.order_id,
+        # xmax is only set on rows the statement updated
+        literal_column("(xmax = 0)").label("inserted"),
+    )
+    order_ids = {}
+    updated_ids = []
+    for row in db.execute(stmt):
+        order_ids[row.order_id] = row.id
+        written["inserted" if row.inserted else "updated"] += 1
+        if not row.inserted:
+            updated_ids.append(row.id)
+
+    # Items without a fingerprint never conflict, adding the re-extracted items would duplicate them
+    legacy_ids = set()
+    if updated_ids:
+        legacy_ids = set(db.scalars(
+            select(OrderItemsORM.order_id)
+            .where(OrderItemsORM.order_id.in_(updated_ids), OrderItemsORM.fingerprint.is_(None))
+            .distinct()
+        ))
+        if legacy_ids:
+            logger.info(f"Skipping items of {len(legacy_ids)} orders stored without item fingerprints")
+
+    item_rows = [
+        dict(item, order_id=order_ids[order_id])
+        for order_id, items in order_items.items()
+        if order_ids[order_id] not in legacy_ids
+        for item in items.values()
+    ]
+    if item_rows:
+        result = db.execute(
+            insert(OrderItemsORM).values(item_rows).on_conflict_do_nothing(index_elements=["order_id", "fingerprint"])
+        )
+        written["itemsInserted"] = result.rowcount
+    return written
@@ -1,6 +1,6 @@
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, DateTime, Float, ForeignKey
+from sqlalchemy import Column, String, DateTime, Float, ForeignKey, Index
 from sqlalchemy.dialects.postgresql import UUID
 from packages.enums import TransactionCategory
 from src.core.database import DB_BASE
@@ -33,4 +33,10 @@ class OrderItemsORM(DB_BASE):
     quantity = Column(Float, nullable=True)
     unit_type = Column(String, nullable=True)
     unit_price = Column(Float, nullable=True)
-    total = Column(Float, nullable=True) 
\ No newline at end of file
+    total = Column(Float, nullable=True) 
+    # Deterministic id of the item within its order, re-ingested orders skip items already stored
+    fingerprint = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        Index("uq_order_items_order_fingerprint", "order_id", "fingerprint", unique=True),
+    )
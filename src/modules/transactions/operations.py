@@ -0,0 +1,125 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+
+from packages.models import Transaction
+from src.core.environment import ENV_SETTINGS
+from src.modules.emails.model import EmailMessageORM
+from src.modules.orders.schema import OrdersORM
+from src.modules.transactions.schema import TransactionORM
+from src.utils.bulk_copy import chunk_rows, copy_insert_ignore, use_copy
+from src.utils.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# A sender only enters the shared index once it produced transactions for this many accounts,
+# so personal addresses never leak into other users' Gmail queries
+GLOBAL_SENDER_MIN_ACCOUNTS = 3
+
+
+def add_unique_senders(senders: list[str], values: list) -> None:
+    for value in values:
+        if not value:
+            continue
+        sender = value.strip().lower()
+        if sender and sender not in senders:
+            senders.append(sender)
+
+
+def get_account_financial_senders(account_id: str, db: Session, limit: int = 200) -> list[str]:
+    """
+    Senders that produced transactions or orders for the account, most frequent first.
+    Order vendors are included by name because orders only keep the vendor, the sender
+    address comes from the email the order was extracted from.
+    """
+    transaction_senders = db.query(TransactionORM.email_id).filter(
+        TransactionORM.account_id == account_id,
+        TransactionORM.email_id.isnot(None),
+    ).group_by(
+        TransactionORM.email_id
+    ).order_by(
+        func.count(TransactionORM.id).desc()
+    ).limit(limit).all()
+
+    order_senders = db.query(EmailMessageORM.emailId).join(
+        OrdersORM, OrdersORM.message_id == EmailMessageORM.id
+    ).filter(
+        OrdersORM.account_id == account_id,
+        EmailMessageORM.emailId.isnot(None),
+    ).group_by(
+        EmailMessageORM.emailId
+    ).order_by(
+        func.count(OrdersORM.id).desc()
+    ).limit(limit).all()
+
+    order_vendors = db.query(OrdersORM.vendor).filter(
+        OrdersORM.account_id == account_id,
+        OrdersORM.vendor.isnot(None),
+    ).group_by(
+        OrdersORM.vendor
+    ).order_by(
+        func.count(OrdersORM.id).desc()
+    ).limit(limit).all()
+
+    senders: list[str] = []
+    add_unique_senders(senders, [row.email_id for row in transaction_senders])
+    add_unique_senders(senders, [row.emailId for row in order_senders])
+    add_unique_senders(senders, [row.vendor for row in order_vendors])
+    return senders[:limit]
+
+
+def get_global_financial_senders(db: Session, min_accounts: int = GLOBAL_SENDER_MIN_ACCOUNTS, limit: int = 200) -> list[str]:
+    """Senders that produced transactions for at least `min_accounts` different accounts."""
+    rows = db.query(TransactionORM.email_id).filter(
+        TransactionORM.email_id.isnot(None),
+    ).group_by(
+        TransactionORM.email_id
+    ).having(
+        func.count(func.distinct(TransactionORM.account_id)) >= min_accounts
+    ).order_by(
+        func.count(func.distinct(TransactionORM.account_id)).desc()
+    ).limit(limit).all()
+
+    senders: list[str] = []
+    add_unique_senders(senders, [row.email_id for row in rows])
+    return senders
+
+
+def insertTransactions(userId: str, accountId: str, transactions: list[Transaction], db: Session) -> tuple[int, int]:
+    """
+    Insert transactions skipping ids already stored. Large batches are streamed through COPY, the rest go
+    in multi-VALUES statements below the parameter limit. Returns the (inserted, failed) counts, the caller commits.
+    """
+    txn_data = []
+    failed_count = 0
+    for idx, transaction in enumerate(transactions):
+        try:
+            txn_data.append({
+                "id": transaction.id,
+                "amount": transaction.amount,
+                "transaction_type": transaction.transaction_type,
+                "source_identifier": transaction.source_identifier,
+                "destination": transaction.destination,
+                "mode": transaction.mode,
+                "reference_number": transaction.reference_number,
+                "email_sender": transaction.emailSender,
+                "email_id": transaction.emailId,
+                "date_time": transaction.date_time,
+                "user_id": userId,
+                "account_id": accountId,
+                "is_include_analytics": True,
+            })
+        except Exception as e:
+            failed_count += 1
+            logger.warning(f"Failed to process transaction at index {idx}: {e}. Failed transaction ID: {transaction.id}")
+
+    if not txn_data:
+        return 0, failed_count
+    if use_copy(db, len(txn_data), ENV_SETTINGS.BULK_COPY_MIN_ROWS):
+        return copy_insert_ignore(db, TransactionORM.__table__, txn_data, ['id']), failed_count
+    inserted = 0
+    for chunk in chunk_rows(txn_data, len(txn_data[0])):
+        # Use PostgreSQL's ON CONFLICT DO NOTHING to skip duplicates
+        stmt = insert(TransactionORM).values(chunk).on_conflict_do_nothing(index_elements=['id'])
+        inserted += db.execute(stmt).rowcount
+    return inserted, failed_count
@@ -0,0 +1,82 @@
+import io
+import uuid
+from datetime import datetime
+from typing import Iterator
+
+from sqlalchemy import Table
+from sqlalchemy.orm import Session
+
+# Postgres caps the bind parameters of one statement, a multi-VALUES insert must stay below it
+POSTGRES_MAX_PARAMETERS = 65535
+# Rows buffered per COPY, bounds the memory of a large backfill
+COPY_CHUNK_ROWS = 10000
+
+
+def chunk_rows(rows: list[dict], columns: int, max_parameters: int = POSTGRES_MAX_PARAMETERS) -> Iterator[list[dict]]:
+    """Split rows so that rows x columns of every chunk fits in one statement."""
+    size = max(1, max_parameters // max(1, columns))
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def use_copy(db: Session, row_count: int, min_rows: int) -> bool:
+    """COPY pays off for large batches only, and needs the psycopg2 driver."""
+    return bool(min_rows) and row_count >= min_rows and db.get_bind().dialect.driver == "psycopg2"
+
+
+def copy_text_value(value) -> str:
+    """Encode a value for COPY's text format, NULL is \\N and control characters are escaped."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_text_buffer(rows: list[dict], columns: list[str]) -> io.StringIO:
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_text_value(row.get(column)) for column in columns))
+        buffer.write("\n")
+    buffer.seek(0)
+    return buffer
+
+
+def copy_insert_ignore(db: Session, table: Table, rows: list[dict], conflict_columns: list[str]) -> int:
+    """
+    Stream rows into a temp staging table with COPY FROM STDIN, then merge them with
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING. Runs in the session's transaction, the caller commits.
+    Returns the number of rows inserted into the target table.
+    """
+    if not rows:
+        return 0
+    columns = [column.name for column in table.columns if column.name in rows[0]]
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    staging = f"staging_{table.name}_{uuid.uuid4().hex[:12]}"
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute(f'CREATE TEMP TABLE {staging} (LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+        for start in range(0, len(rows), COPY_CHUNK_ROWS):
+            cursor.copy_expert(
+                f"COPY {staging} ({column_list}) FROM STDIN",
+                copy_text_buffer(rows[start:start + COPY_CHUNK_ROWS], columns),
+            )
+        conflict_list = ", ".join(f'"{column}"' for column in conflict_columns)
+        cursor.execute(
+            f'INSERT INTO "{table.name}" ({column_list}) SELECT {column_list} FROM {staging} '
+            f"ON CONFLICT ({conflict_list}) DO NOTHING"
+        )
+        inserted = cursor.rowcount
+        cursor.execute(f"DROP TABLE {staging}")
+    finally:
+        cursor.close()
+    return inserted
@@ -4,7 +4,7 @@ import base64
 from google.cloud import tasks_v2
 from src.core.environment import ENV_SETTINGS
 
-def enqueue_worker_task(payload: dict):
+def enqueue_worker_task(payload: dict, path: str = "/tasks/process"):
     client = tasks_v2.CloudTasksClient()
     parent = client.queue_path(
         "rola-labs",
@@ -15,7 +15,7 @@ def enqueue_worker_task(payload: dict):
     task = {
         "http_request": {
             "http_method": tasks_v2.HttpMethod.POST,
-            "url": f"{ENV_SETTINGS.WORKER_CLOUD_RUN_URL}/tasks/process",
+            "url": f"{ENV_SETTINGS.WORKER_CLOUD_RUN_URL}{path}",
             "headers": {
                 "Content-Type": "application/json"
             },
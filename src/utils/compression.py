@@ -0,0 +1,135 @@
+import io
+import json
+import zlib
+from typing import Callable
+
+import msgpack
+import zstandard
+from fastapi import Request, Response
+from fastapi.responses import JSONResponse
+from fastapi.routing import APIRoute
+
+# Largest decompressed request body accepted, guards against decompression bombs
+MAX_DECOMPRESSED_BODY_BYTES = 64 * 1024 * 1024
+# Request body encodings the backend decodes, advertised on 415 responses (RFC 7694)
+SUPPORTED_ENCODINGS = ("gzip", "zstd")
+MSGPACK_CONTENT_TYPES = ("application/msgpack", "application/x-msgpack")
+
+
+# Decompressors stop after max_bytes + 1 bytes, a longer result means the body is over the limit
+def decompress_gzip(body: bytes, max_bytes: int) -> bytes:
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    try:
+        data = decompressor.decompress(body, max_bytes + 1)
+    except zlib.error as e:
+        raise ValueError(f"Invalid gzip request body: {e}")
+    return data
+
+
+def decompress_zstd(body: bytes, max_bytes: int) -> bytes:
+    try:
+        with zstandard.ZstdDecompressor().stream_reader(io.BytesIO(body)) as reader:
+            return reader.read(max_bytes + 1)
+    except zstandard.ZstdError as e:
+        raise ValueError(f"Invalid zstd request body: {e}")
+
+
+DECOMPRESSORS: dict[bytes, Callable[[bytes, int], bytes]] = {
+    b"gzip": decompress_gzip,
+    b"zstd": decompress_zstd,
+}
+
+
+class RequestDecompressionMiddleware:
+    '''
+    ASGI middleware that decompresses request bodies sent with `Content-Encoding: gzip` or `zstd`.
+    The worker compresses large bulk-insert payloads; endpoints and the logging middleware
+    see the decoded body with the encoding header removed. Other encodings get a 415 listing the supported ones.
+    '''
+    def __init__(self, app, max_body_bytes: int = MAX_DECOMPRESSED_BODY_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = [(name, value) for name, value in scope["headers"]]
+        encoding = next((value for name, value in headers if name == b"content-encoding"), b"").strip().lower()
+        if encoding in (b"", b"identity"):
+            await self.app(scope, receive, send)
+            return
+        decompress = DECOMPRESSORS.get(encoding)
+        if not decompress:
+            await self.reject(send, 415, f"Unsupported request content encoding: {encoding.decode(errors='replace')}")
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        try:
+            body = decompress(b"".join(chunks), self.max_body_bytes)
+        except ValueError as e:
+            await self.reject(send, 400, str(e))
+            return
+        if len(body) > self.max_body_bytes:
+            await self.reject(send, 413, "Decompressed request body too large")
+            return
+
+        headers = [
+            (name, value) for name, value in headers if name not in (b"content-encoding", b"content-length")
+        ] + [(b"content-length", str(len(body)).encode())]
+        body_sent = False
+
+        async def receive_decompressed():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(dict(scope, headers=headers), receive_decompressed, send)
+
+    async def reject(self, send, status_code: int, message: str):
+        content = json.dumps({"message": message}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status_code,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(content)).encode()),
+                (b"accept-encoding", ", ".join(SUPPORTED_ENCODINGS).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": content})
+
+
+class MsgpackRoute(APIRoute):
+    '''
+    Route class for the bulk ingest routers that also accepts `application/msgpack` bodies.
+    The body is unpacked straight into the objects FastAPI validates, without a JSON round trip.
+    '''
+    def get_route_handler(self) -> Callable:
+        handler = super().get_route_handler()
+
+        async def route_handler(request: Request) -> Response:
+            content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+            if content_type not in MSGPACK_CONTENT_TYPES:
+                return await handler(request)
+            body = await request.body()
+            try:
+                payload = msgpack.unpackb(body, raw=False)
+            except Exception as e:
+                return JSONResponse(status_code=400, content={"message": f"Invalid msgpack request body: {e}"})
+            headers = [(name, value) for name, value in request.scope["headers"] if name != b"content-type"]
+            decoded = Request(dict(request.scope, headers=headers + [(b"content-type", b"application/json")]), request.receive)
+            # FastAPI reads the body through request.json(), which returns the cached value
+            decoded._body = body
+            decoded._json = payload
+            return await handler(decoded)
+
+        return route_handler
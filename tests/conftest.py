@@ -0,0 +1,68 @@
+"""
+Shared fixtures for the tests that run against PostgreSQL.
+Point TEST_DATABASE_URL at a disposable database to run them, they are skipped otherwise:
+TEST_DATABASE_URL=postgresql://postgres@localhost/moneybhai_test python -m pytest tests -v
+"""
+
+import os
+import uuid
+
+import pytest
+
+TEST_DATABASE_URL = os.environ.get("TEST_DATABASE_URL")
+
+
+@pytest.fixture(scope="session")
+def database_engine():
+    """Engine on the test database with every table created from the models, dropped afterwards"""
+    if not TEST_DATABASE_URL:
+        pytest.skip("Requires TEST_DATABASE_URL")
+    # src.core reads its settings on import
+    os.environ.setdefault("DATABASE_URL", TEST_DATABASE_URL)
+    os.environ.setdefault("LANGSMITH_API_KEY", "test")
+    os.environ.setdefault("LANGSMITH_TRACING", "false")
+    from sqlalchemy import create_engine
+
+    from src.core.database import DB_BASE
+    from src.modules.accounts.schema import AccountsORM, BackfillORM, SyncCheckpointORM  # noqa: F401
+    from src.modules.budgets.schema import BudgetORM  # noqa: F401
+    from src.modules.emails.model import EmailMessageORM  # noqa: F401
+    from src.modules.orders.schema import OrderItemsORM, OrdersORM  # noqa: F401
+    from src.modules.transactions.schema import TransactionORM  # noqa: F401
+    from src.modules.users.schema import UsersORM  # noqa: F401
+
+    engine = create_engine(TEST_DATABASE_URL, future=True)
+    DB_BASE.metadata.drop_all(engine)
+    DB_BASE.metadata.create_all(engine)
+    yield engine
+    DB_BASE.metadata.drop_all(engine)
+    engine.dispose()
+
+
+@pytest.fixture
+def db(database_engine):
+    """Session inside a transaction that is rolled back after the test, commits become savepoints"""
+    from sqlalchemy.orm import Session
+
+    connection = database_engine.connect()
+    transaction = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    yield session
+    session.close()
+    transaction.rollback()
+    connection.close()
+
+
+@pytest.fixture
+def account_id(db):
+    """Id of a fresh user's account"""
+    from src.modules.accounts.schema import AccountsORM
+    from src.modules.users.schema import UsersORM
+
+    user = UsersORM(id=uuid.uuid4(), email=f"{uuid.uuid4()}@example.com", name="Test User")
+    account = AccountsORM(id=uuid.uuid4(), userId=user.id, emailId=user.email)
+    db.add(user)
+    db.flush()
+    db.add(account)
+    db.flush()
+    return account.id
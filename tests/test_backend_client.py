@@ -0,0 +1,250 @@
+"""
+Tests for the worker backend http client and the backend request decoding
+Run with: python -m pytest tests/test_backend_client.py -v
+"""
+
+import gzip
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import msgpack
+import pytest
+import zstandard
+from fastapi import APIRouter, FastAPI, Request
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from src.utils.compression import MsgpackRoute, RequestDecompressionMiddleware
+from worker.backend_client import BackendClient
+
+
+class RecordingHandler(BaseHTTPRequestHandler):
+    """Records every request and answers with the statuses queued on the server"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.server.requests.append({
+            "path": self.path,
+            "headers": dict(self.headers),
+            "body": body,
+            "client_port": self.client_address[1],
+        })
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        content = json.dumps({"status": status}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if status == 415:
+            self.send_header("Accept-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_POST
+    do_PUT = do_POST
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RecordingHandler)
+    httpd.requests = []
+    httpd.statuses = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def client_for(server, **kwargs):
+    return BackendClient(f"http://127.0.0.1:{server.server_address[1]}/api/", backoff_factor=0, **kwargs)
+
+
+class TestBackendClient:
+    """Test pooling, retries and compression of backend calls"""
+
+    def test_connection_is_reused(self, server):
+        """Test consecutive calls go over one keep-alive connection"""
+        client = client_for(server)
+        for _ in range(5):
+            assert client.get("api/v1/accounts/acc-1").status_code == 200
+        assert len({request["client_port"] for request in server.requests}) == 1
+        assert server.requests[0]["path"] == "/api/api/v1/accounts/acc-1"
+
+    def test_large_bodies_are_gzipped(self, server):
+        """Test bodies above the threshold are compressed and small ones sent as is"""
+        client = client_for(server, compress_min_bytes=1024)
+        emails = [{"id": f"m{i}", "snippet": "Rs.100 debited from account 1234"} for i in range(100)]
+        client.post("api/v1/emails/insert-bulk", json={"emails": emails})
+        client.post("api/v1/accounts/acc-1/unlock", json={"ok": True})
+        large, small = server.requests
+        assert large["headers"]["Content-Encoding"] == "gzip"
+        assert json.loads(gzip.decompress(large["body"])) == {"emails": emails}
+        assert "Content-Encoding" not in small["headers"]
+        assert json.loads(small["body"]) == {"ok": True}
+        assert small["headers"]["Content-Type"] == "application/json"
+
+    def test_transient_statuses_are_retried(self, server):
+        """Test 503 and 429 responses are retried until the backend answers"""
+        server.statuses = [503, 429]
+        response = client_for(server).post("api/v1/transactions/bulk-insert", json={"transactions": []})
+        assert response.status_code == 200
+        assert len(server.requests) == 3
+
+    def test_post_is_not_retried_after_it_may_have_run(self, server):
+        """Test a POST answered with 502 or 504 is returned, a GET is retried"""
+        server.statuses = [502, 504]
+        client = client_for(server)
+        assert client.post("api/v1/ingest/batch", json={"emails": []}).status_code == 502
+        assert client.post("api/v1/ingest/batch", json={"emails": []}).status_code == 504
+        assert len(server.requests) == 2
+
+        server.statuses = [502]
+        assert client.get("api/v1/users/u1").status_code == 200
+        assert len(server.requests) == 4
+
+    def test_gives_up_after_max_retries(self, server):
+        """Test the last response is returned once retries are exhausted"""
+        server.statuses = [502] * 5
+        response = client_for(server, max_retries=2).get("api/v1/users/u1")
+        assert response.status_code == 502
+        assert len(server.requests) == 3
+
+    def test_zstd_msgpack_bulk_bodies(self, server):
+        """Test bulk bodies go as zstd compressed msgpack and other bodies stay JSON"""
+        client = client_for(server, compress_min_bytes=64, compression="zstd", body_format="msgpack")
+        emails = [{"id": f"m{i}", "snippet": "Rs.100 debited from account 1234"} for i in range(20)]
+        client.post("api/v1/ingest/batch", json={"emails": emails}, binary=True)
+        client.post("api/v1/emails/existing", json={"ids": ["m1"] * 20})
+        bulk, other = server.requests
+        assert bulk["headers"]["Content-Type"] == "application/msgpack"
+        assert bulk["headers"]["Content-Encoding"] == "zstd"
+        assert msgpack.unpackb(zstandard.ZstdDecompressor().decompress(bulk["body"])) == {"emails": emails}
+        assert other["headers"]["Content-Type"] == "application/json"
+
+    def test_unsupported_encoding_is_negotiated_down(self, server):
+        """Test a 415 switches to an encoding from the backend's Accept-Encoding and resends"""
+        server.statuses = [415]
+        client = client_for(server, compress_min_bytes=0, compression="zstd")
+        assert client.post("api/v1/transactions/bulk-insert", json={"transactions": []}).status_code == 200
+        rejected, accepted = server.requests
+        assert rejected["headers"]["Content-Encoding"] == "zstd"
+        assert accepted["headers"]["Content-Encoding"] == "gzip"
+        assert client.compression == "gzip"
+
+    def test_msgpack_rejection_falls_back_to_json(self, server):
+        """Test a 415 to a msgpack body resends it as JSON"""
+        server.statuses = [415]
+        client = client_for(server, compress_min_bytes=None, body_format="msgpack")
+        assert client.post("api/v1/ingest/batch", json={"emails": []}, binary=True).status_code == 200
+        assert [request["headers"]["Content-Type"] for request in server.requests] == ["application/msgpack", "application/json"]
+        assert json.loads(server.requests[1]["body"]) == {"emails": []}
+
+
+def gzip_app():
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(request: Request):
+        return {"body": await request.json(), "encoding": request.headers.get("content-encoding")}
+
+    app.add_middleware(RequestDecompressionMiddleware, max_body_bytes=10000)
+    return TestClient(app)
+
+
+class TestRequestDecompressionMiddleware:
+    """Test the backend accepts compressed request bodies"""
+
+    def test_gzip_body_is_decompressed(self):
+        """Test endpoints see the plain json body without the encoding header"""
+        payload = {"transactions": [{"id": "m1", "amount": 10}]}
+        response = gzip_app().post(
+            "/echo",
+            content=gzip.compress(json.dumps(payload).encode()),
+            headers={"Content-Encoding": "gzip", "Content-Type": "application/json"},
+        )
+        assert response.status_code == 200
+        assert response.json() == {"body": payload, "encoding": None}
+
+    def test_plain_body_passes_through(self):
+        """Test uncompressed requests are untouched"""
+        response = gzip_app().post("/echo", json={"a": 1})
+        assert response.json()["body"] == {"a": 1}
+
+    def test_invalid_and_oversized_bodies_are_rejected(self):
+        """Test a corrupt body is a 400 and a decompression bomb a 413"""
+        client = gzip_app()
+        assert client.post("/echo", content=b"not gzip", headers={"Content-Encoding": "gzip"}).status_code == 400
+        bomb = gzip.compress(json.dumps({"a": "x" * 20000}).encode())
+        assert client.post("/echo", content=bomb, headers={"Content-Encoding": "gzip"}).status_code == 413
+
+    def test_zstd_body_is_decompressed(self):
+        """Test zstd bodies are decoded like gzip ones and bombs are rejected"""
+        client = gzip_app()
+        payload = {"emails": [{"id": "m1"}]}
+        response = client.post(
+            "/echo",
+            content=zstandard.ZstdCompressor().compress(json.dumps(payload).encode()),
+            headers={"Content-Encoding": "zstd", "Content-Type": "application/json"},
+        )
+        assert response.json() == {"body": payload, "encoding": None}
+        bomb = zstandard.ZstdCompressor().compress(json.dumps({"a": "x" * 20000}).encode())
+        assert client.post("/echo", content=bomb, headers={"Content-Encoding": "zstd"}).status_code == 413
+
+    def test_unknown_encoding_lists_supported_ones(self):
+        """Test an unsupported encoding is a 415 with the accepted encodings"""
+        response = gzip_app().post("/echo", content=b"{}", headers={"Content-Encoding": "br"})
+        assert response.status_code == 415
+        assert response.headers["accept-encoding"] == "gzip, zstd"
+
+
+class BulkPayload(BaseModel):
+    accountId: str
+    ids: list[str]
+
+
+def msgpack_app():
+    router = APIRouter(route_class=MsgpackRoute)
+
+    @router.post("/bulk")
+    async def bulk(payload: BulkPayload):
+        return payload.model_dump()
+
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(RequestDecompressionMiddleware)
+    return TestClient(app)
+
+
+class TestMsgpackRoute:
+    """Test ingest routes accept msgpack bodies"""
+
+    def test_msgpack_body_is_validated(self):
+        """Test a msgpack body reaches the endpoint as the validated model"""
+        payload = {"accountId": "acc-1", "ids": ["m1", "m2"]}
+        response = msgpack_app().post("/bulk", content=msgpack.packb(payload), headers={"Content-Type": "application/msgpack"})
+        assert response.status_code == 200
+        assert response.json() == payload
+
+    def test_compressed_msgpack_and_json_bodies(self):
+        """Test zstd compressed msgpack and plain JSON both work on the same route"""
+        client = msgpack_app()
+        payload = {"accountId": "acc-1", "ids": ["m1"]}
+        response = client.post(
+            "/bulk",
+            content=zstandard.ZstdCompressor().compress(msgpack.packb(payload)),
+            headers={"Content-Type": "application/msgpack", "Content-Encoding": "zstd"},
+        )
+        assert response.json() == payload
+        assert client.post("/bulk", json=payload).json() == payload
+
+    def test_invalid_msgpack_is_rejected(self):
+        """Test a corrupt msgpack body is a 400 and a wrong shape a 422"""
+        client = msgpack_app()
+        assert client.post("/bulk", content=b"\xc1", headers={"Content-Type": "application/msgpack"}).status_code == 400
+        assert client.post("/bulk", content=msgpack.packb({"ids": 1}), headers={"Content-Type": "application/msgpack"}).status_code == 422
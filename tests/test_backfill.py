@@ -0,0 +1,326 @@
+"""
+Tests for the worker backfill ingestion and its state in mb-backend (claim tests need PostgreSQL, see conftest.py)
+Run with: python -m pytest tests/test_backfill.py -v
+"""
+
+import json
+import re
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from packages.models import EmailSanitized
+from worker.backfill import (
+    BACKFILL_COMPLETED,
+    BACKFILL_POLLING,
+    JOB_INGESTED,
+    JOB_SUBMITTED,
+    BackfillError,
+    BackfillJob,
+    BackfillManager,
+    BackfillState,
+)
+from worker.batch_prediction import JOB_DONE_STATES, LocalBatchBackend, build_request_line, write_jsonl
+from worker.item_extraction import response_items
+from worker.prompts import Prompt
+
+PROMPT = Prompt("combined", "Extract transactions and orders from each message.")
+
+
+class FakeClient:
+    """Stores the backfill the way mb-backend does and records every call"""
+
+    def __init__(self, stored=None, status_code=200):
+        self.stored = stored
+        self.status_code = status_code
+        self.calls = []
+
+    def post(self, path, json=None, **kwargs):
+        self.calls.append(("POST", path))
+        if self.stored is not None:
+            return SimpleNamespace(status_code=409, json=lambda: {}, text="claimed")
+        self.stored = {"state": "submitting", "jobs": []}
+        return SimpleNamespace(status_code=200, json=lambda: dict(self.stored), text="")
+
+    def get(self, path, **kwargs):
+        self.calls.append(("GET", path))
+        if self.stored is None:
+            return SimpleNamespace(status_code=404, json=lambda: {}, text="not found")
+        return SimpleNamespace(status_code=200, json=lambda: dict(self.stored), text="")
+
+    def put(self, path, json=None, **kwargs):
+        self.calls.append(("PUT", path))
+        if self.status_code == 200:
+            self.stored = json
+        return SimpleNamespace(status_code=self.status_code, text="error")
+
+
+class FakeAIManager:
+    """Records what the backfill stores, items are valid when they belong to a message of their request"""
+
+    accountId = "account-1"
+
+    def __init__(self, status=200):
+        self.status = status
+        self.fallback_ids = []
+        self.transactions = []
+        self.orders = []
+        self.status_ids = []
+
+    def response_items(self, response):
+        return response_items(response)
+
+    def validate_combined_item(self, item, message_ids):
+        if item.get("messageId") not in message_ids:
+            return f"unknown message id {item.get('messageId')}"
+        if item.get("kind") not in ("transaction", "order", "other"):
+            return f"invalid kind {item.get('kind')}"
+        return None
+
+    def route_combined_results(self, results):
+        transactions = [{**txn, "id": result["messageId"]} for result in results for txn in result.get("transactions") or []]
+        orders = [{**result["order"], "messageId": result["messageId"]} for result in results if result.get("order")]
+        return transactions, orders
+
+    def build_transactions(self, transactions_json_list, emails_by_id):
+        return [{**txn, "emailSender": emails_by_id[txn["id"]].emailSender} for txn in transactions_json_list]
+
+    def extract_combined_from_emails(self, emails):
+        self.fallback_ids.extend(email.id for email in emails)
+        return [{"id": email.id, "amount": 1.0, "emailSender": email.emailSender} for email in emails], []
+
+    def saveTransactions(self, transactions_list):
+        self.transactions.extend(transactions_list)
+        return self.status
+
+    def saveOrders(self, orders_list):
+        self.orders.extend(orders_list)
+        return self.status
+
+    def saveExtractionStatus(self, email_ids):
+        self.status_ids.extend(email_ids)
+        return 200
+
+
+def make_email(message_id):
+    return EmailSanitized(
+        id=message_id,
+        threadId=message_id,
+        emailSender="alerts@hdfcbank.net",
+        emailId="user@example.com",
+        subject="Account update",
+        snippet=f"Rs.10 debited ({message_id})",
+        body="",
+        receivedAt=datetime(2025, 3, 5, tzinfo=timezone.utc),
+    )
+
+
+def transaction_result(message_id):
+    return {"messageId": message_id, "kind": "transaction", "transactions": [{"amount": 10.0}]}
+
+
+def answering(responses):
+    """generate for the local backend, answers each request by its first message id, exceptions fail it"""
+    def generate(model, contents):
+        response = responses[re.search(r"^ID ([^:\n]+):", contents, re.MULTILINE).group(1)]
+        if isinstance(response, Exception):
+            raise response
+        return response
+    return generate
+
+
+def submit_job(tmp_path, backend, requests, label="2025-03"):
+    """Submit one request per list of message ids and wait for the job, as the backfill does for a month"""
+    emails_path = str(tmp_path / f"{label}.emails.jsonl")
+    input_path = str(tmp_path / f"{label}.input.jsonl")
+    message_ids = [message_id for ids in requests for message_id in ids]
+    write_jsonl(emails_path, [json.loads(make_email(message_id).model_dump_json()) for message_id in message_ids])
+    write_jsonl(input_path, [build_request_line(PROMPT, [f"ID {message_id}:\nRs.10 debited" for message_id in ids]) for ids in requests])
+    name = backend.submit(input_path, "flash", display_name=f"backfill-account-1-{label}")
+    deadline = time.monotonic() + 5
+    while backend.state(name) not in JOB_DONE_STATES:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return BackfillJob(label, name=name, emails_uri=backend.store(emails_path, f"{label}/emails.jsonl"), request_count=len(requests))
+
+
+def make_manager(tmp_path, backend, aiManager=None, client=None, jobs=()):
+    settings = SimpleNamespace(BACKFILL_MONTHS=12, LLM_MODEL="flash", BACKFILL_WORK_DIR=str(tmp_path))
+    state = BackfillState(client or FakeClient(stored={}), "account-1", state=BACKFILL_POLLING, jobs=jobs)
+    return BackfillManager(aiManager or FakeAIManager(), backend, state, settings)
+
+
+class TestIngest:
+    """Test storing the results of a completed batch job"""
+
+    def test_valid_results_are_stored(self, tmp_path):
+        """Test every message with a valid item is stored without the interactive api"""
+        backend = LocalBatchBackend(answering({
+            "m1": json.dumps({"results": [transaction_result("m1"), transaction_result("m2")]}),
+        }), work_dir=str(tmp_path))
+        job = submit_job(tmp_path, backend, [["m1", "m2"]])
+        manager = make_manager(tmp_path, backend)
+        manager.ingest(job, backend.state(job.name))
+
+        aiManager = manager.aiManager
+        assert aiManager.fallback_ids == []
+        assert [txn["id"] for txn in aiManager.transactions] == ["m1", "m2"]
+        assert aiManager.transactions[0]["emailSender"] == "alerts@hdfcbank.net"
+        assert sorted(aiManager.status_ids) == ["m1", "m2"]
+
+    def test_failed_request_falls_back(self, tmp_path):
+        """Test the messages of a request without response are extracted interactively"""
+        backend = LocalBatchBackend(answering({
+            "m1": json.dumps([transaction_result("m1")]),
+            "m2": RuntimeError("quota exceeded"),
+        }), work_dir=str(tmp_path))
+        job = submit_job(tmp_path, backend, [["m1"], ["m2", "m3"]])
+        manager = make_manager(tmp_path, backend)
+        manager.ingest(job, backend.state(job.name))
+
+        assert manager.aiManager.fallback_ids == ["m2", "m3"]
+        assert sorted(txn["id"] for txn in manager.aiManager.transactions) == ["m1", "m2", "m3"]
+        assert manager.stats["fallback_messages"] == 2
+
+    def test_invalid_items_fall_back(self, tmp_path):
+        """Test items that are not objects, have an invalid kind or name a message of another request are dropped"""
+        backend = LocalBatchBackend(answering({
+            "m1": json.dumps([
+                transaction_result("m1"),
+                "m2",
+                {"messageId": "m3", "kind": "refund"},
+                transaction_result("m4"),
+            ]),
+            "m4": "not json",
+        }), work_dir=str(tmp_path))
+        job = submit_job(tmp_path, backend, [["m1", "m2", "m3"], ["m4"]])
+        manager = make_manager(tmp_path, backend)
+        manager.ingest(job, backend.state(job.name))
+
+        assert manager.aiManager.fallback_ids == ["m2", "m3", "m4"]
+        assert sorted(manager.aiManager.status_ids) == ["m1", "m2", "m3", "m4"]
+
+    def test_failed_job_falls_back_entirely(self, tmp_path):
+        """Test the results of a job that did not succeed are not read"""
+        backend = LocalBatchBackend(answering({"m1": json.dumps([transaction_result("m1")])}), work_dir=str(tmp_path))
+        job = submit_job(tmp_path, backend, [["m1", "m2"]])
+        manager = make_manager(tmp_path, backend)
+        manager.ingest(job, "JOB_STATE_FAILED")
+
+        assert manager.aiManager.fallback_ids == ["m1", "m2"]
+
+    def test_store_failure_raises(self, tmp_path):
+        """Test a rejected write raises instead of reporting the month as ingested"""
+        backend = LocalBatchBackend(answering({"m1": json.dumps([transaction_result("m1")])}), work_dir=str(tmp_path))
+        job = submit_job(tmp_path, backend, [["m1"]])
+        manager = make_manager(tmp_path, backend, aiManager=FakeAIManager(status=500))
+        with pytest.raises(BackfillError):
+            manager.ingest(job, backend.state(job.name))
+
+
+class TestPoll:
+    """Test ingesting completed jobs from the poll task"""
+
+    def test_poll_ingests_one_job_per_call(self, tmp_path):
+        """Test each poll ingests one completed month, records it, and the last one completes the backfill"""
+        backend = LocalBatchBackend(answering({
+            "m1": json.dumps([transaction_result("m1")]),
+            "m2": json.dumps([transaction_result("m2")]),
+        }), work_dir=str(tmp_path))
+        jobs = [submit_job(tmp_path, backend, [["m1"]], "2025-03"), submit_job(tmp_path, backend, [["m2"]], "2025-02")]
+        client = FakeClient(stored={})
+        manager = make_manager(tmp_path, backend, client=client, jobs=jobs)
+
+        assert manager.poll().label == "2025-03"
+        assert [job["state"] for job in client.stored["jobs"]] == [JOB_INGESTED, JOB_SUBMITTED]
+        assert client.stored["state"] == BACKFILL_POLLING
+        assert manager.poll().label == "2025-02"
+        assert client.stored["state"] == BACKFILL_COMPLETED
+        assert manager.poll() is None
+
+    def test_running_jobs_are_left(self, tmp_path):
+        """Test a poll with no completed job stores nothing"""
+        backend = SimpleNamespace(state=lambda name: "JOB_STATE_RUNNING")
+        client = FakeClient(stored={})
+        manager = make_manager(tmp_path, backend, client=client, jobs=[BackfillJob("2025-03", name="job-1")])
+        assert manager.poll() is None
+        assert client.calls == []
+
+    def test_failed_ingest_keeps_the_job_pending(self, tmp_path):
+        """Test a month whose results were not stored is polled again"""
+        backend = LocalBatchBackend(answering({"m1": json.dumps([transaction_result("m1")])}), work_dir=str(tmp_path))
+        job = submit_job(tmp_path, backend, [["m1"]])
+        client = FakeClient(stored={})
+        manager = make_manager(tmp_path, backend, aiManager=FakeAIManager(status=500), client=client, jobs=[job])
+        with pytest.raises(BackfillError):
+            manager.poll()
+        assert job.state == JOB_SUBMITTED
+        assert client.calls == []
+
+
+class TestBackfillState:
+    """Test claiming, loading and storing the backfill through the backend"""
+
+    def test_claim_and_load_round_trip(self):
+        """Test a claimed backfill stores its jobs and loads them back"""
+        client = FakeClient()
+        state = BackfillState.claim(client, "account-1", "task-1", 1800)
+        state.jobs["2025-03"] = BackfillJob("2025-03", name="job-1", emails_uri="gs://bucket/emails.jsonl", request_count=3)
+        state.state = BACKFILL_POLLING
+        state.save()
+
+        loaded = BackfillState.load(client, "account-1")
+        assert loaded.state == BACKFILL_POLLING
+        [job] = loaded.pending_jobs()
+        assert (job.label, job.name, job.emails_uri, job.request_count) == ("2025-03", "job-1", "gs://bucket/emails.jsonl", 3)
+        assert client.calls[0] == ("POST", "api/v1/accounts/account-1/backfill")
+
+    def test_second_claim_is_turned_away(self):
+        """Test claiming an account that already has a backfill returns None"""
+        client = FakeClient(stored={"state": "polling", "jobs": []})
+        assert BackfillState.claim(client, "account-1", "task-2", 1800) is None
+
+    def test_rejected_save_raises(self):
+        """Test a rejected write raises so the task is retried"""
+        state = BackfillState(FakeClient(status_code=500), "account-1")
+        with pytest.raises(BackfillError):
+            state.save()
+
+    def test_load_without_backfill(self):
+        """Test loading returns None for an account that was never backfilled"""
+        assert BackfillState.load(FakeClient(), "account-1") is None
+
+
+@pytest.fixture
+def operations(database_engine):
+    from src.modules.accounts import operations
+    return operations
+
+
+class TestClaimBackfill:
+    """Test the per account backfill lock in the database"""
+
+    def test_one_task_holds_the_backfill(self, db, account_id, operations):
+        """Test a second task is turned away and a retry of the owning task gets the backfill back"""
+        assert operations.claimBackfill(account_id, "task-1", 1800, db).state == "submitting"
+        assert operations.claimBackfill(account_id, "task-2", 1800, db) is None
+        assert operations.claimBackfill(account_id, "task-1", 1800, db).owner == "task-1"
+
+    def test_silent_submission_is_taken_over(self, db, account_id, operations):
+        """Test a submitting backfill whose owner stopped writing goes to the next task with its jobs"""
+        from src.modules.accounts.models import BackfillPayload
+        operations.claimBackfill(account_id, "task-1", 1800, db)
+        operations.saveBackfill(account_id, BackfillPayload(state="submitting", jobs=[{"label": "2025-03", "name": "job-1"}]), db)
+
+        backfill = operations.claimBackfill(account_id, "task-2", 0, db)
+        assert backfill.owner == "task-2"
+        assert backfill.jobs[0]["name"] == "job-1"
+
+    def test_submitted_backfill_is_not_taken_over(self, db, account_id, operations):
+        """Test a backfill past submission is never claimed by another task"""
+        from src.modules.accounts.models import BackfillPayload
+        operations.claimBackfill(account_id, "task-1", 1800, db)
+        operations.saveBackfill(account_id, BackfillPayload(state="completed", jobs=[]), db)
+        assert operations.claimBackfill(account_id, "task-2", 0, db) is None
@@ -0,0 +1,58 @@
+"""
+Tests for the llm batch packer
+Run with: python -m pytest tests/test_batch_packer.py -v
+"""
+
+from worker.batch_packer import MESSAGE_OVERHEAD_TOKENS, BatchPacker, estimate_tokens
+
+
+class TestEstimateTokens:
+    """Test the token estimate"""
+
+    def test_empty_text_is_free(self):
+        """Test missing snippets or bodies cost nothing"""
+        assert estimate_tokens(None) == 0
+        assert estimate_tokens("") == 0
+
+    def test_estimate_grows_with_length(self):
+        """Test about four characters per token plus the message prefix"""
+        assert estimate_tokens("a" * 400) == 100 + MESSAGE_OVERHEAD_TOKENS
+
+
+class TestBatchPacker:
+    """Test packing by budget and item cap"""
+
+    def test_small_items_are_merged_across_calls(self):
+        """Test items from several pages share a batch until the budget is reached"""
+        packer = BatchPacker(max_tokens=100, max_items=10)
+        completed = []
+        for page in range(3):
+            for n in range(3):
+                completed += packer.add(f"p{page}m{n}", (20,))
+        completed += packer.flush()
+        assert completed == [["p0m0", "p0m1", "p0m2", "p1m0", "p1m1"], ["p1m2", "p2m0", "p2m1", "p2m2"]]
+
+    def test_item_cap(self):
+        """Test a batch closes at max_items even under budget"""
+        packer = BatchPacker(max_tokens=1000, max_items=2)
+        completed = []
+        for n in range(5):
+            completed += packer.add(n, (1,))
+        completed += packer.flush()
+        assert completed == [[0, 1], [2, 3], [4]]
+
+    def test_any_prompt_over_budget_closes_the_batch(self):
+        """Test one long order body closes the batch even if snippets are small"""
+        packer = BatchPacker(max_tokens=100, max_items=10)
+        assert packer.add("alert", (10, 10)) == []
+        assert packer.add("receipt", (10, 95)) == [["alert"]]
+        assert packer.flush() == [["receipt"]]
+
+    def test_oversized_item_gets_its_own_batch(self):
+        """Test an item over the budget is still sent, alone"""
+        packer = BatchPacker(max_tokens=100, max_items=10)
+        assert packer.add("small", (10,)) == []
+        assert packer.add("huge", (500,)) == [["small"]]
+        assert packer.add("next", (10,)) == [["huge"]]
+        assert packer.flush() == [["next"]]
+        assert packer.flush() == []
@@ -0,0 +1,124 @@
+"""
+Tests for the worker batch prediction files and backends
+Run with: python -m pytest tests/test_batch_prediction.py -v
+"""
+
+import json
+import time
+from datetime import datetime
+
+from worker.batch_prediction import (
+    JOB_DONE_STATES,
+    JOB_STATE_PARTIALLY_SUCCEEDED,
+    JOB_STATE_SUCCEEDED,
+    LocalBatchBackend,
+    build_request_line,
+    month_shards,
+    read_jsonl,
+    request_message_ids,
+    request_text,
+    response_text,
+    write_jsonl,
+)
+from worker.prompts import Prompt
+
+PROMPT = Prompt("combined", "Extract transactions and orders from each message.")
+
+
+def wait_for(backend, name, timeout=5):
+    deadline = time.monotonic() + timeout
+    while backend.state(name) not in JOB_DONE_STATES:
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return backend.state(name)
+
+
+class TestMonthShards:
+    """Test sharding of the mailbox history by calendar month"""
+
+    def test_shards_are_newest_first_and_contiguous(self):
+        """Test the first shard ends at the cutoff and each shard starts where the previous ended"""
+        shards = month_shards(datetime(2025, 3, 10, 12, 30), 3)
+        assert [shard.label for shard in shards] == ["2025-03", "2025-02", "2025-01"]
+        assert shards[0].before == datetime(2025, 3, 10, 12, 30)
+        assert shards[0].after == datetime(2025, 3, 1)
+        assert shards[1].before == shards[0].after
+        assert shards[2].after == datetime(2025, 1, 1)
+
+    def test_year_boundary(self):
+        """Test shards cross into the previous year"""
+        shards = month_shards(datetime(2025, 1, 20), 2)
+        assert [shard.label for shard in shards] == ["2025-01", "2024-12"]
+        assert shards[1].after == datetime(2024, 12, 1)
+
+    def test_cutoff_on_month_start_skips_empty_shard(self):
+        """Test a cutoff at midnight on the first leaves no empty month"""
+        shards = month_shards(datetime(2025, 3, 1), 2)
+        assert [shard.label for shard in shards] == ["2025-02"]
+
+    def test_query(self):
+        """Test the gmail query bounds the shard with unix timestamps"""
+        shard = month_shards(datetime(2025, 3, 10), 1)[0]
+        query = shard.query("{from:alerts@hdfcbank.net}")
+        assert query == f"{{from:alerts@hdfcbank.net}} after:{int(datetime(2025, 3, 1).timestamp())} before:{int(datetime(2025, 3, 10).timestamp())}"
+        assert shard.query().startswith("after:")
+
+
+class TestRequestLines:
+    """Test the JSONL request and response layout"""
+
+    def test_request_line_round_trip(self, tmp_path):
+        """Test the prompt goes in the system instruction and the message ids can be read back"""
+        line = build_request_line(PROMPT, ["ID m1:\nSnippet: Rs.10 debited", "ID m2:\nSnippet: Your order"])
+        path = str(tmp_path / "shard" / "input.jsonl")
+        write_jsonl(path, [line])
+        [read] = list(read_jsonl(path))
+        assert read["request"]["systemInstruction"]["parts"][0]["text"] == PROMPT.text
+        assert read["request"]["generationConfig"]["responseMimeType"] == "application/json"
+        assert request_message_ids(read["request"]) == ["m1", "m2"]
+        assert request_text(read["request"]).startswith(PROMPT.text + "\n\nID m1:")
+
+    def test_response_text(self):
+        """Test the model output is read from the first candidate and failed lines give None"""
+        line = {"response": {"candidates": [{"content": {"parts": [{"text": '{"results": '}, {"text": "[]}"}]}}]}}
+        assert response_text(line) == '{"results": []}'
+        assert response_text({"status": "RESOURCE_EXHAUSTED"}) is None
+        assert response_text({"response": {"candidates": []}}) is None
+
+
+class TestLocalBatchBackend:
+    """Test the local stand-in for batch prediction"""
+
+    def test_processes_the_file(self, tmp_path):
+        """Test every request is answered and written in the prediction layout"""
+        calls = []
+
+        def generate(model, contents):
+            calls.append(model)
+            return json.dumps({"results": [{"messageId": id, "kind": "other"} for id in ("m1", "m2") if f"ID {id}:" in contents]})
+
+        backend = LocalBatchBackend(generate, work_dir=str(tmp_path))
+        input_path = str(tmp_path / "input.jsonl")
+        write_jsonl(input_path, [build_request_line(PROMPT, ["ID m1:\na"]), build_request_line(PROMPT, ["ID m2:\nb"])])
+        name = backend.submit(input_path, "flash", display_name="backfill-acc-2025-03")
+        assert wait_for(backend, name) == JOB_STATE_SUCCEEDED
+        lines = list(backend.results(name))
+        assert calls == ["flash", "flash"]
+        assert [json.loads(response_text(line))["results"][0]["messageId"] for line in lines] == ["m1", "m2"]
+
+    def test_failed_requests_are_kept(self, tmp_path):
+        """Test a failing request leaves a line without response and a partial job"""
+        def generate(model, contents):
+            if "ID m2:" in contents:
+                raise RuntimeError("quota exceeded")
+            return "[]"
+
+        backend = LocalBatchBackend(generate, work_dir=str(tmp_path))
+        input_path = str(tmp_path / "input.jsonl")
+        write_jsonl(input_path, [build_request_line(PROMPT, ["ID m1:\na"]), build_request_line(PROMPT, ["ID m2:\nb"])])
+        name = backend.submit(input_path, "flash", display_name="backfill")
+        assert wait_for(backend, name) == JOB_STATE_PARTIALLY_SUCCEEDED
+        lines = list(backend.results(name))
+        assert response_text(lines[0]) == "[]"
+        assert response_text(lines[1]) is None
+        assert lines[1]["status"] == "quota exceeded"
@@ -0,0 +1,104 @@
+"""
+Tests for the worker email body extraction
+Run with: python -m pytest tests/test_body_extraction.py -v
+"""
+
+import base64
+
+from worker.body_extraction import (
+    decode_base64url,
+    extract_body_text,
+    find_body_parts,
+    html_to_text,
+    trim_boilerplate,
+)
+
+
+def encode(text: str, charset: str = "utf-8") -> str:
+    return base64.urlsafe_b64encode(text.encode(charset)).decode("ascii").rstrip("=")
+
+
+class TestHtmlToText:
+    """Test single pass html to text conversion"""
+
+    def test_scripts_and_styles_are_removed(self):
+        """Test both script and style content is dropped (the old converter kept scripts)"""
+        html = (
+            "<html><head><title>Alert</title><style>td { color: red; }</style></head>"
+            "<body><script type='text/javascript'>var x = 1;</script><p>Rs. 500 debited</p></body></html>"
+        )
+        text = html_to_text(html)
+        assert text == "Rs. 500 debited"
+
+    def test_blocks_become_lines_and_cells_are_separated(self):
+        """Test table rows keep their cells together on one line"""
+        html = "<table><tr><td>Item</td><td>Qty</td></tr><tr><td>Milk</td><td>2</td></tr></table>"
+        assert html_to_text(html) == "Item | Qty\nMilk | 2"
+
+    def test_entities_and_comments(self):
+        """Test entities are unescaped and comments skipped"""
+        html = "<!-- tracking --><p>Total:&nbsp;&#8377;1,250 &amp; free delivery</p>"
+        assert html_to_text(html) == "Total: ₹1,250 & free delivery"
+
+
+class TestPayloadDecoding:
+    """Test MIME walking and base64url decoding"""
+
+    def test_decode_respects_size_cap(self):
+        """Test only the capped prefix is decoded"""
+        data = encode("a" * 1000)
+        assert decode_base64url(data, max_bytes=10) == b"a" * 10
+        assert decode_base64url(data) == b"a" * 1000
+
+    def test_decode_invalid_data(self):
+        """Test broken data decodes to empty bytes"""
+        assert decode_base64url("!!!") == b""
+        assert decode_base64url(None) == b""
+
+    def test_plain_text_is_preferred_and_attachments_skipped(self):
+        """Test text/plain wins over html and attachment parts are ignored"""
+        payload = {
+            "mimeType": "multipart/mixed",
+            "parts": [
+                {"mimeType": "text/plain", "filename": "statement.txt", "body": {"data": encode("attachment")}},
+                {
+                    "mimeType": "multipart/alternative",
+                    "parts": [
+                        {"mimeType": "text/html", "body": {"data": encode("<p>html body</p>")}},
+                        {"mimeType": "text/plain", "body": {"data": encode("plain body")}},
+                    ],
+                },
+            ],
+        }
+        text_part, html_part = find_body_parts(payload)
+        assert text_part["body"]["data"] == encode("plain body")
+        assert html_part["body"]["data"] == encode("<p>html body</p>")
+        assert extract_body_text(payload) == "plain body"
+
+    def test_charset_from_part_headers(self):
+        """Test non utf-8 bodies are decoded with their declared charset"""
+        payload = {
+            "mimeType": "text/plain",
+            "headers": [{"name": "Content-Type", "value": 'text/plain; charset="iso-8859-1"'}],
+            "body": {"data": encode("Café order", "iso-8859-1")},
+        }
+        assert extract_body_text(payload) == "Café order"
+
+    def test_html_only_payload(self):
+        """Test html is converted when no text part exists"""
+        payload = {"mimeType": "text/html", "body": {"data": encode("<div>Order <b>#123</b> shipped</div>")}}
+        assert extract_body_text(payload) == "Order #123 shipped"
+
+
+class TestBoilerplateTrimming:
+    """Test legal footer removal"""
+
+    def test_footer_is_trimmed(self):
+        """Test everything from the first footer line is cut"""
+        text = "Rs. 500 debited from a/c 1234\nTo VPA shop@ybl\nRef 5123\nThis is a system generated mail\nDisclaimer: ..."
+        assert trim_boilerplate(text) == "Rs. 500 debited from a/c 1234\nTo VPA shop@ybl\nRef 5123"
+
+    def test_footer_words_at_the_top_are_kept(self):
+        """Test footer keywords in the first lines never cut the alert"""
+        text = "Do not reply: Rs. 500 debited\nfrom a/c 1234"
+        assert trim_boilerplate(text) == text
@@ -0,0 +1,112 @@
+"""
+Tests for the COPY based bulk ingest helpers
+Run with: python -m pytest tests/test_bulk_copy.py -v
+"""
+
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from sqlalchemy import Boolean, Column, DateTime, MetaData, String, Table
+
+from src.utils.bulk_copy import (
+    POSTGRES_MAX_PARAMETERS,
+    chunk_rows,
+    copy_insert_ignore,
+    copy_text_buffer,
+    copy_text_value,
+)
+
+
+class TestChunkRows:
+    """Test multi-VALUES inserts stay below the parameter limit"""
+
+    def test_chunks_fit_parameter_limit(self):
+        """Test every chunk has at most 65535 parameters and no row is lost"""
+        rows = [{"id": str(i)} for i in range(20000)]
+        chunks = list(chunk_rows(rows, columns=10))
+        assert all(len(chunk) * 10 <= POSTGRES_MAX_PARAMETERS for chunk in chunks)
+        assert sum(len(chunk) for chunk in chunks) == len(rows)
+        assert len(chunks) == 4
+
+    def test_small_batch_is_one_chunk(self):
+        """Test a batch under the limit is sent as is"""
+        rows = [{"id": "1"}, {"id": "2"}]
+        assert list(chunk_rows(rows, columns=13)) == [rows]
+
+
+class TestCopyText:
+    """Test values are encoded for COPY's text format"""
+
+    def test_null_bool_and_datetime(self):
+        """Test NULL, booleans and datetimes use the text format spelling"""
+        assert copy_text_value(None) == "\\N"
+        assert copy_text_value(True) == "t"
+        assert copy_text_value(False) == "f"
+        assert copy_text_value(datetime(2026, 1, 2, 3, 4, tzinfo=timezone.utc)) == "2026-01-02T03:04:00+00:00"
+        assert copy_text_value(12.5) == "12.5"
+
+    def test_control_characters_are_escaped(self):
+        """Test tabs, newlines and backslashes in snippets cannot break a row"""
+        assert copy_text_value("a\tb\nc\rd\\e") == "a\\tb\\nc\\rd\\\\e"
+        assert copy_text_value("") == ""
+
+    def test_buffer_follows_column_order(self):
+        """Test one line per row with columns in the given order"""
+        buffer = copy_text_buffer([{"b": 2, "a": "x"}, {"a": None, "b": 3}], ["a", "b"])
+        assert buffer.read() == "x\t2\n\\N\t3\n"
+
+
+class FakeCursor:
+    def __init__(self):
+        self.statements = []
+        self.copied = []
+        self.rowcount = 0
+
+    def execute(self, sql):
+        self.statements.append(sql)
+        if sql.startswith("INSERT"):
+            self.rowcount = sum(len(buffer.splitlines()) for buffer in self.copied)
+
+    def copy_expert(self, sql, buffer):
+        self.statements.append(sql)
+        self.copied.append(buffer.read())
+
+    def close(self):
+        pass
+
+
+class FakeSession:
+    """Exposes the cursor the way Session.connection().connection (the DBAPI connection) does"""
+
+    def __init__(self, cursor):
+        self.connection_cursor = cursor
+
+    def connection(self):
+        return SimpleNamespace(connection=SimpleNamespace(cursor=lambda: self.connection_cursor))
+
+
+class TestCopyInsertIgnore:
+    """Test rows are staged with COPY and merged with one insert"""
+
+    def test_stage_copy_merge(self):
+        """Test staging table, COPY chunks and the conflict skipping merge"""
+        table = Table(
+            "emails",
+            MetaData(),
+            Column("id", String, primary_key=True),
+            Column("snippet", String),
+            Column("date_time", DateTime),
+            Column("is_read", Boolean),
+        )
+        cursor = FakeCursor()
+        session = FakeSession(cursor)
+        rows = [{"id": f"m{i}", "snippet": "Rs.10\tdebited", "date_time": None} for i in range(3)]
+
+        assert copy_insert_ignore(session, table, rows, ["id"]) == 3
+        create, copy, merge, drop = cursor.statements
+        assert create.startswith("CREATE TEMP TABLE staging_emails_") and "ON COMMIT DROP" in create
+        assert copy.startswith("COPY staging_emails_") and '("id", "snippet", "date_time")' in copy
+        assert merge.startswith('INSERT INTO "emails" ("id", "snippet", "date_time") SELECT')
+        assert merge.endswith('ON CONFLICT ("id") DO NOTHING')
+        assert drop.startswith("DROP TABLE staging_emails_")
+        assert cursor.copied == ["m0\tRs.10\\tdebited\t\\N\nm1\tRs.10\\tdebited\t\\N\nm2\tRs.10\\tdebited\t\\N\n"]
@@ -0,0 +1,153 @@
+"""
+Tests for the worker sync checkpoint
+Run with: python -m pytest tests/test_checkpoint.py -v
+"""
+
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from worker import checkpoint as checkpoint_module
+from worker.checkpoint import SyncCheckpoint, flush_active_checkpoints, register_checkpoint, unregister_checkpoint
+
+
+class FakeClient:
+    """Stores the checkpoint the way mb-backend does and records every call"""
+
+    def __init__(self, stored=None, status_code=200):
+        self.stored = stored
+        self.status_code = status_code
+        self.calls = []
+
+    def get(self, path, **kwargs):
+        self.calls.append(("GET", path))
+        if self.stored is None:
+            return SimpleNamespace(status_code=404, json=lambda: {}, text="not found")
+        return SimpleNamespace(status_code=200, json=lambda: dict(self.stored), text="")
+
+    def put(self, path, json=None, **kwargs):
+        self.calls.append(("PUT", path))
+        if self.status_code == 200:
+            self.stored = json
+        return SimpleNamespace(status_code=self.status_code, text="error")
+
+    def delete(self, path, **kwargs):
+        self.calls.append(("DELETE", path))
+        self.stored = None
+        return SimpleNamespace(status_code=200, text="")
+
+
+def received(hour):
+    return datetime(2026, 1, 1, hour, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def checkpoint():
+    return SyncCheckpoint(FakeClient(), "account-1", query="after:2025/12/31", sync_history_id="900")
+
+
+class TestProgress:
+    """Test listing and committing pages"""
+
+    def test_listed_ids_are_in_flight_in_order(self, checkpoint):
+        """Test listed ids stay in flight in listing order with the next page token"""
+        checkpoint.listed(["c", "a"], "token-2")
+        checkpoint.listed(["b"], None)
+        assert checkpoint.in_flight_ids() == ["c", "a", "b"]
+        assert checkpoint.page_token is None
+        assert checkpoint.listing_complete is True
+
+    def test_commit_removes_ids_and_raises_watermark(self, checkpoint):
+        """Test committed ids leave the in flight set and the watermark only moves forward"""
+        checkpoint.listed(["a", "b", "c"], "token-2")
+        checkpoint.commit(["a", "b"], [received(10), None, received(8)], stored=True)
+        checkpoint.commit(["c"], [received(5)], stored=True)
+        assert checkpoint.in_flight_ids() == []
+        assert checkpoint.watermark == received(10)
+        assert checkpoint.pages_committed == 2
+
+    def test_skipped_ids_do_not_count_as_pages(self, checkpoint):
+        """Test ids committed without storing leave the watermark and page count alone"""
+        checkpoint.listed(["a", "b"], None)
+        checkpoint.commit(["a"])
+        assert checkpoint.in_flight_ids() == ["b"]
+        assert checkpoint.watermark is None
+        assert checkpoint.pages_committed == 0
+
+    def test_restart_listing_drops_position(self, checkpoint):
+        """Test restarting the listing clears the page token and keeps in flight ids"""
+        checkpoint.listed(["a"], "token-2")
+        checkpoint.restart_listing(None)
+        assert checkpoint.page_token is None
+        assert checkpoint.listing_complete is False
+        assert checkpoint.in_flight_ids() == ["a"]
+
+
+class TestPersistence:
+    """Test storing and loading checkpoints through the backend"""
+
+    def test_flush_round_trips_through_load(self, checkpoint):
+        """Test a flushed checkpoint loads back as a resumed checkpoint"""
+        checkpoint.listed(["a", "b"], "token-2")
+        checkpoint.commit(["a"], [received(10)], stored=True)
+        assert checkpoint.flush() is True
+
+        loaded = SyncCheckpoint.load(checkpoint.client, "account-1")
+        assert loaded.resumed is True
+        assert loaded.query == "after:2025/12/31"
+        assert loaded.sync_history_id == "900"
+        assert loaded.page_token == "token-2"
+        assert loaded.in_flight_ids() == ["b"]
+        assert loaded.watermark == received(10)
+        assert loaded.pages_committed == 1
+
+    def test_flush_skips_unchanged_state(self, checkpoint):
+        """Test flushing twice without changes writes once"""
+        checkpoint.listed(["a"], None)
+        checkpoint.flush()
+        checkpoint.flush()
+        assert [method for method, _ in checkpoint.client.calls] == ["PUT"]
+
+    def test_failed_flush_is_retried(self):
+        """Test a rejected write is sent again by the next flush"""
+        client = FakeClient(status_code=500)
+        checkpoint = SyncCheckpoint(client, "account-1", query="")
+        assert checkpoint.flush() is False
+        client.status_code = 200
+        assert checkpoint.flush() is True
+        assert len(client.calls) == 2
+
+    def test_load_without_checkpoint(self):
+        """Test loading returns None when the last sync completed"""
+        assert SyncCheckpoint.load(FakeClient(), "account-1") is None
+
+    def test_load_treats_naive_watermark_as_utc(self):
+        """Test a watermark stored without a zone is read as UTC"""
+        client = FakeClient(stored={"query": "", "watermark": "2026-01-01T10:00:00", "inFlightIds": None})
+        loaded = SyncCheckpoint.load(client, "account-1")
+        assert loaded.watermark == received(10)
+        assert loaded.in_flight_ids() == []
+
+    def test_clear_deletes_checkpoint(self, checkpoint):
+        """Test clearing removes the stored checkpoint"""
+        checkpoint.flush()
+        checkpoint.clear()
+        assert checkpoint.client.stored is None
+        assert checkpoint.client.calls[-1] == ("DELETE", "api/v1/accounts/account-1/sync-checkpoint")
+
+
+class TestActiveCheckpoints:
+    """Test the shutdown flush of running syncs"""
+
+    def test_flush_active_checkpoints(self, monkeypatch):
+        """Test every registered checkpoint is written and unregistered ones are not"""
+        monkeypatch.setattr(checkpoint_module, "ACTIVE_CHECKPOINTS", set())
+        running = SyncCheckpoint(FakeClient(), "account-1", query="")
+        finished = SyncCheckpoint(FakeClient(), "account-2", query="")
+        register_checkpoint(running)
+        register_checkpoint(finished)
+        unregister_checkpoint(finished)
+
+        assert flush_active_checkpoints() == 1
+        assert running.client.stored is not None
+        assert finished.client.stored is None
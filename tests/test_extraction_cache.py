@@ -0,0 +1,96 @@
+"""
+Tests for the worker llm extraction cache
+Run with: python -m pytest tests/test_extraction_cache.py -v
+"""
+
+import time
+
+import pytest
+from worker.extraction_cache import CachedBatch, ExtractionCache, content_hash
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ExtractionCache(str(tmp_path / "cache" / "extraction.sqlite3"), max_entries=10, ttl_seconds=60)
+
+
+class TestContentHash:
+    """Test message normalization before hashing"""
+
+    def test_whitespace_and_case_are_ignored(self):
+        """Test re-wrapped copies of the same alert share a key"""
+        assert content_hash("Rs. 500  debited\nfrom A/C 1234", "v1") == content_hash("rs. 500 debited from a/c 1234 ", "v1")
+
+    def test_prompt_version_and_amount_change_the_key(self):
+        """Test a different prompt or different content never shares a key"""
+        assert content_hash("Rs. 500 debited", "v1") != content_hash("Rs. 500 debited", "v2")
+        assert content_hash("Rs. 500 debited", "v1") != content_hash("Rs. 501 debited", "v1")
+
+
+class TestExtractionCache:
+    """Test persistence, eviction and counters"""
+
+    def test_round_trip_and_hit_rate(self, cache):
+        """Test stored values are returned and lookups are counted"""
+        cache.put_many({"a": [{"amount": 1}], "b": []})
+        assert cache.get_many(["a", "b", "c"]) == {"a": [{"amount": 1}], "b": []}
+        assert cache.stats() == {"hits": 2, "misses": 1, "hit_rate": 2 / 3}
+
+    def test_values_survive_reopening(self, cache):
+        """Test the cache is persistent"""
+        cache.put_many({"a": [{"amount": 1}]})
+        reopened = ExtractionCache(cache.path)
+        assert reopened.get_many(["a"]) == {"a": [{"amount": 1}]}
+
+    def test_expired_entries_are_ignored(self, cache):
+        """Test entries older than the ttl are misses"""
+        cache.put_many({"a": []})
+        cache.ttl_seconds = 0
+        time.sleep(0.01)
+        assert cache.get_many(["a"]) == {}
+
+    def test_least_recently_used_entries_are_evicted(self, cache):
+        """Test the cache trims itself to max_entries keeping recently read keys"""
+        cache.put_many({f"old{n}": [] for n in range(9)})
+        cache.put_many({"keep": []})
+        time.sleep(0.01)
+        cache.get_many(["keep"])
+        cache.put_many({"new": []})
+        found = cache.get_many(["keep", "new"] + [f"old{n}" for n in range(9)])
+        assert "keep" in found and "new" in found
+        assert len(found) <= cache.max_entries
+
+
+class TestCachedBatch:
+    """Test splitting batches into hits and misses"""
+
+    def test_only_unique_misses_go_to_the_llm(self, cache):
+        """Test cached and duplicate messages are not sent again"""
+        cache.put_many({content_hash("cached alert", "v1"): [{"amount": 10}]})
+        batch = CachedBatch(cache, [("m1", "cached alert"), ("m2", "new alert"), ("m3", "New  alert")], "v1")
+        assert batch.miss_ids == ["m2"]
+
+        items = batch.resolve([{"id": "m2", "amount": 20}])
+        assert items == [{"id": "m1", "amount": 10}, {"id": "m2", "amount": 20}, {"id": "m3", "amount": 20}]
+
+        again = CachedBatch(cache, [("m4", "new alert"), ("m5", "cached alert")], "v1")
+        assert again.miss_ids == []
+        assert again.resolve(None) == [{"id": "m4", "amount": 20}, {"id": "m5", "amount": 10}]
+
+    def test_messages_without_items_are_cached_as_empty(self, cache):
+        """Test non financial mails cost nothing on the next sync"""
+        batch = CachedBatch(cache, [("m1", "otp is 1234")], "v1", id_field="messageId")
+        assert batch.resolve([]) == []
+        assert CachedBatch(cache, [("m2", "otp is 1234")], "v1").miss_ids == []
+
+    def test_unparsable_llm_output_is_not_cached(self, cache):
+        """Test a failed llm call is retried on the next sync"""
+        batch = CachedBatch(cache, [("m1", "alert")], "v1")
+        assert batch.resolve(None) == []
+        assert CachedBatch(cache, [("m1", "alert")], "v1").miss_ids == ["m1"]
+
+    def test_works_without_cache(self):
+        """Test batching still dedupes when caching is disabled"""
+        batch = CachedBatch(None, [("m1", "alert"), ("m2", "alert")], "v1")
+        assert batch.miss_ids == ["m1"]
+        assert batch.resolve([{"id": "m1", "amount": 5}]) == [{"id": "m1", "amount": 5}, {"id": "m2", "amount": 5}]
@@ -0,0 +1,115 @@
+"""
+Tests for the email extraction status and the dead letter replay queries (needs PostgreSQL, see conftest.py)
+Run with: TEST_DATABASE_URL=... python -m pytest tests/test_extraction_status.py -v
+"""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+from packages.models import EmailSanitized
+
+
+def make_email(id, received_at=datetime(2025, 7, 4, 10)):
+    return EmailSanitized(
+        id=id,
+        threadId=f"t-{id}",
+        emailSender="HDFC Bank",
+        emailId="alerts@hdfcbank.net",
+        subject="Alert",
+        snippet="Rs.65.00 has been debited",
+        body="",
+        receivedAt=received_at,
+    )
+
+
+@pytest.fixture
+def emails(db, account_id):
+    from src.modules.emails.operations import insertEmails
+
+    stored = [make_email(f"m{i}", datetime(2025, 7, 4, 10) + timedelta(minutes=i)) for i in range(3)]
+    assert insertEmails(account_id, stored, db) == 3
+    return stored
+
+
+def statuses(db, account_id):
+    from src.modules.emails.model import EmailMessageORM
+
+    rows = db.query(EmailMessageORM).filter(EmailMessageORM.accountId == account_id).all()
+    return {row.id: (row.extraction_status, row.extraction_attempts, row.extraction_error) for row in rows}
+
+
+def failure(id, error):
+    from src.modules.emails.model import EmailExtractionFailure
+
+    return EmailExtractionFailure(id=id, error=error)
+
+
+class TestExtractionStatus:
+    """Test the pending, failed and parsed transitions of stored emails"""
+
+    def test_new_emails_are_pending(self, db, account_id, emails):
+        """Test inserted emails start pending with no attempts"""
+        assert set(statuses(db, account_id).values()) == {("pending", 0, None)}
+
+    def test_failures_count_attempts_and_parses_do_not(self, db, account_id, emails):
+        """Test only failed extractions increment the attempt count"""
+        from src.modules.emails.operations import updateExtractionStatus
+
+        assert updateExtractionStatus(account_id, ["m0"], [failure("m1", "missing amount")], db) == (1, 1)
+        assert updateExtractionStatus(account_id, [], [failure("m1", "no result in llm response")], db) == (0, 1)
+        result = statuses(db, account_id)
+        assert result["m0"] == ("parsed", 0, None)
+        assert result["m1"] == ("failed", 2, "no result in llm response")
+        assert result["m2"] == ("pending", 0, None)
+
+    def test_replayed_email_parses_and_keeps_failure_count(self, db, account_id, emails):
+        """Test a failed email that parses on replay becomes parsed and its error is cleared"""
+        from src.modules.emails.operations import updateExtractionStatus
+
+        updateExtractionStatus(account_id, [], [failure("m1", "invalid json")], db)
+        updateExtractionStatus(account_id, ["m1"], [], db)
+        assert statuses(db, account_id)["m1"] == ("parsed", 1, None)
+
+    def test_errors_are_truncated(self, db, account_id, emails):
+        """Test a long error is stored cut to the dead letter limit"""
+        from src.modules.emails.operations import EXTRACTION_ERROR_MAX_LENGTH, updateExtractionStatus
+
+        updateExtractionStatus(account_id, [], [failure("m0", "x" * 5000)], db)
+        assert len(statuses(db, account_id)["m0"][2]) == EXTRACTION_ERROR_MAX_LENGTH
+
+    def test_other_accounts_are_untouched(self, db, account_id, emails):
+        """Test a status update only matches the given account"""
+        import uuid
+
+        from src.modules.emails.operations import updateExtractionStatus
+
+        assert updateExtractionStatus(uuid.uuid4(), ["m0"], [failure("m1", "error")], db) == (0, 0)
+        assert set(statuses(db, account_id).values()) == {("pending", 0, None)}
+
+
+class TestDeadLetterReplay:
+    """Test which emails the replay picks up"""
+
+    def test_failed_emails_below_the_attempt_limit(self, db, account_id, emails):
+        """Test replay lists failed emails oldest first and drops those at the attempt limit"""
+        from src.modules.emails.operations import getFailedEmails, updateExtractionStatus
+
+        updateExtractionStatus(account_id, ["m0"], [failure("m2", "error"), failure("m1", "error")], db)
+        assert [email.id for email in getFailedEmails(account_id, 3, db)] == ["m1", "m2"]
+
+        for _ in range(2):
+            updateExtractionStatus(account_id, [], [failure("m1", "error")], db)
+        assert [email.id for email in getFailedEmails(account_id, 3, db)] == ["m2"]
+        assert [email.id for email in getFailedEmails(account_id, 3, db, limit=1)] == ["m2"]
+
+    def test_existing_statuses_skip_known_emails(self, db, account_id, emails):
+        """Test the sync sees parsed and failed emails as known and pending ones as unprocessed"""
+        from src.modules.emails.operations import getExistingEmailStatuses, updateExtractionStatus
+
+        updateExtractionStatus(account_id, ["m0"], [failure("m1", "error")], db)
+        assert getExistingEmailStatuses(account_id, ["m0", "m1", "m2", "unknown"], db) == {
+            "m0": "parsed",
+            "m1": "failed",
+            "m2": "pending",
+        }
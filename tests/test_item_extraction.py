@@ -0,0 +1,92 @@
+"""
+Tests for validated llm item extraction with per message retries
+Run with: python -m pytest tests/test_item_extraction.py -v
+"""
+
+from worker.item_extraction import extract_items_with_retries, response_items
+from worker.stream_parser import ItemParseError
+
+
+def validate(item, message_ids):
+    if item["id"] not in message_ids:
+        return f"unknown message id {item['id']}"
+    if item.get("amount") is None:
+        return "missing amount"
+    return None
+
+
+class ScriptedLLM:
+    """Returns the scripted responses in order and records the ids of every call"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def __call__(self, message_ids):
+        self.calls.append(list(message_ids))
+        return self.responses.pop(0)
+
+
+class TestResponseItems:
+    """Test reading items from structured and raw responses"""
+
+    def test_structured_response(self):
+        """Test streamed items are returned with their completeness"""
+        assert response_items({"items": [{"id": "m1"}], "complete": False}) == ([{"id": "m1"}], False)
+
+    def test_raw_response_in_code_fence_and_wrapper(self):
+        """Test raw output in a code fence and a wrapper object is unpacked"""
+        raw = '```json\n{"orders": [{"messageId": "m1"}]}\n```'
+        assert response_items({"raw_model_output": raw}) == ([{"messageId": "m1"}], True)
+
+    def test_unparseable_raw_response(self):
+        """Test output that is not json counts as an incomplete empty response"""
+        assert response_items({"raw_model_output": "sorry, I cannot help"}) == ([], False)
+
+
+class TestExtractItemsWithRetries:
+    """Test validation, retries and the per message errors returned for the dead letter store"""
+
+    def test_valid_items_need_one_call(self):
+        """Test a fully valid response is returned without retries"""
+        llm = ScriptedLLM({"items": [{"id": "m1", "amount": 1.0}, {"id": "m2", "amount": 2.0}], "complete": True})
+        items, failed = extract_items_with_retries(["m1", "m2"], llm, validate, max_retries=2)
+        assert [item["id"] for item in items] == ["m1", "m2"]
+        assert failed == {}
+        assert llm.calls == [["m1", "m2"]]
+
+    def test_only_failed_messages_are_retried(self):
+        """Test a message with an invalid item is sent again on its own and its retry result is kept"""
+        llm = ScriptedLLM(
+            {"items": [{"id": "m1", "amount": 1.0}, {"id": "m2"}], "complete": True},
+            {"items": [{"id": "m2", "amount": 2.0}], "complete": True},
+        )
+        items, failed = extract_items_with_retries(["m1", "m2"], llm, validate, max_retries=1)
+        assert {item["id"]: item["amount"] for item in items} == {"m1": 1.0, "m2": 2.0}
+        assert failed == {}
+        assert llm.calls == [["m1", "m2"], ["m2"]]
+
+    def test_exhausted_retries_return_last_error_per_message(self):
+        """Test every message still failing is returned with its own last error"""
+        llm = ScriptedLLM(
+            {"items": [{"id": "m1"}, ItemParseError('{"id": "m2", "amount": 1', ValueError("truncated")), {"id": "m3", "amount": 3.0}], "complete": True},
+            {"items": [{"id": "m1"}], "complete": False},
+        )
+        items, failed = extract_items_with_retries(["m1", "m2", "m3"], llm, validate, max_retries=1)
+        assert [item["id"] for item in items] == ["m3"]
+        assert failed == {"m1": "missing amount", "m2": "no result in llm response"}
+        assert llm.calls == [["m1", "m2", "m3"], ["m1", "m2"]]
+
+    def test_incomplete_response_fails_uncovered_messages(self):
+        """Test messages a broken stream never reached fail without retries left"""
+        llm = ScriptedLLM({"items": [{"id": "m1", "amount": 1.0}], "complete": False})
+        items, failed = extract_items_with_retries(["m1", "m2"], llm, validate, max_retries=0)
+        assert [item["id"] for item in items] == ["m1"]
+        assert failed == {"m2": "no result in llm response"}
+
+    def test_items_for_unknown_messages_are_dropped(self):
+        """Test an item for a message that was not sent is dropped and does not fail the batch"""
+        llm = ScriptedLLM({"items": [{"id": "m1", "amount": 1.0}, {"id": "other", "amount": 2.0}], "complete": True})
+        items, failed = extract_items_with_retries(["m1"], llm, validate)
+        assert [item["id"] for item in items] == ["m1"]
+        assert failed == {}
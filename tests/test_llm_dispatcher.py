@@ -0,0 +1,226 @@
+"""
+Tests for the worker async llm dispatcher
+Run with: python -m pytest tests/test_llm_dispatcher.py -v
+"""
+
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+from worker.llm_dispatcher import LatencyTracker, LLMDispatcher, PartialStreamError, TokenRateLimiter, is_retryable
+from worker.stream_parser import StreamedItems
+
+
+class APIError(Exception):
+    """Carries an http status code like google.genai.errors.APIError"""
+
+    def __init__(self, code):
+        super().__init__(f"status {code}")
+        self.code = code
+
+
+def response(text, prompt_tokens=8, output_tokens=2):
+    usage = types.SimpleNamespace(
+        prompt_token_count=prompt_tokens, candidates_token_count=output_tokens, total_token_count=prompt_tokens + output_tokens
+    )
+    return types.SimpleNamespace(text=text, usage_metadata=usage)
+
+
+class FakeModels:
+    """Async stand-in for client.aio.models with scripted failures and delays"""
+
+    def __init__(self, failures=(), delays=(), chunks=("[", "]")):
+        self.failures = list(failures)
+        self.delays = list(delays)
+        self.chunks = chunks
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    async def before_call(self):
+        with self.lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            delay = self.delays.pop(0) if self.delays else 0.01
+            failure = self.failures.pop(0) if self.failures else None
+        try:
+            await asyncio.sleep(delay)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+        if failure:
+            raise failure
+
+    async def generate_content(self, model, contents, config=None):
+        await self.before_call()
+        return response(f"{model}:{contents}")
+
+    async def generate_content_stream(self, model, contents, config=None):
+        await self.before_call()
+
+        async def stream():
+            for chunk in self.chunks:
+                if isinstance(chunk, Exception):
+                    raise chunk
+                yield response(chunk)
+        return stream()
+
+
+def dispatcher_for(models, **kwargs):
+    options = {"retry_base_delay": 0.001, "retry_max_delay": 0.01, "hedge": False}
+    options.update(kwargs)
+    return LLMDispatcher(models, **options)
+
+
+class TestRetries:
+    """Test backoff and retry classification"""
+
+    def test_retryable_errors(self):
+        """Test quota, server and timeout errors are retried and client errors are not"""
+        assert is_retryable(APIError(429))
+        assert is_retryable(APIError(503))
+        assert is_retryable(TimeoutError())
+        assert not is_retryable(APIError(400))
+        assert not is_retryable(ValueError("bad schema"))
+
+    def test_transient_errors_are_retried(self):
+        """Test the call succeeds after transient failures"""
+        models = FakeModels(failures=[APIError(429), APIError(500)])
+        dispatcher = dispatcher_for(models)
+        assert dispatcher.generate_content(model="m", contents="hi").text == "m:hi"
+        assert models.calls == 3
+        assert dispatcher.stats()["retries"] == 2
+
+    def test_client_errors_and_exhausted_retries_raise(self):
+        """Test a client error fails at once and retries stop at the limit"""
+        models = FakeModels(failures=[APIError(400)])
+        with pytest.raises(APIError):
+            dispatcher_for(models).generate_content(model="m", contents="hi")
+        assert models.calls == 1
+
+        models = FakeModels(failures=[APIError(503)] * 5)
+        with pytest.raises(APIError):
+            dispatcher_for(models, max_retries=2).generate_content(model="m", contents="hi")
+        assert models.calls == 3
+
+
+class TestStreaming:
+    """Test streamed calls"""
+
+    def test_chunks_are_returned_in_order(self):
+        """Test every chunk of a stream is returned"""
+        models = FakeModels(chunks=("[{", '"a": 1}', "]"))
+        responses = dispatcher_for(models).generate_content_stream(model="m", contents="hi")
+        assert "".join(r.text for r in responses) == '[{"a": 1}]'
+
+    def test_broken_stream_returns_partial_chunks(self):
+        """Test a stream breaking midway is not retried and keeps what arrived"""
+        models = FakeModels(chunks=("[{}", ConnectionError("reset")))
+        with pytest.raises(PartialStreamError) as error:
+            dispatcher_for(models).generate_content_stream(model="m", contents="hi")
+        assert [r.text for r in error.value.responses] == ["[{}"]
+        assert models.calls == 1
+
+    def test_consumer_parses_chunks_as_they_arrive(self):
+        """Test items are parsed while the stream is still open and the consumer is returned"""
+        items_seen = []
+
+        class RecordingItems(StreamedItems):
+            def feed(self, response):
+                super().feed(response)
+                items_seen.append(len(self.items))
+
+        models = FakeModels(chunks=('[{"a": 1}', ', {"a": 2}', "]"))
+        streamed = dispatcher_for(models).generate_content_stream(model="m", contents="hi", consumer=RecordingItems)
+        assert items_seen == [1, 2, 2]
+        assert streamed.items == [{"a": 1}, {"a": 2}]
+        assert streamed.complete is True
+
+    def test_broken_stream_keeps_parsed_items(self):
+        """Test a broken stream hands back the consumer with the items parsed so far"""
+        models = FakeModels(chunks=('[{"a": 1}, {"a"', ConnectionError("reset")))
+        with pytest.raises(PartialStreamError) as error:
+            dispatcher_for(models).generate_content_stream(model="m", contents="hi", consumer=StreamedItems)
+        assert error.value.result.items == [{"a": 1}]
+        assert error.value.result.complete is False
+
+    def test_settles_input_tokens_only(self):
+        """Test the token bucket is charged the prompt tokens, not the output tokens"""
+        dispatcher = dispatcher_for(FakeModels(), tokens_per_minute=100000)
+        dispatcher.generate_content(model="m", contents="x" * 400)
+        # 8 prompt tokens charged, the 10 total tokens would leave less, refill over a few ms adds a little
+        assert 100000 - 9 < dispatcher.limiter.available <= 100000
+
+
+class TestConcurrency:
+    """Test the global semaphore and the token limiter"""
+
+    def test_semaphore_bounds_requests_from_all_threads(self):
+        """Test threads of several syncs never exceed the global limit"""
+        models = FakeModels(delays=[0.05] * 12)
+        dispatcher = dispatcher_for(models, max_concurrency=3)
+        threads = [
+            threading.Thread(target=dispatcher.generate_content, kwargs={"model": "m", "contents": str(i)})
+            for i in range(12)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert models.calls == 12
+        assert models.max_in_flight == 3
+
+    def test_async_callers(self):
+        """Test callers on another event loop can await the dispatcher"""
+        dispatcher = dispatcher_for(FakeModels())
+
+        async def main():
+            return await asyncio.gather(*(dispatcher.agenerate_content(model="m", contents=str(i)) for i in range(3)))
+        assert [r.text for r in asyncio.run(main())] == ["m:0", "m:1", "m:2"]
+
+    def test_token_limiter_waits_for_refill(self):
+        """Test a request over the remaining minute budget waits for the bucket to refill"""
+        limiter = TokenRateLimiter(tokens_per_minute=6000)
+
+        async def main():
+            await limiter.acquire(6000)
+            start = time.monotonic()
+            await limiter.acquire(20)
+            return time.monotonic() - start
+        assert asyncio.run(main()) >= 0.15
+        assert limiter.waited_seconds > 0
+
+    def test_token_limiter_settles_real_usage(self):
+        """Test reported usage above the estimate is charged to the bucket"""
+        limiter = TokenRateLimiter(tokens_per_minute=1000)
+        limiter.settle(reserved=100, used=400)
+        assert limiter.available <= 700
+
+
+class TestHedging:
+    """Test hedged duplicate requests"""
+
+    def test_percentile_needs_samples(self):
+        """Test there is no threshold until enough latencies are known"""
+        tracker = LatencyTracker(min_samples=3)
+        tracker.add(1.0)
+        assert tracker.percentile(0.95) is None
+        for seconds in (0.1, 0.2, 0.3):
+            tracker.add(seconds)
+        assert tracker.percentile(0.95) == 1.0
+
+    def test_slow_request_is_hedged(self):
+        """Test a request running past p95 gets a duplicate and the faster response wins"""
+        models = FakeModels(delays=[0.01] * 5 + [1.0, 0.01])
+        dispatcher = dispatcher_for(models, hedge=True, hedge_min_samples=5)
+        for i in range(5):
+            dispatcher.generate_content(model="m", contents=str(i))
+        start = time.monotonic()
+        assert dispatcher.generate_content(model="m", contents="slow").text == "m:slow"
+        assert time.monotonic() - start < 0.5
+        assert dispatcher.stats()["hedges"] == 1
+        assert dispatcher.stats()["hedge_wins"] == 1
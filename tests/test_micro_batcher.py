@@ -0,0 +1,191 @@
+"""
+Tests for the worker cross-account llm micro-batcher
+Run with: python -m pytest tests/test_micro_batcher.py -v
+"""
+
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import pytest
+from worker.micro_batcher import MicroBatcher
+from worker.stream_parser import ItemParseError
+
+
+def parse(response):
+    return response["items"], response["complete"]
+
+
+class FakeLLM:
+    """Echoes one item per message id it was sent and records every request"""
+
+    def __init__(self, fail=False):
+        self.requests = []
+        self.lock = threading.Lock()
+        self.fail = fail
+
+    def send(self, messages):
+        with self.lock:
+            self.requests.append(list(messages))
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        items = []
+        for message in messages:
+            message_id = re.match(r"ID ([^:]+):", message).group(1)
+            items.append({"id": message_id, "amount": float(message.split()[-1])})
+        return {"items": items, "complete": True}
+
+
+@contextmanager
+def request_in_flight(batcher):
+    """Keep another account's request for the prompt in flight, so new batches open a window"""
+    release = threading.Event()
+
+    def send(messages):
+        release.wait()
+        return {"items": [], "complete": True}
+
+    thread = threading.Thread(target=batcher.submit, args=("transactions", "acc-busy", ["ID busy:\nRs. 0"], send, parse))
+    thread.start()
+    while not batcher.active.get("transactions"):
+        time.sleep(0.001)
+    try:
+        yield
+    finally:
+        release.set()
+        thread.join()
+
+
+def submit_concurrently(batcher, llm, submissions):
+    """Submit each (account, messages) pair from its own thread while another request is in flight"""
+    results = [None] * len(submissions)
+    barrier = threading.Barrier(len(submissions))
+
+    def run(index, account_id, messages):
+        barrier.wait()
+        results[index] = batcher.submit("transactions", account_id, messages, llm.send, parse)
+
+    with request_in_flight(batcher):
+        threads = [threading.Thread(target=run, args=(i, *submission)) for i, submission in enumerate(submissions)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    return results
+
+
+class TestMicroBatcher:
+    """Test batching across callers and routing of results"""
+
+    def test_concurrent_callers_share_one_request(self):
+        """Test submissions within the window go out together and each caller gets its own items"""
+        batcher = MicroBatcher(window_seconds=0.2, max_items=25)
+        llm = FakeLLM()
+        results = submit_concurrently(batcher, llm, [
+            ("acc-1", ["ID m1:\nRs. 100"]),
+            ("acc-2", ["ID m2:\nRs. 200", "ID m3:\nRs. 300"]),
+            ("acc-3", ["ID m4:\nRs. 400"]),
+        ])
+        assert len(llm.requests) == 1
+        assert len(llm.requests[0]) == 4
+        assert [item["id"] for item in results[0]["items"]] == ["m1"]
+        assert {item["id"]: item["amount"] for item in results[1]["items"]} == {"m2": 200.0, "m3": 300.0}
+        assert results[1]["input_messages"] == ["ID m2:\nRs. 200", "ID m3:\nRs. 300"]
+        assert batcher.stats()["requests"] == 2
+
+    def test_full_sync_batches_of_two_accounts_share_one_request(self):
+        """Test two batches filled by the per-sync packer (25 emails) go out as one request"""
+        batcher = MicroBatcher(window_seconds=0.2, max_items=100)
+        llm = FakeLLM()
+        first, second = submit_concurrently(batcher, llm, [
+            ("acc-1", [f"ID a{i}:\nRs. {i}" for i in range(25)]),
+            ("acc-2", [f"ID b{i}:\nRs. {i}" for i in range(25)]),
+        ])
+        assert [len(request) for request in llm.requests] == [50]
+        assert [item["id"] for item in first["items"]] == [f"a{i}" for i in range(25)]
+        assert [item["id"] for item in second["items"]] == [f"b{i}" for i in range(25)]
+        assert first["batched_with"] == second["batched_with"] == 1
+
+    def test_same_message_id_in_two_accounts(self):
+        """Test the tags keep equal ids from different mailboxes apart"""
+        batcher = MicroBatcher(window_seconds=0.2)
+        llm = FakeLLM()
+        first, second = submit_concurrently(batcher, llm, [
+            ("acc-1", ["ID m1:\nRs. 100"]),
+            ("acc-2", ["ID m1:\nRs. 900"]),
+        ])
+        assert len(llm.requests) == 1
+        assert first["items"] == [{"id": "m1", "amount": 100.0}]
+        assert second["items"] == [{"id": "m1", "amount": 900.0}]
+
+    def test_item_cap_starts_a_new_request(self):
+        """Test a full batch is sent without waiting and the overflow goes into the next one"""
+        batcher = MicroBatcher(window_seconds=0.2, max_items=2)
+        llm = FakeLLM()
+        results = submit_concurrently(batcher, llm, [
+            ("acc-1", ["ID a:\nRs. 1"]),
+            ("acc-2", ["ID b:\nRs. 2"]),
+            ("acc-3", ["ID c:\nRs. 3"]),
+        ])
+        assert sorted(len(request) for request in llm.requests) == [1, 2]
+        assert [len(result["items"]) for result in results] == [1, 1, 1]
+
+    def test_errors_reach_every_caller(self):
+        """Test a failed shared request fails every submission in it"""
+        batcher = MicroBatcher(window_seconds=0.2)
+        llm = FakeLLM(fail=True)
+        errors = []
+
+        def run(account_id):
+            try:
+                batcher.submit("transactions", account_id, [f"ID {account_id}:\nRs. 1"], llm.send, parse)
+            except RuntimeError as e:
+                errors.append(e)
+
+        with request_in_flight(batcher):
+            threads = [threading.Thread(target=run, args=(f"acc-{i}",)) for i in range(3)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        assert len(llm.requests) == 1
+        assert len(errors) == 3
+
+    def test_unroutable_parse_error_marks_incomplete(self):
+        """Test a broken item without an id makes every caller retry its uncovered messages"""
+        batcher = MicroBatcher(window_seconds=0)
+        response = {"items": [ItemParseError('{"id": "0.m1", "amount": ', ValueError()), ItemParseError("{oops", ValueError())], "complete": True}
+        result = batcher.submit("transactions", "acc-1", ["ID m1:\nRs. 1"], lambda messages: response, parse)
+        assert result["complete"] is False
+        assert len(result["items"]) == 1
+        assert '"id": "m1"' in result["items"][0].raw
+
+    @pytest.mark.parametrize("window_seconds", [0, 0.05])
+    def test_single_caller(self, window_seconds):
+        """Test a lone caller is sent on its own"""
+        batcher = MicroBatcher(window_seconds=window_seconds)
+        llm = FakeLLM()
+        result = batcher.submit("transactions", "acc-1", ["ID m1:\nRs. 5"], llm.send, parse)
+        assert result["items"] == [{"id": "m1", "amount": 5.0}]
+        assert result["batched_with"] == 0
+        assert batcher.active == {}
+
+    def test_lone_caller_skips_the_window(self):
+        """Test a caller with nothing else open or in flight is sent without waiting out the window"""
+        batcher = MicroBatcher(window_seconds=5)
+        llm = FakeLLM()
+        started = time.monotonic()
+        batcher.submit("transactions", "acc-1", ["ID m1:\nRs. 5"], llm.send, parse)
+        batcher.submit("transactions", "acc-1", ["ID m2:\nRs. 6"], llm.send, parse)
+        assert time.monotonic() - started < 1
+        assert len(llm.requests) == 2
+
+    def test_window_opens_under_concurrency(self):
+        """Test a caller arriving while another request is in flight waits for company"""
+        batcher = MicroBatcher(window_seconds=0.05)
+        llm = FakeLLM()
+        with request_in_flight(batcher):
+            started = time.monotonic()
+            batcher.submit("transactions", "acc-1", ["ID m1:\nRs. 5"], llm.send, parse)
+            assert time.monotonic() - started >= 0.05
@@ -0,0 +1,103 @@
+"""
+Tests for the worker llm model tier router
+Run with: python -m pytest tests/test_model_router.py -v
+"""
+
+import types
+from datetime import datetime
+
+from packages.models import EmailSanitized
+from worker.model_router import LIGHT_TIER, STANDARD_TIER, ModelRouter, count_table_rows
+
+
+def make_email(id="m1", sender="alerts@hdfcbank.net", snippet="", body=""):
+    return EmailSanitized(
+        id=id,
+        threadId="t1",
+        emailSender="Sender",
+        emailId=sender,
+        subject="Alert",
+        snippet=snippet,
+        body=body,
+        receivedAt=datetime(2025, 7, 4),
+    )
+
+
+INVOICE_BODY = "\n".join(
+    ["Thanks for your order"] + [f"Item {i} | 1 | ₹{100 + i}" for i in range(6)] + ["Order total | ₹621"]
+)
+
+
+def router():
+    return ModelRouter(light_model="flash-lite", standard_model="flash")
+
+
+class TestModelRouter:
+    """Test complexity scoring and tier routing"""
+
+    def test_short_bank_alert_goes_to_light_model(self):
+        """Test a known alert sender with a short snippet is light"""
+        email = make_email(snippet="Rs.65.00 has been debited from account 1531 to VPA abc@ybl on 04-07-25.")
+        assert router().tier_for(email) == LIGHT_TIER
+        assert router().model_for(router().tier_for(email)) == "flash-lite"
+
+    def test_invoices_and_long_mails_go_to_standard_model(self):
+        """Test order senders, line item tables and long bodies are standard"""
+        assert router().tier_for(make_email(sender="auto-confirm@amazon.in", snippet="Your order")) == STANDARD_TIER
+        assert router().tier_for(make_email(sender="billing@shop.example", body=INVOICE_BODY)) == STANDARD_TIER
+        assert router().tier_for(make_email(sender="news@example.com", body="x" * 5000)) == STANDARD_TIER
+        assert count_table_rows(INVOICE_BODY) == 6
+
+    def test_disabled_router_uses_standard_model(self):
+        """Test tiering can be switched off"""
+        disabled = ModelRouter(light_model="flash-lite", standard_model="flash", enabled=False)
+        assert disabled.tier_for(make_email(snippet="Rs.65 debited")) == STANDARD_TIER
+
+    def test_split_keeps_order(self):
+        """Test ids are split by tier in input order"""
+        emails = {
+            "a": make_email(id="a", snippet="Rs.1 debited"),
+            "b": make_email(id="b", sender="orders@swiggy.in", snippet="Order delivered"),
+            "c": make_email(id="c", snippet="Rs.2 credited"),
+        }
+        assert router().split(["a", "b", "c"], emails) == (["a", "c"], ["b"])
+
+    def test_empty_result_with_amount_is_low_confidence(self):
+        """Test messages mentioning an amount that came back empty are escalated"""
+        emails = {
+            "a": make_email(id="a", snippet="Rs.500 debited from a/c 1234"),
+            "b": make_email(id="b", snippet="Your OTP is 123456"),
+            "c": make_email(id="c", snippet="INR 20 credited"),
+            "d": make_email(id="d", snippet="Rs.99 spent"),
+        }
+        items = [
+            {"messageId": "c", "kind": "transaction"},
+            {"messageId": "d", "kind": "other"},
+        ]
+        assert router().low_confidence_ids(["a", "b", "c", "d"], items, emails, "messageId") == {"a", "d"}
+
+    def test_promotions_with_amounts_are_not_escalated(self):
+        """Test offer mails with a rupee amount that came back as other stay with the light model"""
+        emails = {
+            "a": make_email(id="a", sender="offers@swiggy.in", snippet="Flat ₹150 off on your next 3 orders, use code TREAT"),
+            "b": make_email(id="b", sender="deals@bank.example", snippet="Get cashback up to Rs. 500 on UPI payments this weekend"),
+            "c": make_email(id="c", sender="news@shop.example", snippet="Prices from Rs 199 in our new arrivals"),
+        }
+        items = [{"messageId": "a", "kind": "other"}]
+        assert router().low_confidence_ids(["a", "b", "c"], items, emails, "messageId") == set()
+
+    def test_metrics_per_tier(self):
+        """Test latency, tokens and escalations are recorded per tier"""
+        model_router = router()
+        usage = types.SimpleNamespace(prompt_token_count=100, candidates_token_count=20)
+        model_router.record_call("flash-lite", 0.2, 3, usage)
+        model_router.record_call("flash-lite", 0.4, 2, usage)
+        model_router.record_call("flash", 1.0, 1, None)
+        model_router.record_escalations(1)
+        stats = model_router.stats()
+        assert stats["escalations"] == 1
+        assert stats["tiers"][LIGHT_TIER]["calls"] == 2
+        assert stats["tiers"][LIGHT_TIER]["messages"] == 5
+        assert abs(stats["tiers"][LIGHT_TIER]["avg_latency_seconds"] - 0.3) < 1e-9
+        assert stats["tiers"][LIGHT_TIER]["input_tokens"] == 200
+        assert stats["tiers"][STANDARD_TIER]["output_tokens"] == 0
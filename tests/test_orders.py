@@ -0,0 +1,118 @@
+"""
+Tests for the set-based order upsert and item fingerprints (upsert tests need PostgreSQL, see conftest.py)
+Run with: TEST_DATABASE_URL=... python -m pytest tests/test_orders.py -v
+"""
+
+import pytest
+
+from packages.models import OrderItemsIntentModel, OrdersIntentModel
+
+
+def make_order(order_id="ORD-1", items=(), **fields):
+    return OrdersIntentModel(orderId=order_id, messageId=fields.pop("messageId", "m1"), items=list(items), **fields)
+
+
+def make_item(name="Milk", total=30.0, **fields):
+    return OrderItemsIntentModel(name=name, quantity=1, unitPrice=total, total=total, **fields)
+
+
+@pytest.fixture
+def operations(database_engine):
+    from src.modules.orders import operations
+    return operations
+
+
+def stored_orders(db, account_id):
+    from src.modules.orders.schema import OrdersORM
+    return {order.order_id: order for order in db.query(OrdersORM).filter(OrdersORM.account_id == account_id)}
+
+
+def stored_items(db, account_id):
+    from src.modules.orders.schema import OrderItemsORM
+    return db.query(OrderItemsORM).filter(OrderItemsORM.account_id == account_id).all()
+
+
+class TestOrderItemFingerprint:
+    """Test the deterministic item fingerprint"""
+
+    def test_same_item_same_fingerprint(self, operations):
+        """Test an item fingerprints the same on every ingest"""
+        assert operations.orderItemFingerprint(make_item(), 0) == operations.orderItemFingerprint(make_item(), 0)
+
+    def test_occurrence_and_fields_change_it(self, operations):
+        """Test repeated lines of a receipt and different items get different fingerprints"""
+        fingerprint = operations.orderItemFingerprint(make_item(), 0)
+        assert operations.orderItemFingerprint(make_item(), 1) != fingerprint
+        assert operations.orderItemFingerprint(make_item(total=31.0), 0) != fingerprint
+        assert len(fingerprint) == 64
+
+
+class TestUpsertOrders:
+    """Test inserting, merging and updating orders with their items"""
+
+    def test_insert_orders_with_items(self, db, account_id, operations):
+        """Test new orders and all their items are inserted"""
+        counts = operations.upsertOrders(account_id, [
+            make_order("ORD-1", [make_item("Milk"), make_item("Bread", 40.0)], vendor="Zepto", total=70.0),
+            make_order("ORD-2", [make_item("Rice", 90.0)]),
+        ], db)
+        assert (counts["inserted"], counts["updated"], counts["failed"], counts["itemsInserted"]) == (2, 0, 0, 3)
+        assert stored_orders(db, account_id)["ORD-1"].vendor == "Zepto"
+
+    def test_repeats_in_one_payload_are_merged(self, db, account_id, operations):
+        """Test an order twice in one payload becomes one row with the later non-null values and all items"""
+        counts = operations.upsertOrders(account_id, [
+            make_order("ORD-1", [make_item("Milk")], vendor="Zepto", total=30.0),
+            make_order("ORD-1", [make_item("Milk"), make_item("Eggs", 60.0)], total=90.0, messageId="m2"),
+        ], db)
+        assert (counts["inserted"], counts["updated"], counts["itemsInserted"]) == (1, 0, 2)
+        order = stored_orders(db, account_id)["ORD-1"]
+        assert (order.vendor, order.total, order.message_id) == ("Zepto", 90.0, "m2")
+
+    def test_update_fills_in_and_never_clears(self, db, account_id, operations):
+        """Test a re-ingested order updates the values it has and keeps the stored ones it lacks"""
+        operations.upsertOrders(account_id, [make_order("ORD-1", vendor="Zepto", currency="INR", total=70.0)], db)
+        counts = operations.upsertOrders(account_id, [make_order("ORD-1", total=75.0, subTotal=70.0)], db)
+        assert (counts["inserted"], counts["updated"]) == (0, 1)
+        order = stored_orders(db, account_id)["ORD-1"]
+        assert (order.vendor, order.currency, order.total, order.sub_total) == ("Zepto", "INR", 75.0, 70.0)
+
+    def test_reingested_items_are_not_duplicated(self, db, account_id, operations):
+        """Test items already stored are skipped and identical receipt lines are both kept"""
+        items = [make_item("Milk"), make_item("Milk")]
+        first = operations.upsertOrders(account_id, [make_order("ORD-1", items)], db)
+        second = operations.upsertOrders(account_id, [make_order("ORD-1", items + [make_item("Eggs", 60.0)])], db)
+        assert first["itemsInserted"] == 2
+        assert second["itemsInserted"] == 1
+        assert sorted(item.name for item in stored_items(db, account_id)) == ["Eggs", "Milk", "Milk"]
+
+    def test_items_of_orders_without_fingerprints_are_skipped(self, db, account_id, operations):
+        """Test an order stored before fingerprints existed does not get its items again"""
+        from src.modules.orders.schema import OrderItemsORM
+
+        operations.upsertOrders(account_id, [make_order("ORD-1", [make_item("Milk")])], db)
+        db.query(OrderItemsORM).update({OrderItemsORM.fingerprint: None})
+        counts = operations.upsertOrders(account_id, [make_order("ORD-1", [make_item("Milk")], total=30.0)], db)
+        assert (counts["updated"], counts["itemsInserted"]) == (1, 0)
+        assert len(stored_items(db, account_id)) == 1
+
+    def test_unpreparable_orders_are_reported(self, db, account_id, operations):
+        """Test an order that cannot be prepared is counted as failed and the others are stored"""
+        broken = make_order("ORD-2", [make_item()])
+        broken.items = [None]
+        counts = operations.upsertOrders(account_id, [make_order("ORD-1"), broken], db)
+        assert (counts["inserted"], counts["failed"]) == (1, 1)
+        assert counts["errors"][0]["orderId"] == "ORD-2"
+        assert counts["errors"][0]["index"] == 1
+
+    def test_statement_failures_are_reported_per_order(self, db, account_id, operations):
+        """Test an order the database rejects is reported and the rest of the payload is still stored"""
+        counts = operations.upsertOrders(account_id, [
+            make_order("ORD-1", [make_item("Milk")]),
+            make_order("ORD-2", [make_item("Bread", 40.0)], vendor="Zep\x00to"),
+            make_order("ORD-3", [make_item("Rice", 90.0)]),
+        ], db)
+        assert (counts["inserted"], counts["failed"], counts["itemsInserted"]) == (2, 1, 2)
+        assert [(error["index"], error["orderId"]) for error in counts["errors"]] == [(1, "ORD-2")]
+        assert sorted(stored_orders(db, account_id)) == ["ORD-1", "ORD-3"]
+        assert sorted(item.name for item in stored_items(db, account_id)) == ["Milk", "Rice"]
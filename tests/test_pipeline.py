@@ -0,0 +1,127 @@
+"""
+Tests for the worker sync pipeline
+Run with: python -m pytest tests/test_pipeline.py -v
+"""
+
+import threading
+import time
+
+import pytest
+from worker.pipeline import Pipeline, Stage
+
+
+class TestPipeline:
+    """Test staged pipeline execution"""
+
+    def test_items_flow_through_all_stages(self):
+        """Test every item passes every stage"""
+        results = []
+        stages = [
+            Stage("double", lambda item: [item * 2], concurrency=2),
+            Stage("collect", lambda item: results.append(item), concurrency=1),
+        ]
+        stats = Pipeline(range(10), stages).run()
+        assert sorted(results) == [n * 2 for n in range(10)]
+        assert stats["stages"]["double"]["processed"] == 10
+
+    def test_handler_can_drop_and_fan_out(self):
+        """Test a handler returning None drops the item and a list fans out"""
+        results = []
+        stages = [
+            Stage("split", lambda item: None if item % 2 else [item, item], concurrency=1),
+            Stage("collect", lambda item: results.append(item), concurrency=1),
+        ]
+        Pipeline(range(4), stages).run()
+        assert sorted(results) == [0, 0, 2, 2]
+
+    def test_flush_emits_trailing_items(self):
+        """Test flush runs once after the last item"""
+        buffered = []
+        results = []
+
+        def buffer(item):
+            buffered.append(item)
+            if len(buffered) == 3:
+                batch = list(buffered)
+                buffered.clear()
+                return [batch]
+            return None
+
+        def flush():
+            if buffered:
+                return [list(buffered)]
+            return None
+
+        stages = [
+            Stage("pack", buffer, concurrency=1, flush=flush),
+            Stage("collect", lambda batch: results.append(batch), concurrency=1),
+        ]
+        Pipeline(range(7), stages).run()
+        assert results == [[0, 1, 2], [3, 4, 5], [6]]
+
+    def test_bounded_queue_applies_backpressure(self):
+        """Test a slow stage keeps the source from running ahead"""
+        produced = []
+        in_flight_max = [0]
+        consumed = []
+        lock = threading.Lock()
+
+        def source():
+            for n in range(20):
+                produced.append(n)
+                with lock:
+                    in_flight_max[0] = max(in_flight_max[0], len(produced) - len(consumed))
+                yield n
+
+        def slow(item):
+            time.sleep(0.01)
+            with lock:
+                consumed.append(item)
+
+        Pipeline(source(), [Stage("slow", slow, concurrency=1, queue_size=2)]).run()
+        assert len(consumed) == 20
+        # queue of 2 + one item being handled + one item blocked in put
+        assert in_flight_max[0] <= 4
+
+    def test_stages_overlap(self):
+        """Test total time approaches the slowest stage rather than the sum"""
+        def sleeper(item):
+            time.sleep(0.05)
+            return [item]
+
+        stages = [
+            Stage("a", sleeper, concurrency=1),
+            Stage("b", sleeper, concurrency=1),
+            Stage("c", sleeper, concurrency=1),
+        ]
+        started = time.perf_counter()
+        Pipeline(range(10), stages).run()
+        elapsed = time.perf_counter() - started
+        # sequential would take 10 * 3 * 0.05 = 1.5s
+        assert elapsed < 1.0
+
+    def test_stage_error_cancels_and_is_raised(self):
+        """Test the first stage error stops the pipeline and propagates"""
+        seen = []
+
+        def explode(item):
+            if item == 3:
+                raise ValueError("boom")
+            return [item]
+
+        stages = [
+            Stage("explode", explode, concurrency=1),
+            Stage("collect", lambda item: seen.append(item), concurrency=1),
+        ]
+        with pytest.raises(ValueError, match="boom"):
+            Pipeline(range(1000), stages).run()
+        assert len(seen) < 1000
+
+    def test_source_error_is_raised(self):
+        """Test errors while listing pages propagate"""
+        def source():
+            yield 1
+            raise RuntimeError("listing failed")
+
+        with pytest.raises(RuntimeError, match="listing failed"):
+            Pipeline(source(), [Stage("noop", lambda item: None)]).run()
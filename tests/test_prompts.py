@@ -0,0 +1,149 @@
+"""
+Tests for the worker prompt registry and context caching
+Run with: python -m pytest tests/test_prompts.py -v
+"""
+
+import types
+from datetime import datetime, timedelta, timezone
+
+from worker.prompts import LocalContextCache, Prompt, PromptRegistry, build_registry
+
+
+class FakeVertexCaches:
+    """Records create calls like `client.caches` and can be told to fail"""
+
+    def __init__(self, ttl_seconds=3600, fail=False):
+        self.created = []
+        self.ttl_seconds = ttl_seconds
+        self.fail = fail
+
+    def create(self, model, config):
+        if self.fail:
+            raise RuntimeError("quota exceeded")
+        self.created.append((model, config))
+        return types.SimpleNamespace(
+            name=f"projects/p/locations/l/cachedContents/{len(self.created)}",
+            expire_time=datetime.now(timezone.utc) + timedelta(seconds=self.ttl_seconds),
+        )
+
+
+def usage(prompt_tokens, cached_tokens=None):
+    return types.SimpleNamespace(prompt_token_count=prompt_tokens, cached_content_token_count=cached_tokens)
+
+
+def registry_with(caches, text_length=8000):
+    registry = PromptRegistry(caches, ttl_seconds=3600)
+    registry.register(Prompt("big", "x" * text_length))
+    registry.register(Prompt("small", "instructions"))
+    return registry
+
+
+class TestPrompt:
+    """Test prompt versioning"""
+
+    def test_version_follows_text(self):
+        """Test the version changes with the text and only with the text"""
+        assert Prompt("orders", "a").version == Prompt("orders", "a").version
+        assert Prompt("orders", "a").version != Prompt("orders", "b").version
+        assert Prompt("orders", "a").version.startswith("orders-")
+
+    def test_default_prompts(self):
+        """Test the shipped prompts carry their schemas and only the small one stays inline"""
+        registry = build_registry(LocalContextCache())
+        assert set(registry.prompts) == {"transactions", "orders", "combined"}
+        assert "OrderItemsIntentModel" in registry.get("orders").text
+        assert "MessageExtractionIntentModel" in registry.get("combined").text
+        assert not registry.is_cacheable(registry.get("transactions"))
+        assert registry.is_cacheable(registry.get("combined"))
+
+
+class TestVertexCaching:
+    """Test requests against a vertex style cache backend"""
+
+    def test_cached_prompt_sends_only_payload(self):
+        """Test the request references the cache and the prompt is created once"""
+        caches = FakeVertexCaches()
+        registry = registry_with(caches)
+        registry.warm()
+        first = registry.build_request("big", "ID 1:\nRs. 500 debited")
+        second = registry.build_request("big", "ID 2:\nRs. 700 debited")
+        assert first.contents == "ID 1:\nRs. 500 debited"
+        assert first.cached_content == second.cached_content == "projects/p/locations/l/cachedContents/1"
+        assert len(caches.created) == 1
+        model, config = caches.created[0]
+        assert model == "gemini-2.5-flash"
+        assert config.display_name == registry.get("big").version
+        assert config.ttl == "3600s"
+
+    def test_small_prompt_is_inlined(self):
+        """Test prompts below the cache minimum are sent with the payload"""
+        registry = registry_with(FakeVertexCaches())
+        request = registry.build_request("small", "ID 1:\nhello")
+        assert request.contents == "instructions\n\nID 1:\nhello"
+        assert request.cached_content is None
+        assert not request.uses_cache
+
+    def test_create_failure_falls_back_to_inline(self):
+        """Test a failed cache creation never fails the call"""
+        registry = registry_with(FakeVertexCaches(fail=True))
+        request = registry.build_request("big", "payload")
+        assert request.cached_content is None
+        assert request.contents.endswith("\n\npayload")
+        assert registry.stats()["cache_errors"] == 1
+
+    def test_handles_are_refreshed_and_per_model(self):
+        """Test expiring or invalidated handles are recreated and each model gets its own cache"""
+        caches = FakeVertexCaches(ttl_seconds=60)
+        registry = registry_with(caches)
+        registry.build_request("big", "a")
+        registry.build_request("big", "b")
+        assert len(caches.created) == 2
+
+        caches = FakeVertexCaches()
+        registry = registry_with(caches)
+        registry.build_request("big", "a")
+        registry.invalidate("big")
+        registry.build_request("big", "b")
+        registry.build_request("big", "c", model="gemini-2.5-flash-lite")
+        assert [model for model, _ in caches.created] == ["gemini-2.5-flash", "gemini-2.5-flash", "gemini-2.5-flash-lite"]
+
+    def test_usage_is_tracked(self):
+        """Test cached token counts from responses are summed per prompt"""
+        registry = registry_with(FakeVertexCaches())
+        request = registry.build_request("big", "payload")
+        registry.record_usage(request, usage(2100, 2000))
+        registry.record_usage(request, usage(2100, None))
+        stats = registry.stats()["prompts"]["big"]
+        assert stats["calls"] == 2
+        assert stats["cache_hits"] == 1
+        assert stats["prompt_tokens"] == 4200
+        assert stats["cached_tokens"] == 2000
+        assert stats["cached"] is True
+
+
+class TestLocalContextCache:
+    """Test the local stand-in"""
+
+    def test_prompt_is_inlined_and_hit_is_simulated(self):
+        """Test the full prompt is sent while the prefix tokens are reported as cached"""
+        caches = LocalContextCache()
+        registry = registry_with(caches)
+        request = registry.build_request("big", "payload")
+        assert request.contents == "x" * 8000 + "\n\npayload"
+        assert request.cached_content is None
+        assert request.uses_cache
+        assert list(caches.contents.values()) == ["x" * 8000]
+
+        registry.record_usage(request, usage(2010))
+        stats = registry.stats()["prompts"]["big"]
+        assert stats["cache_hits"] == 1
+        assert stats["cached_tokens"] == registry.get("big").tokens
+
+    def test_no_backend_never_caches(self):
+        """Test the off setting keeps every prompt inline"""
+        registry = registry_with(None)
+        registry.warm()
+        request = registry.build_request("big", "payload")
+        assert request.cached_content is None
+        assert not request.uses_cache
+        assert registry.stats()["prompts"]["big"]["cached"] is False
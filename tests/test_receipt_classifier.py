@@ -0,0 +1,62 @@
+"""
+Tests for the order receipt classifier used by the two phase Gmail fetch
+Run with: python -m pytest tests/test_receipt_classifier.py -v
+"""
+
+import pytest
+from worker.receipt_classifier import is_likely_order_receipt, is_order_sender, sender_domain
+
+
+class TestSenderDomain:
+    """Test sender domain matching"""
+
+    def test_sender_domain_is_lowercased(self):
+        """Test the domain is taken after the last @ and lowercased"""
+        assert sender_domain("Auto-Confirm@Amazon.IN") == "amazon.in"
+
+    def test_missing_sender(self):
+        """Test senders without an address have no domain"""
+        assert sender_domain(None) == ""
+        assert sender_domain("no-address") == ""
+
+    def test_order_sender_subdomains(self):
+        """Test subdomains of order senders match and lookalike domains do not"""
+        assert is_order_sender("noreply@mailers.zomato.com")
+        assert is_order_sender("order-update@amazon.in")
+        assert not is_order_sender("deals@notamazon.in")
+        assert not is_order_sender("alerts@hdfcbank.net")
+
+
+class TestIsLikelyOrderReceipt:
+    """Test which mails are downloaded in full for order extraction"""
+
+    @pytest.mark.parametrize("sender, subject, snippet", [
+        ("auto-confirm@amazon.in", "Your Amazon.in order of boAt Airdopes", "Hello, thank you for shopping with us"),
+        ("noreply@swiggy.in", "Your Swiggy order was delivered", "Order total ₹412"),
+        ("billing@somestore.com", "Tax invoice for your purchase", "Amount paid Rs. 1,299.00"),
+        ("hello@smallshop.in", "Order #4411 confirmed", "We are getting your order ready"),
+        ("tickets@events.in", "Booking confirmed", "Total INR 750 for 2 tickets"),
+    ])
+    def test_receipts(self, sender, subject, snippet):
+        """Test order confirmations, invoices and bookings are kept"""
+        assert is_likely_order_receipt(sender, subject, snippet) is True
+
+    @pytest.mark.parametrize("sender, subject, snippet", [
+        ("noreply@amazon.in", "Your OTP for login", "Use 482113 as your one time password"),
+        ("offers@flipkart.com", "Big Billion Days: 80% off", "Sale ends tonight"),
+        ("news@somestore.com", "Our monthly newsletter", "New arrivals this week"),
+        ("friend@gmail.com", "Dinner on Saturday?", "Let me know if you can make it"),
+        ("alerts@hdfcbank.net", "Account statement", "Balance Rs. 10,000 as of today"),
+    ])
+    def test_non_receipts(self, sender, subject, snippet):
+        """Test OTPs, promotions, newsletters and personal mail are skipped"""
+        assert is_likely_order_receipt(sender, subject, snippet) is False
+
+    def test_keyword_in_snippet_needs_amount(self):
+        """Test an order keyword only in the snippet needs an amount as well"""
+        assert is_likely_order_receipt("team@app.io", "Update", "Your order history is ready") is False
+        assert is_likely_order_receipt("team@app.io", "Update", "Your order of Rs 499 has shipped") is True
+
+    def test_missing_fields(self):
+        """Test missing sender, subject and snippet do not raise"""
+        assert is_likely_order_receipt(None, None, None) is False
@@ -0,0 +1,44 @@
+"""
+Tests for the sender allowlist that narrows the Gmail search
+Run with: python -m pytest tests/test_sender_index.py -v
+"""
+
+from worker.sender_index import SenderAllowlist, format_sender_term, is_narrowed_query
+
+
+class TestFormatSenderTerm:
+    """Test how senders are written into the query"""
+
+    def test_addresses_are_kept_and_names_quoted(self):
+        """Test addresses go in as-is and names with spaces are quoted"""
+        assert format_sender_term("alerts@hdfcbank.net") == "alerts@hdfcbank.net"
+        assert format_sender_term('HDFC "Bank"') == '"HDFC Bank"'
+
+
+class TestNarrowQuery:
+    """Test narrowing and exploration runs"""
+
+    def test_narrowed_query(self):
+        """Test known senders and discovery terms are added and the query is recognised as narrowed"""
+        allowlist = SenderAllowlist(["alerts@hdfcbank.net"], ["auto-confirm@amazon.in", "alerts@hdfcbank.net"], exploration_rate=0)
+        query, is_exploration = allowlist.narrow_query("after:1700000000")
+        assert is_exploration is False
+        assert query.startswith("after:1700000000 {from:(alerts@hdfcbank.net OR auto-confirm@amazon.in) debited")
+        assert is_narrowed_query(query)
+
+    def test_exploration_runs_the_full_query(self):
+        """Test an exploration run and an account without senders keep the query unrestricted"""
+        query, is_exploration = SenderAllowlist(["alerts@hdfcbank.net"], [], exploration_rate=1).narrow_query("after:1")
+        assert (query, is_exploration) == ("after:1", True)
+        query, is_exploration = SenderAllowlist([], [], exploration_rate=0).narrow_query("after:1")
+        assert (query, is_exploration) == ("after:1", True)
+        assert not is_narrowed_query(query)
+        assert not is_narrowed_query(None)
+
+    def test_senders_are_cut_at_the_length_budget(self):
+        """Test senders that do not fit the query length are left out"""
+        senders = [f"sender{i}@bank{i}.com" for i in range(200)]
+        query, _ = SenderAllowlist(senders, [], exploration_rate=0, max_query_length=300).narrow_query("after:1")
+        assert len(query) <= 300
+        assert "sender0@bank0.com" in query
+        assert "sender199@bank199.com" not in query
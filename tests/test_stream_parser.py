@@ -0,0 +1,62 @@
+"""
+Tests for the incremental llm json parser
+Run with: python -m pytest tests/test_stream_parser.py -v
+"""
+
+import json
+
+from worker.stream_parser import ItemParseError, JsonArrayItemParser
+
+
+def feed_in_chunks(text: str, size: int) -> tuple[list, JsonArrayItemParser]:
+    parser = JsonArrayItemParser()
+    items = []
+    for start in range(0, len(text), size):
+        items += parser.feed(text[start:start + size])
+    return items, parser
+
+
+class TestJsonArrayItemParser:
+    """Test items are yielded as soon as they are complete"""
+
+    def test_top_level_array_in_any_chunking(self):
+        """Test the result does not depend on where chunks are cut"""
+        data = [{"id": "m1", "amount": 65.0, "reason": "to {VPA} [x]"}, {"id": "m2", "destination": "a \"quoted\" name"}]
+        text = json.dumps(data)
+        for size in (1, 3, 7, len(text)):
+            items, parser = feed_in_chunks(text, size)
+            assert items == data
+            assert parser.complete
+
+    def test_items_arrive_before_the_array_closes(self):
+        """Test the first item is available while the second is still streaming"""
+        parser = JsonArrayItemParser()
+        assert parser.feed('[{"id": "m1"}, {"id": "m') == [{"id": "m1"}]
+        assert not parser.complete
+        assert parser.feed('2"}]') == [{"id": "m2"}]
+        assert parser.complete
+
+    def test_wrapper_object_with_nested_lists(self):
+        """Test orders inside {"orders": [...]} are yielded with their item lists"""
+        data = {"orders": [{"orderId": "1", "messageId": "m1", "items": [{"name": "milk"}]}, {"orderId": "2", "messageId": "m2", "items": []}]}
+        items, parser = feed_in_chunks(json.dumps(data), 5)
+        assert items == data["orders"]
+        assert parser.complete
+
+    def test_code_fence_is_ignored(self):
+        """Test text around the array does not matter"""
+        items, parser = feed_in_chunks('```json\n[{"id": "m1"}]\n```', 4)
+        assert items == [{"id": "m1"}]
+
+    def test_broken_element_does_not_affect_the_others(self):
+        """Test an invalid element is reported with its raw text"""
+        items, parser = feed_in_chunks('[{"id": "m1", "amount": 6 5}, {"id": "m2"}]', 6)
+        assert isinstance(items[0], ItemParseError)
+        assert '"m1"' in items[0].raw
+        assert items[1] == {"id": "m2"}
+
+    def test_truncated_stream_is_incomplete(self):
+        """Test a cut off response keeps the finished items and reports incomplete"""
+        items, parser = feed_in_chunks('[{"id": "m1"}, {"id": "m2", "amo', 8)
+        assert items == [{"id": "m1"}]
+        assert not parser.complete
@@ -0,0 +1,141 @@
+"""
+Tests for the deterministic transaction templates
+Run with: python -m pytest tests/test_template_parsers.py -v
+"""
+
+from datetime import datetime, timezone
+
+import pytest
+from packages.models import EmailSanitized
+from worker.template_parsers import DEFAULT_TEMPLATES, TemplateRegistry
+
+
+def make_email(sender: str, snippet: str, body: str = "") -> EmailSanitized:
+    return EmailSanitized(
+        id="msg1",
+        threadId="thr1",
+        emailSender="Alerts",
+        emailId=sender,
+        subject="Transaction alert",
+        snippet=snippet,
+        body=body,
+        receivedAt=datetime(2025, 7, 4, tzinfo=timezone.utc),
+    )
+
+
+ALERTS = [
+    (
+        "alerts@hdfcbank.net",
+        "Dear Customer, Rs.65.00 has been debited from account 1531 to VPA Q285361434@ybl MADHU SUDHAN S on 04-07-25. "
+        "Your UPI transaction reference number is 254342617978.",
+        ("hdfc_upi_debit", 65.0, "debit", "UPI", "1531", "Q285361434@ybl MADHU SUDHAN S", "254342617978"),
+    ),
+    (
+        "alerts@hdfcbank.net",
+        "Dear Customer, Rs. 1,500.00 is successfully credited to your account **1531 by VPA abc@okaxis ABC KUMAR on 04-07-25. "
+        "Your UPI transaction reference number is 518512345678.",
+        ("hdfc_upi_credit", 1500.0, "credit", "UPI", "1531", "abc@okaxis ABC KUMAR", "518512345678"),
+    ),
+    (
+        "alerts@hdfcbank.net",
+        "Dear Card Member, Rs.1,299.00 spent on HDFC Bank Card x4321 at AMAZON PAY INDIA on 2025-07-04:10:15:22.",
+        ("hdfc_card_spend", 1299.0, "debit", "Credit Card", "4321", "AMAZON PAY INDIA", ""),
+    ),
+    (
+        "credit_cards@icicibank.com",
+        "ICICI Bank Acct XX123 debited for Rs 500.00 on 04-Jul-25; MADHU S credited. UPI:518512345678. Call 18002662 for dispute.",
+        ("icici_upi_debit", 500.0, "debit", "UPI", "XX123", "MADHU S", "518512345678"),
+    ),
+    (
+        "credit_cards@icicibank.com",
+        "Your ICICI Bank Credit Card XX4321 has been used for a transaction of INR 799.00 on Jul 04, 2025 at 10:15:22. Info: SWIGGY.",
+        ("icici_card_spend", 799.0, "debit", "Credit Card", "XX4321", "SWIGGY", ""),
+    ),
+    (
+        "donotreply@sbi.co.in",
+        "Dear UPI user A/C X1234 debited by 500.0 on date 04Jul25 trf to MADHU S Refno 518512345678. If not u? call 1800111109.",
+        ("sbi_upi_debit", 500.0, "debit", "UPI", "X1234", "MADHU S", "518512345678"),
+    ),
+    (
+        "donotreply@alerts.sbi.co.in",
+        "Dear SBI User, your A/c X1234-credited by Rs.250 on 04Jul25 transfer from ABC KUMAR Ref No 518512345679 -SBI",
+        ("sbi_upi_credit", 250.0, "credit", "UPI", "X1234", "ABC KUMAR", "518512345679"),
+    ),
+    (
+        "alerts@axisbank.com",
+        "INR 500.00 debited\nA/c no. XX1234\n04-07-25, 10:15:22\nUPI/P2M/518512345678/SWIGGY\nNot you? SMS BLOCKUPI",
+        ("axis_upi_debit", 500.0, "debit", "UPI", "XX1234", "SWIGGY", "518512345678"),
+    ),
+    (
+        "alerts@axisbank.com",
+        "INR 1,000.00 credited\nA/c no. XX1234\n04-07-25, 10:15:22 IST\nUPI/P2A/518512345678/MADHU S\nNot you?",
+        ("axis_upi_credit", 1000.0, "credit", "UPI", "XX1234", "MADHU S", "518512345678"),
+    ),
+    (
+        "noreply@phonepe.com",
+        "Paid ₹500 to Swiggy Transaction ID T2507041015221234567890 Debited from XXXXXX1234",
+        ("phonepe_paid", 500.0, "debit", "UPI", "XXXXXX1234", "Swiggy", "T2507041015221234567890"),
+    ),
+    (
+        "noreply@phonepe.com",
+        "Received ₹750 from MADHU S Transaction ID T2507041015221234567891 Credited to XXXXXX1234",
+        ("phonepe_received", 750.0, "credit", "UPI", "XXXXXX1234", "MADHU S", "T2507041015221234567891"),
+    ),
+    (
+        "no-reply@paytm.com",
+        "Paid Rs.500 to Swiggy from Paytm Balance. UPI Ref No: 518512345678",
+        ("paytm_paid", 500.0, "debit", "UPI", "Paytm Balance", "Swiggy", "518512345678"),
+    ),
+]
+
+
+class TestTemplates:
+    """Test each template against a sample alert"""
+
+    @pytest.mark.parametrize("sender,snippet,expected", ALERTS, ids=[alert[2][0] for alert in ALERTS])
+    def test_alert_is_parsed(self, sender, snippet, expected):
+        """Test the sample alert is matched by the expected template"""
+        registry = TemplateRegistry(DEFAULT_TEMPLATES)
+        transaction = registry.parse(make_email(sender, snippet))
+        name, amount, transaction_type, mode, source, destination, reference = expected
+        assert transaction is not None
+        assert registry.stats()["template_hits"] == {name: 1}
+        assert transaction.id == "msg1"
+        assert transaction.amount == amount
+        assert transaction.transaction_type == transaction_type
+        assert transaction.mode == mode
+        assert transaction.source_identifier == source
+        assert transaction.destination == destination
+        assert transaction.reference_number == reference
+
+    def test_every_template_has_a_sample(self):
+        """Test new templates come with a sample alert"""
+        assert {template.name for template in DEFAULT_TEMPLATES} == {alert[2][0] for alert in ALERTS}
+
+
+class TestTemplateRegistry:
+    """Test routing and counters"""
+
+    def test_templates_only_apply_to_their_sender(self):
+        """Test a lookalike alert from another sender goes to the llm"""
+        registry = TemplateRegistry(DEFAULT_TEMPLATES)
+        email = make_email("alerts@hdfcbank.net.phish.example", ALERTS[0][1])
+        assert registry.parse(email) is None
+        assert registry.stats()["sender_misses"] == {"hdfcbank.net.phish.example": 1}
+
+    def test_body_is_used_when_snippet_does_not_match(self):
+        """Test templates fall back to the body"""
+        registry = TemplateRegistry(DEFAULT_TEMPLATES)
+        email = make_email("alerts@hdfcbank.net", "You have done a UPI txn. Check details!", body=ALERTS[0][1])
+        assert registry.parse(email).amount == 65.0
+
+    def test_split_counts_hits_and_misses(self):
+        """Test split separates parsed transactions from emails left for the llm"""
+        registry = TemplateRegistry(DEFAULT_TEMPLATES)
+        otp = make_email("alerts@hdfcbank.net", "OTP for your transaction is 123456")
+        transactions, unmatched = registry.split([make_email(*ALERTS[0][:2]), otp])
+        assert [txn.amount for txn in transactions] == [65.0]
+        assert unmatched == [otp]
+        stats = registry.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1 and stats["hit_rate"] == 0.5
+        assert stats["sender_misses"] == {"hdfcbank.net": 1}
@@ -0,0 +1,305 @@
+import json
+import os
+from datetime import datetime
+from typing import Iterable, Optional
+
+from packages.models import EmailSanitized
+from worker.batch_packer import BatchPacker, estimate_tokens
+from worker.batch_prediction import (
+    JOB_DONE_STATES,
+    JOB_RESULT_STATES,
+    MonthShard,
+    build_request_line,
+    month_shards,
+    request_message_ids,
+    response_text,
+    write_jsonl,
+)
+from worker.prompts import Prompt
+from worker.template_parsers import DEFAULT_REGISTRY
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+BACKFILL_SUBMITTING = "submitting"
+BACKFILL_POLLING = "polling"
+BACKFILL_COMPLETED = "completed"
+
+JOB_SUBMITTED = "submitted"
+JOB_INGESTED = "ingested"
+# Months with nothing for the llm, recorded so a resumed submission skips them
+JOB_EMPTY = "empty"
+
+
+class BackfillError(Exception):
+    """The backfill progress or the results of a month could not be read or stored in mb-backend."""
+
+
+class BackfillJob:
+    '''One month of mailbox history submitted as a batch prediction job.'''
+    def __init__(self, label: str, name: str = None, emails_uri: str = None, request_count: int = 0, state: str = JOB_SUBMITTED):
+        self.label = label
+        self.name = name
+        self.emails_uri = emails_uri
+        self.request_count = request_count
+        self.state = state
+
+    @classmethod
+    def from_payload(cls, data: dict) -> "BackfillJob":
+        return cls(
+            data["label"],
+            name=data.get("name"),
+            emails_uri=data.get("emailsUri"),
+            request_count=data.get("requestCount", 0),
+            state=data.get("state", JOB_SUBMITTED),
+        )
+
+    def to_payload(self) -> dict:
+        return {
+            "label": self.label,
+            "name": self.name,
+            "emailsUri": self.emails_uri,
+            "requestCount": self.request_count,
+            "state": self.state,
+        }
+
+
+class BackfillState:
+    '''
+    This class is supposed to do the following actions:
+    1. Claim the backfill of an account in mb-backend, a second backfill task of the account is turned away
+    2. Record every submitted month with its batch job name and the uri of its emails file
+    3. Record every ingested month, so retried and re-enqueued poll tasks skip it
+    Cloud Run may recycle the instance while the jobs run for hours, so nothing is kept on it.
+    '''
+    def __init__(self, client, accountId: str, state: str = BACKFILL_SUBMITTING, jobs: Iterable[BackfillJob] = ()):
+        self.client = client
+        self.accountId = accountId
+        self.state = state
+        self.jobs: dict[str, BackfillJob] = {job.label: job for job in jobs}
+
+    @property
+    def url(self) -> str:
+        return f"api/v1/accounts/{self.accountId}/backfill"
+
+    @classmethod
+    def from_payload(cls, client, accountId: str, data: dict) -> "BackfillState":
+        return cls(client, accountId, state=data["state"], jobs=[BackfillJob.from_payload(job) for job in data.get("jobs") or []])
+
+    @classmethod
+    def claim(cls, client, accountId: str, owner: str, lease_seconds: int) -> Optional["BackfillState"]:
+        """
+        Start or resume the backfill for the task `owner`. Returns None when another task holds it,
+        or the account was backfilled already.
+        """
+        response = client.post(f"api/v1/accounts/{accountId}/backfill", json={"owner": owner, "leaseSeconds": lease_seconds})
+        if response.status_code == 409:
+            return None
+        if response.status_code != 200:
+            raise BackfillError(f"Failed to claim backfill for account {accountId}: {response.text}")
+        return cls.from_payload(client, accountId, response.json())
+
+    @classmethod
+    def load(cls, client, accountId: str) -> Optional["BackfillState"]:
+        response = client.get(f"api/v1/accounts/{accountId}/backfill")
+        if response.status_code == 404:
+            return None
+        if response.status_code != 200:
+            raise BackfillError(f"Failed to fetch backfill for account {accountId}: {response.text}")
+        return cls.from_payload(client, accountId, response.json())
+
+    def pending_jobs(self) -> list[BackfillJob]:
+        return [job for job in self.jobs.values() if job.state == JOB_SUBMITTED]
+
+    def save(self):
+        """Raises when the state is not stored, the task fails and Cloud Tasks retries it."""
+        payload = {"state": self.state, "jobs": [job.to_payload() for job in self.jobs.values()]}
+        response = self.client.put(self.url, json=payload)
+        if response.status_code != 200:
+            raise BackfillError(f"Failed to store backfill for account {self.accountId}: {response.text}")
+
+
+class BackfillManager:
+    '''
+    This class is supposed to do the following actions:
+    1. Shard the mailbox history older than the first interactive sync window by calendar month
+    2. List, download and parse the emails of each month and store them through mb-backend
+    3. Write the emails the templates cannot parse to a JSONL file of combined extraction requests per month
+    4. Submit each file as an offline batch prediction job (Vertex, or the local stand-in) and record it in the backfill state
+    5. On every poll, store the transactions and orders of one month whose job has completed
+    Messages whose batch request failed or came back invalid are extracted through the interactive api.
+    '''
+    def __init__(
+        self,
+        aiManager,
+        backend,
+        state: BackfillState,
+        settings,
+        emailManager=None,
+        prompt: Prompt = None,
+        base_query: str = "",
+        before: datetime = None,
+    ):
+        # Polling only ingests, it needs neither gmail nor the prompt
+        self.emailManager = emailManager
+        self.aiManager = aiManager
+        self.backend = backend
+        self.state = state
+        self.settings = settings
+        self.prompt = prompt
+        self.base_query = base_query
+        self.before = before
+        self.months = settings.BACKFILL_MONTHS
+        self.model = settings.LLM_MODEL
+        self.work_dir = os.path.join(settings.BACKFILL_WORK_DIR, aiManager.accountId)
+        self.stats = {"months": 0, "emails": 0, "template_transactions": 0, "batch_requests": 0, "fallback_messages": 0, "transactions": 0, "orders": 0}
+
+    def submit(self) -> int:
+        """Submit every month not recorded yet, newest first. Returns how many jobs wait to be ingested."""
+        if self.state.state != BACKFILL_SUBMITTING:
+            # A retried task whose months were all submitted, the poll tasks own the state now
+            return len(self.state.pending_jobs())
+        for shard in month_shards(self.before, self.months):
+            if shard.label in self.state.jobs:
+                continue
+            self.state.jobs[shard.label] = self.submit_shard(shard)
+            # Recorded before the next month, a recycled instance resubmits at most this one
+            self.state.save()
+        self.state.state = BACKFILL_POLLING if self.state.pending_jobs() else BACKFILL_COMPLETED
+        self.state.save()
+        logger.info(f"Backfill submitted for accountId: {self.aiManager.accountId}", extra={"backfill_stats": self.stats})
+        return len(self.state.pending_jobs())
+
+    def poll(self) -> Optional[BackfillJob]:
+        """Ingest the first completed job, one per task keeps each task short. None when every job is still running."""
+        for job in self.state.pending_jobs():
+            state = self.backend.state(job.name)
+            if state not in JOB_DONE_STATES:
+                continue
+            logger.info(f"Batch job {job.name} for {job.label} finished with {state}")
+            self.ingest(job, state)
+            job.state = JOB_INGESTED
+            if not self.state.pending_jobs():
+                self.state.state = BACKFILL_COMPLETED
+            self.state.save()
+            logger.info(f"Backfill ingested {job.label} for accountId: {self.aiManager.accountId}", extra={"backfill_stats": self.stats})
+            return job
+        return None
+
+    def collect_shard(self, shard: MonthShard) -> list[EmailSanitized]:
+        query = shard.query(self.base_query)
+        emails = []
+        next_page_token = None
+        while True:
+            message_ids, next_page_token = self.emailManager.list_message_ids(
+                query, next_page_token, max_results=self.settings.SYNC_PAGE_SIZE
+            )
+            if message_ids and self.settings.SYNC_SKIP_KNOWN_MESSAGES:
+                message_ids = self.emailManager.filter_known_message_ids(message_ids)
+            if message_ids:
+                if self.settings.GMAIL_FETCH_FORMAT == "two_phase":
+                    messages = self.emailManager.fetch_messages_two_phase(message_ids)
+                else:
+                    messages = self.emailManager.fetch_messages_by_ids(message_ids)
+                emails.extend(self.emailManager.fetch_messages_details_list(messages))
+            if not next_page_token:
+                break
+        logger.info(f"Collected {len(emails)} emails for {shard.label} for accountId: {self.emailManager.accountId}")
+        return emails
+
+    def submit_shard(self, shard: MonthShard) -> BackfillJob:
+        emails = self.collect_shard(shard)
+        if not emails:
+            return BackfillJob(shard.label, state=JOB_EMPTY)
+        self.stats["months"] += 1
+        self.stats["emails"] += len(emails)
+        self.emailManager.sync_database(emails)
+
+        template_transactions = []
+        llm_emails = emails
+        if self.settings.TEMPLATE_PARSERS_ENABLED:
+            template_transactions, llm_emails = DEFAULT_REGISTRY.split(emails)
+        if template_transactions:
+            self.stats["template_transactions"] += len(template_transactions)
+            emails_by_id = {email.id: email for email in emails}
+            self.save(
+                self.aiManager.build_transactions([txn.model_dump(exclude_none=True) for txn in template_transactions], emails_by_id),
+                [],
+            )
+
+        llm_emails = [email for email in llm_emails if email.snippet or email.body]
+        # Emails that never reach the llm are done here, the rest get their status when the job is ingested
+        llm_ids = {email.id for email in llm_emails}
+        self.aiManager.saveExtractionStatus([email.id for email in emails if email.id not in llm_ids])
+        if not llm_emails:
+            return BackfillJob(shard.label, state=JOB_EMPTY)
+
+        packer: BatchPacker[EmailSanitized] = BatchPacker(self.settings.LLM_BATCH_MAX_INPUT_TOKENS, self.settings.LLM_BATCH_MAX_ITEMS)
+        batches = []
+        for email in llm_emails:
+            batches.extend(packer.add(email, (estimate_tokens(email.snippet) + estimate_tokens(email.body),)))
+        batches.extend(packer.flush())
+
+        # Batch requests carry the prompt inline, cached content is not available to batch prediction
+        lines = [build_request_line(self.prompt, [self.aiManager.format_combined_message(email) for email in batch]) for batch in batches]
+        display_name = f"backfill-{self.aiManager.accountId}-{shard.label}"
+        input_path = os.path.join(self.work_dir, f"{shard.label}.input.jsonl")
+        emails_path = os.path.join(self.work_dir, f"{shard.label}.emails.jsonl")
+        write_jsonl(input_path, lines)
+        write_jsonl(emails_path, [json.loads(email.model_dump_json()) for email in llm_emails])
+        # Stored with the backend rather than on the instance, the job may be ingested by another one
+        emails_uri = self.backend.store(emails_path, f"{display_name}/emails.jsonl")
+
+        name = self.backend.submit(input_path, self.model, display_name=display_name)
+        self.stats["batch_requests"] += len(lines)
+        logger.info(f"Submitted batch job {name} with {len(lines)} requests for {shard.label} for accountId: {self.aiManager.accountId}")
+        return BackfillJob(shard.label, name=name, emails_uri=emails_uri, request_count=len(lines))
+
+    def ingest(self, job: BackfillJob, state: str):
+        emails_by_id = {email["id"]: EmailSanitized(**email) for email in self.backend.load(job.emails_uri)}
+        results = []
+        extracted_ids = set()
+        if state in JOB_RESULT_STATES:
+            for line in self.backend.results(job.name):
+                message_ids = request_message_ids(line.get("request") or {})
+                text = response_text(line)
+                if not text:
+                    logger.warning(f"Batch request for {len(message_ids)} messages failed: {line.get('status')}")
+                    continue
+                items, _ = self.aiManager.response_items({"raw_model_output": text})
+                for item in items:
+                    error = self.aiManager.validate_combined_item(item, message_ids) if isinstance(item, dict) else "not an object"
+                    if error:
+                        logger.warning(f"Dropping batch extracted item: {error}")
+                        continue
+                    results.append(item)
+                    extracted_ids.add(item["messageId"])
+
+        # Messages without a valid result (failed request, broken or missing item) go through the interactive api
+        fallback_emails = [email for message_id, email in emails_by_id.items() if message_id not in extracted_ids]
+        transactions_json_list, orders_list = self.aiManager.route_combined_results(results)
+        transactions_list = self.aiManager.build_transactions(transactions_json_list, emails_by_id)
+        if fallback_emails:
+            logger.info(f"Extracting {len(fallback_emails)} messages of {job.label} interactively")
+            self.stats["fallback_messages"] += len(fallback_emails)
+            fallback_transactions, fallback_orders = self.aiManager.extract_combined_from_emails(fallback_emails)
+            transactions_list += fallback_transactions
+            orders_list += fallback_orders
+        self.save(transactions_list, orders_list)
+        if self.aiManager.saveExtractionStatus(list(emails_by_id)) != 200:
+            raise BackfillError(f"Failed to store the extraction status of {job.label}")
+
+    def save(self, transactions_list: list[dict], orders_list: list[dict]):
+        """Raises when anything is not stored, the month stays pending and its poll task is retried."""
+        if transactions_list:
+            self.stats["transactions"] += len(transactions_list)
+            status = self.aiManager.saveTransactions(transactions_list)
+            logger.info(f"Backfill transactions database sync status: {status}")
+            if status != 200:
+                raise BackfillError(f"Failed to store {len(transactions_list)} backfill transactions, status {status}")
+        if orders_list:
+            self.stats["orders"] += len(orders_list)
+            status = self.aiManager.saveOrders(orders_list)
+            logger.info(f"Backfill orders database sync status: {status}")
+            if status != 200:
+                raise BackfillError(f"Failed to store {len(orders_list)} backfill orders, status {status}")
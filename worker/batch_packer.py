@@ -0,0 +1,59 @@
+import math
+import threading
+from typing import Generic, TypeVar
+
+# Gemini averages about four characters per token on english alert and receipt text
+CHARS_PER_TOKEN = 4
+# "ID <message id>:\n" prefix and the blank line between messages
+MESSAGE_OVERHEAD_TOKENS = 12
+
+T = TypeVar("T")
+
+
+def estimate_tokens(text: str | None) -> int:
+    """Cheap token estimate used for packing, no tokenizer round trip."""
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN) + MESSAGE_OVERHEAD_TOKENS
+
+
+class BatchPacker(Generic[T]):
+    '''
+    Packs items into llm batches up to an input token budget and an item cap.
+    Each item carries one cost per prompt it is sent with (for example snippet tokens for the
+    transactions prompt and body tokens for the orders prompt) and a batch closes as soon as
+    any prompt would go over budget. Items arrive from any number of Gmail pages, so small
+    pages are merged and large ones split. An item larger than the budget gets a batch of its own.
+    '''
+    def __init__(self, max_tokens: int, max_items: int):
+        self.max_tokens = max_tokens
+        self.max_items = max(1, max_items)
+        self.lock = threading.Lock()
+        self.items: list[T] = []
+        self.totals: list[int] = []
+
+    def add(self, item: T, costs: tuple[int, ...]) -> list[list[T]]:
+        """Add an item and return the batches it completed (zero or one)."""
+        with self.lock:
+            completed = []
+            totals = [total + cost for total, cost in zip(self.totals, costs)] if self.items else list(costs)
+            if self.items and any(total > self.max_tokens for total in totals):
+                completed.append(self.items)
+                self.items = []
+                totals = list(costs)
+            self.items.append(item)
+            self.totals = totals
+            if len(self.items) >= self.max_items:
+                completed.append(self.items)
+                self.items = []
+                self.totals = []
+            return completed
+
+    def flush(self) -> list[list[T]]:
+        with self.lock:
+            if not self.items:
+                return []
+            completed = [self.items]
+            self.items = []
+            self.totals = []
+            return completed
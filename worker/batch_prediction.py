@@ -0,0 +1,205 @@
+import json
+import os
+import re
+import threading
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+
+from google.cloud import storage
+from google.genai.types import CreateBatchJobConfig
+
+from worker.prompts import Prompt
+
+JOB_STATE_SUCCEEDED = "JOB_STATE_SUCCEEDED"
+JOB_STATE_PARTIALLY_SUCCEEDED = "JOB_STATE_PARTIALLY_SUCCEEDED"
+JOB_STATE_RUNNING = "JOB_STATE_RUNNING"
+# Terminal states of a Vertex batch prediction job
+JOB_DONE_STATES = {
+    JOB_STATE_SUCCEEDED,
+    JOB_STATE_PARTIALLY_SUCCEEDED,
+    "JOB_STATE_FAILED",
+    "JOB_STATE_CANCELLED",
+    "JOB_STATE_EXPIRED",
+}
+JOB_RESULT_STATES = {JOB_STATE_SUCCEEDED, JOB_STATE_PARTIALLY_SUCCEEDED}
+
+# Every message sent to the llm starts with "ID <message id>:"
+MESSAGE_ID_PATTERN = re.compile(r"^ID ([^:\n]+):", re.MULTILINE)
+
+
+class MonthShard:
+    '''One calendar month of mailbox history (the newest shard ends at `before` instead of the month end).'''
+    def __init__(self, after: datetime, before: datetime):
+        self.after = after
+        self.before = before
+        self.label = after.strftime("%Y-%m")
+
+    def query(self, base_query: str = "") -> str:
+        return f"{base_query} after:{int(self.after.timestamp())} before:{int(self.before.timestamp())}".strip()
+
+
+def month_shards(before: datetime, months: int) -> list[MonthShard]:
+    """Split the `months` calendar months up to `before` into shards, newest first."""
+    shards = []
+    end = before
+    start = before.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    for _ in range(months):
+        if start < end:
+            shards.append(MonthShard(start, end))
+        end = start
+        start = (start - timedelta(days=1)).replace(day=1)
+    return shards
+
+
+def build_request_line(prompt: Prompt, messages: list[str]) -> dict:
+    """
+    One line of a batch prediction input file: the prompt as system instruction and the messages as contents.
+    Vertex echoes the request next to its response, so results are matched back by the message ids in it.
+    """
+    return {
+        "request": {
+            "systemInstruction": {"parts": [{"text": prompt.text}]},
+            "contents": [{"role": "user", "parts": [{"text": "\n\n".join(messages)}]}],
+            "generationConfig": {"responseMimeType": "application/json"},
+        },
+    }
+
+
+def request_text(request: dict) -> str:
+    """The prompt and messages of a batch request as one string, for the interactive api."""
+    parts = request.get("systemInstruction", {}).get("parts", []) + [
+        part for content in request.get("contents", []) for part in content.get("parts", [])
+    ]
+    return "\n\n".join(part["text"] for part in parts if part.get("text"))
+
+
+def request_message_ids(request: dict) -> list[str]:
+    texts = [part.get("text") or "" for content in request.get("contents", []) for part in content.get("parts", [])]
+    return MESSAGE_ID_PATTERN.findall("\n".join(texts))
+
+
+def response_text(line: dict) -> str | None:
+    """The model output of a batch prediction output line, None when the request failed."""
+    response = line.get("response") or {}
+    candidates = response.get("candidates") or []
+    if not candidates:
+        return None
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text") or "" for part in parts) or None
+
+
+def write_jsonl(path: str, lines: list[dict]):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        for line in lines:
+            f.write(json.dumps(line) + "\n")
+
+
+def read_jsonl(path: str) -> Iterator[dict]:
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+class LocalBatchBackend:
+    '''
+    Stand-in for Vertex batch prediction used for local runs and tests.
+    A submitted input file is processed line by line on a background thread with `generate`
+    (model, request text) -> response text, and the output file has the same layout as the
+    predictions Vertex writes, so ingestion is the same for both backends.
+    Jobs and files only exist in this process, the poll tasks have to reach the same instance.
+    '''
+    def __init__(self, generate: Callable[[str, str], str], work_dir: str):
+        self.generate = generate
+        self.work_dir = work_dir
+        self.lock = threading.Lock()
+        self.jobs: dict[str, dict] = {}
+
+    def submit(self, input_path: str, model: str, display_name: str) -> str:
+        name = f"local-batch-{display_name}-{uuid.uuid4().hex[:8]}"
+        output_path = os.path.join(self.work_dir, f"{name}.predictions.jsonl")
+        with self.lock:
+            self.jobs[name] = {"state": JOB_STATE_RUNNING, "output_path": output_path}
+        threading.Thread(target=self.process, args=(name, input_path, output_path, model), daemon=True).start()
+        return name
+
+    def process(self, name: str, input_path: str, output_path: str, model: str):
+        lines = []
+        failed = 0
+        for line in read_jsonl(input_path):
+            try:
+                text = self.generate(model, request_text(line["request"]))
+                line["response"] = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+            except Exception as e:
+                failed += 1
+                line["status"] = str(e)
+            lines.append(line)
+        write_jsonl(output_path, lines)
+        with self.lock:
+            self.jobs[name]["state"] = JOB_STATE_PARTIALLY_SUCCEEDED if failed else JOB_STATE_SUCCEEDED
+
+    def state(self, name: str) -> str:
+        with self.lock:
+            return self.jobs[name]["state"]
+
+    def results(self, name: str) -> Iterator[dict]:
+        yield from read_jsonl(self.jobs[name]["output_path"])
+
+    def store(self, path: str, key: str) -> str:
+        return path
+
+    def load(self, uri: str) -> Iterator[dict]:
+        yield from read_jsonl(uri)
+
+
+class VertexBatchBackend:
+    '''
+    Vertex AI batch prediction: the input file is uploaded to Cloud Storage, a batch job reads it
+    and writes predictions next to it, and the prediction files are streamed back for ingestion.
+    Nothing is kept on the instance, a job is polled and ingested from any instance by its name.
+    '''
+    def __init__(self, client, storage_client: storage.Client, bucket_name: str, prefix: str = "backfill"):
+        self.client = client
+        self.bucket = storage_client.bucket(bucket_name)
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+
+    def submit(self, input_path: str, model: str, display_name: str) -> str:
+        job_prefix = f"{self.prefix}/{display_name}-{uuid.uuid4().hex[:8]}"
+        self.bucket.blob(f"{job_prefix}/input.jsonl").upload_from_filename(input_path)
+        job = self.client.batches.create(
+            model=model,
+            src=f"gs://{self.bucket_name}/{job_prefix}/input.jsonl",
+            config=CreateBatchJobConfig(display_name=display_name, dest=f"gs://{self.bucket_name}/{job_prefix}/output"),
+        )
+        return job.name
+
+    def state(self, name: str) -> str:
+        return self.client.batches.get(name=name).state.name
+
+    def results(self, name: str) -> Iterator[dict]:
+        output_prefix = self.blob_name(self.client.batches.get(name=name).dest.gcs_uri)
+        for blob in self.bucket.list_blobs(prefix=output_prefix):
+            if not blob.name.endswith(".jsonl"):
+                continue
+            for line in blob.download_as_text().splitlines():
+                if line.strip():
+                    yield json.loads(line)
+
+    def blob_name(self, uri: str) -> str:
+        return uri.removeprefix(f"gs://{self.bucket_name}/")
+
+    def store(self, path: str, key: str) -> str:
+        """Upload a file the ingestion needs later, returns its gs:// uri."""
+        blob_name = f"{self.prefix}/{key}"
+        self.bucket.blob(blob_name).upload_from_filename(path)
+        return f"gs://{self.bucket_name}/{blob_name}"
+
+    def load(self, uri: str) -> Iterator[dict]:
+        for line in self.bucket.blob(self.blob_name(uri)).download_as_text().splitlines():
+            if line.strip():
+                yield json.loads(line)
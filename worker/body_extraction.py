@@ -0,0 +1,177 @@
+import base64
+import binascii
+import re
+from html import unescape
+
+# Bodies above this are newsletters or statements, the transaction details are always near the top
+MAX_DECODED_BYTES = 256 * 1024
+# Upper bound for the text handed to the llm per email
+MAX_TEXT_CHARS = 12000
+
+# Elements whose content is never visible text
+SKIPPED_ELEMENTS = b"script|style|title|noscript|svg|template"
+# Elements that end a visual line, so table rows and paragraphs stay on separate lines
+BLOCK_ELEMENTS = (
+    "p", "div", "br", "tr", "li", "ul", "ol", "table", "tbody", "thead", "tfoot", "h1", "h2", "h3",
+    "h4", "h5", "h6", "hr", "section", "article", "header", "footer", "blockquote", "pre", "center",
+)
+CELL_ELEMENTS = ("td", "th")
+
+# Text emitted in place of a tag, keyed by tag name as written in lower or upper case
+# (closing tags keep their slash). Any other tag or token becomes a space.
+TAG_SEPARATORS = {}
+for element in BLOCK_ELEMENTS:
+    for name in (element, element.upper()):
+        TAG_SEPARATORS[name.encode()] = b"\n"
+        TAG_SEPARATORS[b"/" + name.encode()] = b"\n"
+for element in CELL_ELEMENTS:
+    for name in (element, element.upper()):
+        TAG_SEPARATORS[name.encode()] = b" | "
+
+# One scan over the raw bytes. Splitting on it alternates text and the tag name, which is
+# None for comments, doctypes and skipped elements (those are consumed with their content)
+HTML_TOKEN_PATTERN = re.compile(
+    rb"<(?:!--.*?--"
+    rb"|(?:" + SKIPPED_ELEMENTS + rb")\b.*?</(?:" + SKIPPED_ELEMENTS + rb")\s*"
+    rb"|(/?[a-zA-Z][a-zA-Z0-9]*)[^>]*"
+    rb"|![^>]*)>",
+    re.S | re.I,
+)
+# Everything before <body> is head content, it is skipped without tokenizing
+BODY_PATTERN = re.compile(rb"<body\b", re.I)
+# Charsets where tags are not plain ascii bytes, decoded and re-encoded before scanning
+WIDE_CHARSETS = ("utf-16", "utf-32", "utf16", "utf32")
+
+# Lines that start the legal footer of bank alerts and order mails
+FOOTER_PATTERN = re.compile(
+    r"^(?:\W*)(?:disclaimer|unsubscribe|privacy policy|terms (?:and|&) conditions|terms of use|"
+    r"this (?:is (?:a|an) )?(?:system|auto(?:matically)?)[- ]generated|please do not reply|do not reply|"
+    r"this e-?mail (?:and any|is confidential|was sent to)|you (?:are )?receiv(?:ed|ing) this (?:e-?mail|message)|"
+    r"never share your|download (?:the|our) app|follow us|copyright|©|\(c\) ?\d{4}|all rights reserved)",
+    re.I,
+)
+# Footers are only trimmed from the last part of the text, never from the alert itself
+FOOTER_SEARCH_START_RATIO = 0.3
+
+
+def decode_base64url(data: str | None, max_bytes: int = MAX_DECODED_BYTES) -> bytes:
+    """
+    Decode Gmail's unpadded base64url body data to bytes. Only the input needed for
+    `max_bytes` output is decoded, so a huge attachment-like body never gets fully expanded.
+    """
+    if not data:
+        return b""
+    max_chars = ((max_bytes + 2) // 3) * 4
+    raw = data[:max_chars].encode("ascii", errors="ignore")
+    raw += b"=" * (-len(raw) % 4)
+    try:
+        return base64.urlsafe_b64decode(raw)[:max_bytes]
+    except (binascii.Error, ValueError):
+        return b""
+
+
+def get_part_charset(part: dict) -> str:
+    for header in part.get("headers") or ():
+        if header.get("name", "").lower() != "content-type":
+            continue
+        value = header.get("value", "")
+        index = value.lower().find("charset=")
+        if index != -1:
+            return value[index + 8:].split(";", 1)[0].strip().strip('"\'') or "utf-8"
+    return "utf-8"
+
+
+def decode_part(part: dict, max_bytes: int = MAX_DECODED_BYTES) -> str:
+    data = decode_base64url(part.get("body", {}).get("data"), max_bytes)
+    return decode_bytes(data, get_part_charset(part))
+
+
+def decode_bytes(data: bytes, charset: str = "utf-8") -> str:
+    if not data:
+        return ""
+    try:
+        return data.decode(charset, errors="replace")
+    except LookupError:
+        return data.decode("utf-8", errors="replace")
+
+
+def find_body_parts(payload: dict) -> tuple[dict | None, dict | None]:
+    """
+    Walk the MIME tree depth first without recursion and return the first
+    text/plain and text/html parts that carry inline data. Attachments are skipped.
+    """
+    text_part = None
+    html_part = None
+    stack = [payload]
+    while stack:
+        part = stack.pop()
+        parts = part.get("parts")
+        if parts:
+            stack.extend(reversed(parts))
+            continue
+        if part.get("filename") or not part.get("body", {}).get("data"):
+            continue
+        mime_type = part.get("mimeType", "")
+        if mime_type == "text/plain" and text_part is None:
+            text_part = part
+            break
+        if mime_type == "text/html" and html_part is None:
+            html_part = part
+    return text_part, html_part
+
+
+def html_to_text(html: str | bytes, charset: str = "utf-8") -> str:
+    """
+    Convert html to readable text in a single scan over the raw bytes, decoding only the
+    visible text at the end. Tags are dropped, block elements become line breaks, table
+    cells are separated by ` | ` and scripts, styles and comments are skipped with their content.
+    """
+    if not html:
+        return ""
+    if isinstance(html, str):
+        html, charset = html.encode("utf-8", errors="replace"), "utf-8"
+    elif charset.lower().startswith(WIDE_CHARSETS):
+        html, charset = decode_bytes(html, charset).encode("utf-8"), "utf-8"
+
+    body = BODY_PATTERN.search(html)
+    parts = HTML_TOKEN_PATTERN.split(html[body.start():] if body else html)
+    separator = TAG_SEPARATORS.get
+    parts[1::2] = [separator(tag, b" ") for tag in parts[1::2]]
+    return normalize_text(unescape(decode_bytes(b"".join(parts), charset)))
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace within each line and drop empty lines."""
+    lines = []
+    for line in text.split("\n"):
+        words = line.split()
+        if words:
+            line = " ".join(words).strip(" |")
+            if line:
+                lines.append(line)
+    return "\n".join(lines)
+
+
+def trim_boilerplate(text: str) -> str:
+    """Cut the legal footer starting at the first footer line in the last part of the text."""
+    if not text:
+        return ""
+    lines = text.split("\n")
+    first_candidate = int(len(lines) * FOOTER_SEARCH_START_RATIO)
+    for index in range(max(first_candidate, 1), len(lines)):
+        if FOOTER_PATTERN.match(lines[index]):
+            return "\n".join(lines[:index])
+    return text
+
+
+def extract_body_text(payload: dict, max_bytes: int = MAX_DECODED_BYTES, max_chars: int = MAX_TEXT_CHARS) -> str:
+    """Readable body of a Gmail `format=full` payload, preferring text/plain over html."""
+    text_part, html_part = find_body_parts(payload)
+    if text_part is not None:
+        text = normalize_text(decode_part(text_part, max_bytes))
+    elif html_part is not None:
+        data = decode_base64url(html_part["body"]["data"], max_bytes)
+        text = html_to_text(data, get_part_charset(html_part))
+    else:
+        return ""
+    return trim_boilerplate(text)[:max_chars]
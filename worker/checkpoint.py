@@ -0,0 +1,175 @@
+import threading
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Checkpoints of the syncs running on this instance, flushed when Cloud Run stops it
+ACTIVE_CHECKPOINTS: set["SyncCheckpoint"] = set()
+ACTIVE_CHECKPOINTS_LOCK = threading.Lock()
+
+
+class SyncCheckpoint:
+    '''
+    This class is supposed to do the following actions:
+    1. Track the Gmail listing position of a sync: the next page token and the query or history cursor it belongs to
+    2. Track the message ids listed but not yet stored (in flight)
+    3. Track the highest receivedAt stored, which becomes lastSyncedAt once the sync completes
+    4. Write all of it to mb-backend after every stored page, so a restarted task resumes instead of starting over
+    On resume the in flight ids are processed first, then listing continues from the page token.
+    '''
+    def __init__(
+        self,
+        client,
+        accountId: str,
+        query: str,
+        start_history_id: Optional[str] = None,
+        sync_history_id: Optional[str] = None,
+        page_token: Optional[str] = None,
+        listing_complete: bool = False,
+        watermark: Optional[datetime] = None,
+        in_flight_ids: Iterable[str] = (),
+        pages_committed: int = 0,
+        resumed: bool = False,
+    ):
+        self.client = client
+        self.accountId = accountId
+        self.query = query
+        self.start_history_id = start_history_id
+        self.sync_history_id = sync_history_id
+        self.page_token = page_token
+        self.listing_complete = listing_complete
+        self.watermark = watermark
+        # dict keeps the listing order, resumed pages follow the original order
+        self.in_flight = dict.fromkeys(in_flight_ids)
+        self.pages_committed = pages_committed
+        self.resumed = resumed
+        self.lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.version = 0
+        self.flushed_version = -1
+
+    @property
+    def url(self) -> str:
+        return f"api/v1/accounts/{self.accountId}/sync-checkpoint"
+
+    @classmethod
+    def load(cls, client, accountId: str) -> Optional["SyncCheckpoint"]:
+        """Checkpoint left by an interrupted sync of the account, None when the last sync completed."""
+        try:
+            response = client.get(f"api/v1/accounts/{accountId}/sync-checkpoint")
+        except Exception as e:
+            logger.error(f"Failed to fetch sync checkpoint for account {accountId}: {e}")
+            return None
+        if response.status_code != 200:
+            return None
+        data = response.json()
+        watermark = datetime.fromisoformat(data["watermark"]) if data.get("watermark") else None
+        if watermark and watermark.tzinfo is None:
+            # Stored without a zone, receivedAt is always UTC
+            watermark = watermark.replace(tzinfo=timezone.utc)
+        return cls(
+            client,
+            accountId,
+            query=data.get("query"),
+            start_history_id=data.get("startHistoryId"),
+            sync_history_id=data.get("syncHistoryId"),
+            page_token=data.get("pageToken"),
+            listing_complete=data.get("listingComplete", False),
+            watermark=watermark,
+            in_flight_ids=data.get("inFlightIds") or [],
+            pages_committed=data.get("pagesCommitted", 0),
+            resumed=True,
+        )
+
+    def in_flight_ids(self) -> list[str]:
+        with self.lock:
+            return list(self.in_flight)
+
+    def restart_listing(self, start_history_id: Optional[str]):
+        """The stored position is no longer valid (expired cursor or page token), list from the start."""
+        with self.lock:
+            self.start_history_id = start_history_id
+            self.page_token = None
+            self.listing_complete = False
+            self.version += 1
+
+    def listed(self, message_ids: list[str], next_page_token: Optional[str]):
+        with self.lock:
+            self.in_flight.update(dict.fromkeys(message_ids))
+            self.page_token = next_page_token
+            self.listing_complete = not next_page_token
+            self.version += 1
+
+    def commit(self, message_ids: Iterable[str], received_at: Iterable[Optional[datetime]] = (), stored: bool = False):
+        """Ids that are stored, or need no storing (already known, not parseable), leave the in flight set."""
+        with self.lock:
+            for message_id in message_ids:
+                self.in_flight.pop(message_id, None)
+            for value in received_at:
+                if value and (not self.watermark or value > self.watermark):
+                    self.watermark = value
+            if stored:
+                self.pages_committed += 1
+            self.version += 1
+
+    def to_payload(self) -> dict:
+        return {
+            "query": self.query,
+            "startHistoryId": self.start_history_id,
+            "syncHistoryId": self.sync_history_id,
+            "pageToken": self.page_token,
+            "listingComplete": self.listing_complete,
+            "watermark": self.watermark.isoformat() if self.watermark else None,
+            "inFlightIds": list(self.in_flight),
+            "pagesCommitted": self.pages_committed,
+        }
+
+    def flush(self) -> bool:
+        """Write the checkpoint unless this state was written already. Returns True when it is stored."""
+        with self.flush_lock:
+            with self.lock:
+                version = self.version
+                payload = self.to_payload()
+            if version == self.flushed_version:
+                return True
+            try:
+                response = self.client.put(self.url, json=payload)
+            except Exception as e:
+                logger.error(f"Failed to store sync checkpoint for account {self.accountId}: {e}")
+                return False
+            if response.status_code != 200:
+                logger.error(f"Failed to store sync checkpoint for account {self.accountId}: {response.text}")
+                return False
+            # Flushes are serialised, a slower older write never overwrites a newer one
+            self.flushed_version = version
+            return True
+
+    def clear(self):
+        """Drop the checkpoint once the sync completed and lastSyncedAt moved past it."""
+        try:
+            response = self.client.delete(self.url)
+            logger.info(f"Cleared sync checkpoint for account {self.accountId}, status: {response.status_code}")
+        except Exception as e:
+            logger.error(f"Failed to clear sync checkpoint for account {self.accountId}: {e}")
+
+
+def register_checkpoint(checkpoint: SyncCheckpoint):
+    with ACTIVE_CHECKPOINTS_LOCK:
+        ACTIVE_CHECKPOINTS.add(checkpoint)
+
+
+def unregister_checkpoint(checkpoint: SyncCheckpoint):
+    with ACTIVE_CHECKPOINTS_LOCK:
+        ACTIVE_CHECKPOINTS.discard(checkpoint)
+
+
+def flush_active_checkpoints() -> int:
+    """Write the checkpoint of every running sync, called on SIGTERM. Returns how many were stored."""
+    with ACTIVE_CHECKPOINTS_LOCK:
+        checkpoints = list(ACTIVE_CHECKPOINTS)
+    stored = sum(1 for checkpoint in checkpoints if checkpoint.flush())
+    logger.info(f"Flushed {stored}/{len(checkpoints)} sync checkpoints")
+    return stored
@@ -1,13 +1,34 @@
 import json
 from google import genai
+from google.cloud import storage
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from google.oauth2 import service_account
-from google.genai.types import HttpOptions
+from google.genai.types import GenerateContentConfig, HttpOptions
+from worker.backend_client import BackendClient
+from worker.batch_prediction import LocalBatchBackend, VertexBatchBackend
+from worker.db_persistence import DatabasePersistence
+from worker.extraction_cache import ExtractionCache
+from worker.llm_dispatcher import LLMDispatcher
+from worker.micro_batcher import MicroBatcher
+from worker.model_router import ModelRouter
+from worker.prompts import LocalContextCache, build_registry
 
 class Settings(BaseSettings):
     DEBUG: bool = False
     WORKER_CLOUD_RUN_URL: str
     MB_BACKEND_API_URL: str = "http://0.0.0.0:8080/api/"
+    BACKEND_POOL_SIZE: int = 16
+    BACKEND_CONNECT_TIMEOUT_SECONDS: float = 5.0
+    BACKEND_READ_TIMEOUT_SECONDS: float = 60.0
+    BACKEND_MAX_RETRIES: int = 3
+    BACKEND_RETRY_BACKOFF_SECONDS: float = 0.5
+    BACKEND_COMPRESS_MIN_BYTES: int = 1024
+    BACKEND_COMPRESSION: str = "gzip"  # "gzip" | "zstd" (needs a backend that accepts it) | "off"
+    BACKEND_BODY_FORMAT: str = "json"  # bulk ingest bodies, "json" | "msgpack" (needs a backend that accepts it)
+    WORKER_PERSISTENCE: str = "http"  # "http" (through mb-backend) | "database" (direct writes)
+    DATABASE_URL: str = None
+    WORKER_DB_POOL_SIZE: int = 5
+    WORKER_DB_MAX_OVERFLOW: int = 5
     API_TOKEN_GITHUB: str = None
     GCP_CREDENTIALS: str = None
     GMAIL_WEB_CLIENT_ID: str = None
@@ -16,7 +37,62 @@ class Settings(BaseSettings):
     LANGSMITH_ENDPOINT: str = "https://api.smith.langchain.com"
     LANGSMITH_API_KEY: str
     LANGSMITH_PROJECT: str = "MoneyBhai"
-
+    GMAIL_FETCH_MODE: str = "batch"  # "serial" | "batch"
+    GMAIL_BATCH_SIZE: int = 50
+    GMAIL_FETCH_MAX_RETRIES: int = 3
+    GMAIL_FETCH_FORMAT: str = "two_phase"  # "full" | "two_phase"
+    GMAIL_SYNC_MODE: str = "history"  # "history" | "query"
+    SENDER_ALLOWLIST_ENABLED: bool = False
+    SENDER_EXPLORATION_RATE: float = 0.1
+    SYNC_PAGE_SIZE: int = 50
+    SYNC_SKIP_KNOWN_MESSAGES: bool = True
+    SYNC_FETCH_CONCURRENCY: int = 2
+    SYNC_FETCH_QUEUE_SIZE: int = 4
+    SYNC_PARSE_CONCURRENCY: int = 1
+    SYNC_PARSE_QUEUE_SIZE: int = 2
+    SYNC_PACK_QUEUE_SIZE: int = 2
+    SYNC_LLM_CONCURRENCY: int = 2
+    SYNC_LLM_QUEUE_SIZE: int = 2
+    SYNC_PERSIST_CONCURRENCY: int = 1
+    SYNC_PERSIST_QUEUE_SIZE: int = 4
+    SYNC_PERSIST_MODE: str = "batch"  # "batch" (one atomic /ingest/batch call per page) | "separate"
+    SYNC_CHECKPOINT_ENABLED: bool = True  # store progress after every page and resume interrupted syncs
+    LLM_MODEL: str = "gemini-2.5-flash"
+    LLM_LIGHT_MODEL: str = "gemini-2.5-flash-lite"
+    LLM_MODEL_TIERING_ENABLED: bool = True
+    LLM_LIGHT_MAX_SCORE: int = 0  # messages scoring above this go to LLM_MODEL
+    LLM_EXTRACTION_MODE: str = "combined"  # "combined" | "separate"
+    LLM_STRUCTURED_OUTPUT: bool = True
+    LLM_ITEM_MAX_RETRIES: int = 1
+    LLM_BATCH_MAX_INPUT_TOKENS: int = 8000  # email content per call, on top of the prompt instructions
+    LLM_BATCH_MAX_ITEMS: int = 25
+    TEMPLATE_PARSERS_ENABLED: bool = True
+    LLM_MAX_CONCURRENCY: int = 8  # requests in flight across every account on this instance
+    LLM_TOKENS_PER_MINUTE: int = 1000000  # 0 disables the limiter
+    LLM_MAX_RETRIES: int = 4
+    LLM_RETRY_BASE_DELAY_SECONDS: float = 1.0
+    LLM_RETRY_MAX_DELAY_SECONDS: float = 30.0
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 120.0
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_MICRO_BATCH_ENABLED: bool = True
+    LLM_MICRO_BATCH_WINDOW_MS: int = 200
+    # caps of a request shared across accounts, above LLM_BATCH_MAX_* so full per-sync batches still merge
+    LLM_MICRO_BATCH_MAX_ITEMS: int = 100
+    LLM_MICRO_BATCH_MAX_INPUT_TOKENS: int = 32000
+    PROMPT_CACHE_BACKEND: str = "vertex"  # "vertex" | "local" | "off"
+    PROMPT_CACHE_TTL_SECONDS: int = 3600
+    EXTRACTION_CACHE_ENABLED: bool = True
+    EXTRACTION_CACHE_PATH: str = "/tmp/moneybhai/extraction_cache.sqlite3"
+    EXTRACTION_CACHE_MAX_ENTRIES: int = 200000
+    EXTRACTION_CACHE_TTL_SECONDS: int = 30 * 24 * 3600
+    BACKFILL_BACKEND: str = "vertex"  # "vertex" | "local"
+    BACKFILL_MONTHS: int = 12
+    BACKFILL_GCS_BUCKET: str = "rola-labs-mb-backfill"
+    BACKFILL_GCS_PREFIX: str = "backfill"
+    BACKFILL_WORK_DIR: str = "/tmp/moneybhai/backfill"
+    BACKFILL_POLL_SECONDS: float = 60.0  # delay of the re-enqueued task polling the batch jobs
+    BACKFILL_LEASE_SECONDS: int = 1800  # a backfill task silent this long may be taken over by another
 
     model_config = SettingsConfigDict(
         env_file=".env", 
@@ -39,6 +115,85 @@ VERTEXT_CLIENT = genai.Client(
     credentials=credentials,
 )
 
+# Keep-alive pool shared by every call to mb-backend from this instance
+BACKEND_CLIENT = BackendClient(
+    ENV_SETTINGS.MB_BACKEND_API_URL,
+    pool_size=ENV_SETTINGS.BACKEND_POOL_SIZE,
+    connect_timeout=ENV_SETTINGS.BACKEND_CONNECT_TIMEOUT_SECONDS,
+    read_timeout=ENV_SETTINGS.BACKEND_READ_TIMEOUT_SECONDS,
+    max_retries=ENV_SETTINGS.BACKEND_MAX_RETRIES,
+    backoff_factor=ENV_SETTINGS.BACKEND_RETRY_BACKOFF_SECONDS,
+    compress_min_bytes=ENV_SETTINGS.BACKEND_COMPRESS_MIN_BYTES,
+    compression=ENV_SETTINGS.BACKEND_COMPRESSION,
+    body_format=ENV_SETTINGS.BACKEND_BODY_FORMAT,
+)
+
+# Direct database writes skip the backend hop, the http api stays the default
+DB_PERSISTENCE = DatabasePersistence(
+    ENV_SETTINGS.DATABASE_URL,
+    pool_size=ENV_SETTINGS.WORKER_DB_POOL_SIZE,
+    max_overflow=ENV_SETTINGS.WORKER_DB_MAX_OVERFLOW,
+) if ENV_SETTINGS.WORKER_PERSISTENCE == "database" else None
+
+# Shared by every account synced on this instance, point the path at a mounted volume to share across instances
+EXTRACTION_CACHE = ExtractionCache(
+    ENV_SETTINGS.EXTRACTION_CACHE_PATH,
+    max_entries=ENV_SETTINGS.EXTRACTION_CACHE_MAX_ENTRIES,
+    ttl_seconds=ENV_SETTINGS.EXTRACTION_CACHE_TTL_SECONDS,
+) if ENV_SETTINGS.EXTRACTION_CACHE_ENABLED else None
+
+# One dispatcher per instance so concurrency and token quota are shared by every account sync
+LLM_DISPATCHER = LLMDispatcher(
+    VERTEXT_CLIENT.aio.models,
+    max_concurrency=ENV_SETTINGS.LLM_MAX_CONCURRENCY,
+    tokens_per_minute=ENV_SETTINGS.LLM_TOKENS_PER_MINUTE,
+    max_retries=ENV_SETTINGS.LLM_MAX_RETRIES,
+    retry_base_delay=ENV_SETTINGS.LLM_RETRY_BASE_DELAY_SECONDS,
+    retry_max_delay=ENV_SETTINGS.LLM_RETRY_MAX_DELAY_SECONDS,
+    request_timeout=ENV_SETTINGS.LLM_REQUEST_TIMEOUT_SECONDS,
+    hedge=ENV_SETTINGS.LLM_HEDGE_ENABLED,
+    hedge_min_samples=ENV_SETTINGS.LLM_HEDGE_MIN_SAMPLES,
+)
+
+# Merges the llm batches of account syncs running at the same time into shared requests
+MICRO_BATCHER = MicroBatcher(
+    window_seconds=ENV_SETTINGS.LLM_MICRO_BATCH_WINDOW_MS / 1000,
+    max_items=ENV_SETTINGS.LLM_MICRO_BATCH_MAX_ITEMS,
+    max_tokens=ENV_SETTINGS.LLM_MICRO_BATCH_MAX_INPUT_TOKENS,
+) if ENV_SETTINGS.LLM_MICRO_BATCH_ENABLED else None
+
+# Short alerts go to the light model, receipts and anything it gets wrong to the standard one
+MODEL_ROUTER = ModelRouter(
+    light_model=ENV_SETTINGS.LLM_LIGHT_MODEL,
+    standard_model=ENV_SETTINGS.LLM_MODEL,
+    max_light_score=ENV_SETTINGS.LLM_LIGHT_MAX_SCORE,
+    enabled=ENV_SETTINGS.LLM_MODEL_TIERING_ENABLED,
+)
+
+# Extraction prompts are built once and, on vertex, registered as cached content at worker startup
+PROMPT_REGISTRY = build_registry(
+    caches=VERTEXT_CLIENT.caches if ENV_SETTINGS.PROMPT_CACHE_BACKEND == "vertex"
+    else LocalContextCache() if ENV_SETTINGS.PROMPT_CACHE_BACKEND == "local"
+    else None,
+    model=ENV_SETTINGS.LLM_MODEL,
+    ttl_seconds=ENV_SETTINGS.PROMPT_CACHE_TTL_SECONDS,
+)
+
+# Onboarding backfills go through offline batch prediction, the local backend runs the same files through the dispatcher
+BACKFILL_BACKEND = VertexBatchBackend(
+    VERTEXT_CLIENT,
+    storage.Client(project="rola-labs", credentials=credentials),
+    bucket_name=ENV_SETTINGS.BACKFILL_GCS_BUCKET,
+    prefix=ENV_SETTINGS.BACKFILL_GCS_PREFIX,
+) if ENV_SETTINGS.BACKFILL_BACKEND == "vertex" else LocalBatchBackend(
+    lambda model, contents: LLM_DISPATCHER.generate_content(
+        model=model,
+        contents=contents,
+        config=GenerateContentConfig(response_mime_type="application/json"),
+    ).text,
+    work_dir=ENV_SETTINGS.BACKFILL_WORK_DIR,
+)
+
 # credentials = service_account.Credentials.from_service_account_info(
 #     json.loads(ENV_SETTINGS.GOOGLE_APPLICATION_CREDENTIALS)
 # )
@@ -0,0 +1,68 @@
+from typing import Optional
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from packages.models import EmailSanitized, OrdersIntentModel, Transaction
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class DatabasePersistence:
+    '''
+    Writes sync output straight to the mb-backend database instead of through its http api.
+    1. Reuses the backend tables and the set-based ingest operations, so rows are stored exactly as the api stores them
+    2. Emails go in as parsed models, transactions and orders are validated once from the extracted dicts
+    3. Each call is one transaction over a pooled connection owned by this worker instance
+    Meant for large backfills where the backend hop and the json round trips dominate.
+    '''
+    def __init__(self, database_url: str, pool_size: int = 5, max_overflow: int = 5):
+        # The backend modules read DATABASE_URL on import, so they are only imported when this mode is enabled
+        from src.modules.emails.model import EmailExtractionFailure
+        from src.modules.ingest.operations import ingestBatch
+
+        self.ingest_batch = ingestBatch
+        self.failure_model = EmailExtractionFailure
+        self.engine = create_engine(
+            database_url,
+            pool_size=pool_size,
+            max_overflow=max_overflow,
+            pool_pre_ping=True,
+            future=True,
+        )
+        self.session_factory = sessionmaker(bind=self.engine, autoflush=False)
+
+    def save(
+        self,
+        userId: str,
+        accountId: str,
+        emails: list[EmailSanitized] = None,
+        transactions_list: list[dict] = None,
+        orders_list: list[dict] = None,
+        parsed: list[str] = None,
+        failed: list[dict] = None,
+    ) -> Optional[dict]:
+        """Store the given kinds in one transaction. Returns the per-kind counts, None when nothing was stored."""
+        try:
+            with self.session_factory() as db:
+                counts = self.ingest_batch(
+                    userId,
+                    accountId,
+                    emails or [],
+                    [Transaction.model_validate(txn) for txn in transactions_list or []],
+                    [OrdersIntentModel.model_validate(order) for order in orders_list or []],
+                    parsed or [],
+                    [self.failure_model(**item) for item in failed or []],
+                    None,
+                    db,
+                )
+                db.commit()
+        except Exception as e:
+            logger.exception(f"Failed to store batch in the database for accountId {accountId}: {e}")
+            return None
+        logger.info(f"Stored batch in the database for accountId {accountId}", extra={"ingest_counts": counts})
+        return counts
+
+    def close(self):
+        self.engine.dispose()
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Entries are evicted in chunks so a full cache does not trim on every write
+EVICTION_BATCH_RATIO = 0.1
+
+WHITESPACE_TRANSLATION = str.maketrans({"\u200b": None, "\u200c": None, "\u200d": None, "\ufeff": None, "\xa0": " "})
+
+
+def normalize_content(text: str) -> str:
+    """Lowercase and collapse whitespace so the same alert re-wrapped by another client hashes the same."""
+    return " ".join(text.translate(WHITESPACE_TRANSLATION).lower().split())
+
+
+def content_hash(text: str, prompt_version: str) -> str:
+    digest = hashlib.sha256()
+    digest.update(prompt_version.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(normalize_content(text).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ExtractionCache:
+    '''
+    Persistent cache of per-message llm extraction results, stored in sqlite.
+    Keys are content hashes that include the prompt version, so the cache is shared by
+    every account and a prompt change never serves stale results. Values are the list of
+    items the llm extracted for one message, an empty list meaning "nothing to extract".
+
+    Entries older than `ttl_seconds` are ignored and deleted, and once the cache holds more
+    than `max_entries` the least recently used entries are evicted.
+    '''
+    def __init__(self, path: str, max_entries: int = 100000, ttl_seconds: int = 30 * 24 * 3600):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS extraction_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS extraction_cache_accessed_at ON extraction_cache (accessed_at)"
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS extraction_cache_created_at ON extraction_cache (created_at)"
+        )
+
+    def get_many(self, keys: list[str]) -> dict[str, list]:
+        """Return cached values for the keys that are present and fresh, and count hits and misses."""
+        unique_keys = list(dict.fromkeys(keys))
+        if not unique_keys:
+            return {}
+        now = time.time()
+        found = {}
+        with self.lock:
+            placeholders = ",".join("?" * len(unique_keys))
+            rows = self.connection.execute(
+                f"SELECT key, value FROM extraction_cache WHERE key IN ({placeholders}) AND created_at >= ?",
+                [*unique_keys, now - self.ttl_seconds],
+            ).fetchall()
+            for key, value in rows:
+                found[key] = json.loads(value)
+            if found:
+                self.connection.executemany(
+                    "UPDATE extraction_cache SET accessed_at = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+            self.hits += sum(1 for key in keys if key in found)
+            self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def put_many(self, values: dict[str, list]):
+        if not values:
+            return
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN")
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO extraction_cache (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                [(key, json.dumps(value), now, now) for key, value in values.items()],
+            )
+            self.connection.execute("COMMIT")
+            self.evict(now)
+
+    def evict(self, now: float):
+        """Drop expired entries, then the least recently used ones above `max_entries`. Caller holds the lock."""
+        self.connection.execute("DELETE FROM extraction_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        (size,) = self.connection.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()
+        if size <= self.max_entries:
+            return
+        excess = size - self.max_entries + int(self.max_entries * EVICTION_BATCH_RATIO)
+        self.connection.execute(
+            "DELETE FROM extraction_cache WHERE key IN "
+            "(SELECT key FROM extraction_cache ORDER BY accessed_at LIMIT ?)",
+            (excess,),
+        )
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
+
+
+class CachedBatch:
+    '''
+    One llm batch split into cache hits and the messages that still need the llm.
+    Messages with identical content (the same alert in several linked accounts, or a
+    re-sync) are sent once and the result is fanned out to every copy.
+    '''
+    def __init__(self, cache: ExtractionCache | None, messages: list[tuple[str, str]], prompt_version: str, id_field: str = "id"):
+        self.cache = cache
+        self.id_field = id_field
+        self.keys = {message_id: content_hash(content, prompt_version) for message_id, content in messages}
+        self.cached = cache.get_many(list(self.keys.values())) if cache else {}
+        # cache key -> message id whose content is sent to the llm
+        self.pending: dict[str, str] = {}
+        for message_id, key in self.keys.items():
+            if key not in self.cached and key not in self.pending:
+                self.pending[key] = message_id
+
+    @property
+    def miss_ids(self) -> list[str]:
+        return list(self.pending.values())
+
+    @property
+    def hit_count(self) -> int:
+        return sum(1 for key in self.keys.values() if key in self.cached)
+
+    def resolve(self, llm_items: list[dict] | None, uncached_ids: set[str] = None) -> list[dict]:
+        """
+        Merge the llm items for the misses with the cached items and return them for every
+        message in the batch. Misses are only cached when the llm output could be parsed, and
+        never for `uncached_ids` (messages whose extraction failed validation).
+        """
+        uncached_ids = uncached_ids or set()
+        results = dict(self.cached)
+        if isinstance(llm_items, list):
+            items_by_id: dict[str, list] = {}
+            for item in llm_items:
+                if not isinstance(item, dict):
+                    continue
+                stored = {field: value for field, value in item.items() if field != self.id_field}
+                items_by_id.setdefault(item.get(self.id_field), []).append(stored)
+            fresh = {key: items_by_id.get(message_id, []) for key, message_id in self.pending.items()}
+            if self.cache:
+                self.cache.put_many({key: value for key, value in fresh.items() if self.pending[key] not in uncached_ids})
+            results.update(fresh)
+
+        items = []
+        for message_id, key in self.keys.items():
+            for item in results.get(key, []):
+                items.append({self.id_field: message_id, **item})
+        return items
@@ -0,0 +1,77 @@
+import json
+import re
+from typing import Callable
+
+from worker.log import setup_logger
+from worker.stream_parser import ItemParseError
+
+logger = setup_logger(__name__)
+
+
+def extract_json_from_response(response: str) -> dict | list | None:
+    """Extract JSON content from LLM response, handling code blocks."""
+    try:
+        cleaned = re.sub(r"^```[a-zA-Z]*\n|\n```$", "", response)
+        return json.loads(cleaned)
+    except Exception as e:
+        logger.warning(f"Failed to extract JSON from LLM response: {e}")
+        return None
+
+
+def response_items(response: dict) -> tuple[list, bool]:
+    """Return the extracted items of a structured or raw llm response and whether it covered every message."""
+    if "items" in response:
+        return response["items"], response["complete"]
+    parsed = extract_json_from_response(response.get("raw_model_output") or "")
+    if isinstance(parsed, dict):
+        # {"orders": [...]} or {"results": [...]}
+        parsed = next((value for value in parsed.values() if isinstance(value, list)), None)
+    return (parsed, True) if isinstance(parsed, list) else ([], False)
+
+
+def extract_items_with_retries(
+    message_ids: list[str],
+    generate: Callable[[list[str]], dict],
+    validate: Callable[[dict, list[str]], str | None],
+    id_field: str = "id",
+    max_retries: int = 0,
+) -> tuple[list[dict], dict[str, str]]:
+    """
+    Run an extraction for the messages and validate every returned item.
+    Only the messages whose items failed validation, or that a broken response never reached,
+    are sent again (up to `max_retries` times). Returns the valid items and the ids that still
+    failed with their last error, which must not be cached.
+    """
+    pending = list(message_ids)
+    valid_items = []
+    failed = {}
+    for attempt in range(max_retries + 1):
+        items, complete = response_items(generate(pending))
+
+        failed = {}
+        covered = set()
+        for item in items:
+            if isinstance(item, ItemParseError):
+                match = re.search(rf'"{id_field}"\s*:\s*"([^"]+)"', item.raw)
+                message_id, error = (match.group(1) if match else None), f"invalid json: {item.error}"
+            else:
+                message_id = item.get(id_field) if isinstance(item, dict) else None
+                error = validate(item, pending) if isinstance(item, dict) else "not an object"
+            covered.add(message_id)
+            if error is None:
+                valid_items.append(item)
+                continue
+            logger.warning(f"Dropping extracted item for message {message_id}: {error}")
+            if message_id in pending:
+                failed[message_id] = error
+        if not complete:
+            failed.update({id: "no result in llm response" for id in pending if id not in covered})
+
+        if not failed:
+            return valid_items, {}
+        # Items already accepted for a retried message would come back again
+        valid_items = [item for item in valid_items if item.get(id_field) not in failed]
+        pending = [id for id in pending if id in failed]
+        if attempt < max_retries:
+            logger.warning(f"Retrying extraction for {len(pending)} messages, attempt {attempt + 1}")
+    return valid_items, failed
@@ -0,0 +1,269 @@
+import asyncio
+import concurrent.futures
+import math
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable
+
+from worker.batch_packer import estimate_tokens
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Http status codes worth another attempt: timeouts, quota and server errors
+RETRYABLE_STATUS_CODES = {408, 429}
+# Latencies kept for the hedging percentile
+LATENCY_WINDOW = 200
+
+
+class PartialStreamError(Exception):
+    '''
+    A stream that broke after some chunks arrived, with the chunks so the items in them are not lost.
+    `result` is what the call would have returned: the stream consumer, or the chunks without one.
+    '''
+    def __init__(self, responses: list, error: Exception, result=None):
+        super().__init__(str(error))
+        self.responses = responses
+        self.error = error
+        self.result = responses if result is None else result
+
+
+class StreamChunks:
+    '''Default stream consumer, keeps the response chunks in order.'''
+    def __init__(self):
+        self.responses = []
+
+    def feed(self, response):
+        self.responses.append(response)
+
+
+def is_retryable(error: Exception) -> bool:
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES or code >= 500
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    # transport errors of the http clients used by google-genai
+    return type(error).__module__.split(".")[0] in ("httpx", "httpcore", "aiohttp")
+
+
+class TokenRateLimiter:
+    '''
+    Token bucket holding a minute of input tokens, refilled continuously.
+    Callers reserve the estimated tokens of a request before sending it and settle the
+    difference once the response reports its real usage. Waiters are served in arrival order.
+    '''
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = tokens_per_minute
+        self.available = float(tokens_per_minute)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.waited_seconds = 0.0
+
+    def refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    async def acquire(self, tokens: int):
+        if self.capacity <= 0:
+            return
+        tokens = min(tokens, self.capacity)
+        async with self.lock:
+            self.refill()
+            while self.available < tokens:
+                delay = (tokens - self.available) * 60 / self.capacity
+                self.waited_seconds += delay
+                await asyncio.sleep(delay)
+                self.refill()
+            self.available -= tokens
+
+    def settle(self, reserved: int, used: int):
+        """Charge (or give back) the difference between the reserved and the reported tokens."""
+        if self.capacity <= 0 or not used:
+            return
+        self.refill()
+        self.available = min(self.capacity, self.available - (used - reserved))
+
+
+class LatencyTracker:
+    '''Rolling window of request latencies.'''
+    def __init__(self, min_samples: int = 20):
+        self.samples: deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, value: float) -> float | None:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, math.ceil(value * len(ordered)) - 1)]
+
+
+class LLMDispatcher:
+    '''
+    This class is supposed to do the following actions:
+    1. Send every Gemini request of this worker through the genai async client on one event loop thread
+    2. Bound the requests in flight with a global semaphore, whichever account sync they come from
+    3. Keep input tokens under the per minute quota with a token bucket
+    4. Retry quota, timeout and server errors with exponential backoff and full jitter
+    5. Send a hedged duplicate when a request runs past the p95 latency and keep the first response
+    Sync pipeline threads call the blocking methods, async code awaits the `a` prefixed ones.
+    '''
+    def __init__(
+        self,
+        models,
+        max_concurrency: int = 8,
+        tokens_per_minute: int = 0,
+        max_retries: int = 4,
+        retry_base_delay: float = 1.0,
+        retry_max_delay: float = 30.0,
+        request_timeout: float = 120.0,
+        hedge: bool = True,
+        hedge_min_samples: int = 20,
+    ):
+        self.models = models
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.request_timeout = request_timeout
+        self.hedge = hedge
+        self.latency = LatencyTracker(hedge_min_samples)
+        self.loop: asyncio.AbstractEventLoop | None = None
+        self.loop_lock = threading.Lock()
+        self.semaphore: asyncio.Semaphore | None = None
+        self.limiter: TokenRateLimiter | None = None
+        self.requests = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """Start the dispatcher event loop on a daemon thread, once."""
+        with self.loop_lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-dispatcher", daemon=True).start()
+                self.semaphore = asyncio.Semaphore(self.max_concurrency)
+                self.limiter = TokenRateLimiter(self.tokens_per_minute)
+                self.loop = loop
+            return self.loop
+
+    def submit(self, coroutine) -> concurrent.futures.Future:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.start())
+
+    def generate_content(self, model: str, contents: str, config=None):
+        """Blocking generate_content for pipeline threads."""
+        return self.submit(self.dispatch(self.content_call(model, contents, config), contents)).result()
+
+    def generate_content_stream(self, model: str, contents: str, config=None, consumer: Callable = None):
+        """
+        Blocking streamed call for pipeline threads, returns the response chunks in order.
+        With a `consumer` factory every chunk is fed to it as it arrives and the consumer is returned instead.
+        Each attempt gets its own consumer, so a retried or hedged stream never mixes with another one.
+        """
+        return self.submit(self.dispatch(self.stream_call(model, contents, config, consumer), contents)).result()
+
+    async def agenerate_content(self, model: str, contents: str, config=None):
+        return await asyncio.wrap_future(self.submit(self.dispatch(self.content_call(model, contents, config), contents)))
+
+    async def agenerate_content_stream(self, model: str, contents: str, config=None, consumer: Callable = None):
+        return await asyncio.wrap_future(self.submit(self.dispatch(self.stream_call(model, contents, config, consumer), contents)))
+
+    def content_call(self, model: str, contents: str, config):
+        async def call():
+            response = await self.models.generate_content(model=model, contents=contents, config=config)
+            return response, response.usage_metadata
+        return call
+
+    def stream_call(self, model: str, contents: str, config, consumer: Callable = None):
+        async def call():
+            sink = consumer() if consumer else StreamChunks()
+            usage_metadata = None
+            try:
+                async for response in await self.models.generate_content_stream(model=model, contents=contents, config=config):
+                    sink.feed(response)
+                    usage_metadata = response.usage_metadata or usage_metadata
+            except Exception as e:
+                if sink.responses:
+                    raise PartialStreamError(sink.responses, e, sink if consumer else None)
+                raise
+            return (sink if consumer else sink.responses), usage_metadata
+        return call
+
+    async def dispatch(self, call, contents: str):
+        """Run a call with retries, backoff and hedging. A broken stream is returned to the caller, not retried."""
+        tokens = estimate_tokens(contents) if isinstance(contents, str) else 0
+        self.requests += 1
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self.hedged(call, tokens)
+            except PartialStreamError:
+                raise
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                delay = random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * 2 ** attempt))
+                self.retries += 1
+                logger.warning(f"LLM request attempt {attempt + 1}/{self.max_retries + 1} failed, retrying in {delay:.1f}s: {str(e)}")
+                await asyncio.sleep(delay)
+
+    async def hedged(self, call, tokens: int):
+        """Send the call and, once it has run past the p95 latency, a duplicate. The first success wins."""
+        threshold = self.latency.percentile(0.95) if self.hedge else None
+        started = asyncio.Event()
+        primary = asyncio.ensure_future(self.attempt(call, tokens, started))
+        if threshold is None:
+            return await primary
+
+        # the clock starts when the primary holds a slot, time spent queued is not latency
+        waiter = asyncio.ensure_future(started.wait())
+        await asyncio.wait({primary, waiter}, return_when=asyncio.FIRST_COMPLETED)
+        waiter.cancel()
+        done, _ = await asyncio.wait({primary}, timeout=threshold)
+        if done:
+            return primary.result()
+
+        self.hedges += 1
+        hedge = asyncio.ensure_future(self.attempt(call, tokens))
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is hedge:
+                        self.hedge_wins += 1
+                    return task.result()
+                error = task.exception()
+        raise error
+
+    async def attempt(self, call, tokens: int, started: asyncio.Event = None):
+        await self.limiter.acquire(tokens)
+        async with self.semaphore:
+            if started:
+                started.set()
+            start = time.monotonic()
+            result, usage_metadata = await asyncio.wait_for(call(), self.request_timeout)
+            self.latency.add(time.monotonic() - start)
+        # the bucket holds input tokens, output tokens have their own quota
+        self.limiter.settle(tokens, getattr(usage_metadata, "prompt_token_count", None))
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "p95_seconds": self.latency.percentile(0.95),
+            "rate_limited_seconds": self.limiter.waited_seconds if self.limiter else 0.0,
+        }
@@ -1,26 +1,67 @@
 # worker/main.py
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from fastapi import Depends, FastAPI, Request, HTTPException
+from fastapi.concurrency import run_in_threadpool
+from google.cloud import tasks_v2
+from google.protobuf import timestamp_pb2
 import json
 import logging
 import base64
-import requests
+import signal
+import uuid
 
-from packages.models import EmailSanitized, TaskQueuePayload
-from worker.connectors import ENV_SETTINGS
-from worker.operations import AIManager, EmailManager
+from packages.models import TaskQueuePayload
+from worker.backfill import BACKFILL_COMPLETED, BackfillManager, BackfillState
+from worker.checkpoint import SyncCheckpoint, flush_active_checkpoints, register_checkpoint, unregister_checkpoint
+from worker.connectors import BACKEND_CLIENT, BACKFILL_BACKEND, ENV_SETTINGS, LLM_DISPATCHER, MICRO_BATCHER, MODEL_ROUTER, PROMPT_REGISTRY
+from worker.operations import INITIAL_SYNC_LOOKBACK_DAYS, AIManager, EmailManager
+from worker.sync import SyncManager
+from worker.sender_index import SenderAllowlist, is_narrowed_query
 from worker.gmailAuth import authenticateGmail, TokenExpiredError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+def install_checkpoint_flush_on_sigterm() -> None:
+    """Cloud Run sends SIGTERM before stopping an instance, store the progress of running syncs before shutting down."""
+    previous_handler = signal.getsignal(signal.SIGTERM)
+
+    def handle_sigterm(signum, frame):
+        logger.info("SIGTERM received, flushing sync checkpoints")
+        flush_active_checkpoints()
+        if callable(previous_handler):
+            previous_handler(signum, frame)
+        elif previous_handler == signal.SIG_DFL:
+            raise SystemExit(128 + signum)
+
+    try:
+        signal.signal(signal.SIGTERM, handle_sigterm)
+    except ValueError as e:
+        # signal handlers can only be installed from the main thread
+        logger.warning(f"Could not install SIGTERM checkpoint flush: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Register the extraction prompts as cached content before the first task arrives
+    models = [ENV_SETTINGS.LLM_MODEL]
+    if ENV_SETTINGS.LLM_MODEL_TIERING_ENABLED:
+        models.append(ENV_SETTINGS.LLM_LIGHT_MODEL)
+    await run_in_threadpool(PROMPT_REGISTRY.warm, models)
+    LLM_DISPATCHER.start()
+    logger.info(f"Prompt registry ready: {PROMPT_REGISTRY.stats()}")
+    # uvicorn has installed its own handler by now, ours runs first and then hands over to it
+    install_checkpoint_flush_on_sigterm()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 def release_sync_lock(account_id: str) -> None:
     """Release sync lock for a user after task completion or error."""
     try:
-        unlock_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/accounts/{account_id}/unlock"
-        unlock_response = requests.post(unlock_url)
+        unlock_url = f"api/v1/accounts/{account_id}/unlock"
+        unlock_response = BACKEND_CLIENT.post(unlock_url)
         logger.info(f"Sync lock released for user with {account_id}, status: {unlock_response.status_code}")
     except Exception as unlock_error:
         logger.error(f"Failed to release sync lock for user with {account_id}: {unlock_error}")
@@ -28,8 +69,8 @@ def release_sync_lock(account_id: str) -> None:
 def fetch_user_details(user_id: str) -> dict:
     """Fetch user details from backend API."""
     try:
-        user_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/users/{user_id}"
-        response = requests.get(user_url)
+        user_url = f"api/v1/users/{user_id}"
+        response = BACKEND_CLIENT.get(user_url)
         if response.status_code == 200:
             return response.json()
         logger.error(f"Failed to fetch user details, status: {response.status_code}")
@@ -41,8 +82,8 @@ def fetch_user_details(user_id: str) -> dict:
 def fetch_account_details(account_id: str) -> dict:
     """Fetch account details from backend API."""
     try:
-        account_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/accounts/{account_id}"
-        response = requests.get(account_url)
+        account_url = f"api/v1/accounts/{account_id}"
+        response = BACKEND_CLIENT.get(account_url)
         if response.status_code == 200:
             return response.json()
         logger.error(f"Failed to fetch account details, status: {response.status_code}")
@@ -51,14 +92,44 @@ def fetch_account_details(account_id: str) -> dict:
         logger.error(f"Error fetching account details for account {account_id}: {e}")
         return None
     
-def update_last_synced_at(accountId: str, last_synced_at: str) -> None:
-    """Update lastSyncedAt for a account."""
+def fetch_financial_senders(account_id: str) -> dict:
+    """Fetch the known transaction and order senders for an account from backend API."""
+    try:
+        senders_url = f"api/v1/accounts/{account_id}/financial-senders"
+        response = BACKEND_CLIENT.get(senders_url)
+        if response.status_code == 200:
+            return response.json()
+        logger.error(f"Failed to fetch financial senders, status: {response.status_code}")
+        return None
+    except Exception as e:
+        logger.error(f"Error fetching financial senders for account {account_id}: {e}")
+        return None
+
+def fetch_failed_email_ids(account_id: str) -> list:
+    """Fetch the ids of the emails whose extraction failed and can still be replayed from backend API."""
+    try:
+        dead_letter_url = "api/v1/emails/dead-letter"
+        response = BACKEND_CLIENT.get(dead_letter_url, params={"accountId": account_id})
+        if response.status_code == 200:
+            return [email["id"] for email in response.json().get("emails", [])]
+        logger.error(f"Failed to fetch dead letter emails, status: {response.status_code}")
+        return []
+    except Exception as e:
+        logger.error(f"Error fetching dead letter emails for account {account_id}: {e}")
+        return []
+
+def update_last_synced_at(accountId: str, last_synced_at: str = None, history_id: str = None) -> None:
+    """Update lastSyncedAt and the Gmail history cursor for a account."""
     try:
-        update_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/accounts/{accountId}"
-        response = requests.put(
+        update_url = f"api/v1/accounts/{accountId}"
+        update_payload = {}
+        if last_synced_at:
+            update_payload['lastSyncedAt'] = last_synced_at
+        if history_id:
+            update_payload['historyId'] = history_id
+        response = BACKEND_CLIENT.put(
             update_url,
-            headers={'Content-Type': 'application/json'},
-            json={'lastSyncedAt': last_synced_at}
+            json=update_payload
         )
         logger.info(f"Updated lastSyncedAt for account {accountId}, status: {response.status_code}")
     except Exception as e:
@@ -67,21 +138,51 @@ def update_last_synced_at(accountId: str, last_synced_at: str) -> None:
 def invalidate_account_token(account_id: str) -> None:
     """Clear refresh token for an account when it's expired or revoked."""
     try:
-        update_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/accounts/{account_id}"
-        response = requests.put(
+        update_url = f"api/v1/accounts/{account_id}"
+        response = BACKEND_CLIENT.put(
             update_url,
-            headers={'Content-Type': 'application/json'},
             json={'gmailRefreshToken': None, 'gmailRefreshTokenCreatedAt': None}
         )
         logger.info(f"Invalidated refresh token for account {account_id}, status: {response.status_code}")
     except Exception as e:
         logger.error(f"Failed to invalidate token for account {account_id}: {e}")
+
+def enqueue_worker_task(payload: dict, path: str, delay_seconds: float = 0) -> str:
+    """Enqueue a task for this worker on the sync queue, run after delay_seconds."""
+    client = tasks_v2.CloudTasksClient()
+    parent = client.queue_path(
+        "rola-labs",
+        "asia-south1",
+        "mb-sync-queue"
+    )
+
+    schedule_time = timestamp_pb2.Timestamp()
+    schedule_time.FromDatetime(datetime.now(timezone.utc) + timedelta(seconds=delay_seconds))
+    task = {
+        "http_request": {
+            "http_method": tasks_v2.HttpMethod.POST,
+            "url": f"{ENV_SETTINGS.WORKER_CLOUD_RUN_URL}{path}",
+            "headers": {
+                "Content-Type": "application/json"
+            },
+            "oidc_token": {
+                "service_account_email": "rola-labs@appspot.gserviceaccount.com"
+            },
+            "body": base64.b64encode(
+                json.dumps(payload).encode("utf-8")
+            )
+        },
+        "schedule_time": schedule_time,
+    }
+
+    response = client.create_task(parent=parent, task=task)
+    return response.name
     
 def fetch_transactions(user_id: str) -> list:
     """Fetch transactions for a user from backend API."""
     try:
-        transactions_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/users/{user_id}/transactions"
-        response = requests.get(transactions_url)
+        transactions_url = f"api/v1/users/{user_id}/transactions"
+        response = BACKEND_CLIENT.get(transactions_url)
         if response.status_code == 200:
             return response.json().get("transactions", [])
         logger.error(f"Failed to fetch transactions, status: {response.status_code}")
@@ -93,8 +194,8 @@ def fetch_transactions(user_id: str) -> list:
 def fetch_orders(user_id: str) -> list:
     """Fetch orders for a user from backend API."""
     try:
-        orders_url = f"{ENV_SETTINGS.MB_BACKEND_API_URL}api/v1/users/{user_id}/orders"
-        response = requests.get(orders_url)
+        orders_url = f"api/v1/users/{user_id}/orders"
+        response = BACKEND_CLIENT.get(orders_url)
         if response.status_code == 200:
             return response.json().get("orders", [])
         logger.error(f"Failed to fetch orders, status: {response.status_code}")
@@ -103,6 +204,22 @@ def fetch_orders(user_id: str) -> list:
         logger.error(f"Error fetching orders for user {user_id}: {e}")
         return []
 
+def narrow_query_to_financial_senders(account_id: str, query: str) -> str:
+    """Restrict a Gmail query to the senders that produced transactions or orders before."""
+    if not ENV_SETTINGS.SENDER_ALLOWLIST_ENABLED:
+        return query
+    senders = fetch_financial_senders(account_id)
+    if not senders:
+        return query
+    allowlist = SenderAllowlist(
+        account_senders=senders.get('accountSenders', []),
+        global_senders=senders.get('globalSenders', []),
+        exploration_rate=ENV_SETTINGS.SENDER_EXPLORATION_RATE,
+    )
+    query, is_exploration = allowlist.narrow_query(query)
+    logger.info(f"Sender allowlist has {len(allowlist.senders)} senders, exploration run: {is_exploration}")
+    return query
+
 @app.post("/tasks/process")
 async def processTask(request: Request):
     '''
@@ -115,6 +232,7 @@ async def processTask(request: Request):
     7. return status    
     '''
     accountId = None
+    checkpoint = None
     try:
         logger.info("Received task processing request")
         payload = await request.body()
@@ -157,65 +275,80 @@ async def processTask(request: Request):
             accountId=tasksPayload.accountId,
         )
 
-        # Build query based on lastSyncedAt
-        query = emailManager.build_gmail_query(last_synced_at)
-        logger.info(f"Gmail query: {query}")
-
-        next_page_token = None
-        latest_email_time = None
-        while True:
-            # Fetch emails in batches
-            messages, next_page_token = emailManager.fetch_emails_messages_list(query, next_page_token, max_results=10)
-            logger.info(f"Fetched {len(messages)} emails for accountId: {tasksPayload.accountId}")
-            if len(messages) == 0:
-                break
-            processed_messages: list[EmailSanitized] = emailManager.fetch_messages_details_list(messages)
-            logger.info(f"Processed {len(processed_messages)} emails for accountId: {tasksPayload.accountId}")
-            
-            # send emails to mb-backend for inserting into db
-            # TODO: if userDetails.get("has_allowed_analytics", False) is True:
-            statusCode: int = emailManager.sync_database(processed_messages)
-            logger.info(f"Database sync status code: {statusCode}")
-
-            # Process LLM through Gemini and update the database
-            aiManager: AIManager = AIManager(
-                email=tasksPayload.email, 
-                userId=tasksPayload.userId, 
-                accountId=tasksPayload.accountId,
-            )
-            transactions_list: list[dict] = aiManager.extract_transactions_from_emails(processed_messages)
-
-            # Send processed transactions to mb-backend for inserting into db
-            if transactions_list:            
-                logger.info(f"Processed and extracted {len(transactions_list)} transactions from emails for email: {tasksPayload.email}")
-                status = aiManager.saveTransactions(transactions_list)
-                logger.info(f"AI Manager database sync status: {status}")
-            else:
-                logger.info("No transactions extracted from emails, skipping database sync")
-
-
-            # Process Orders from emails
-            llm_orders_response = aiManager.extract_order_from_emails(processed_messages)
-            orders_list = aiManager.extract_json_from_response(llm_orders_response.get("raw_model_output"))
-            if orders_list:
-                logger.info(f"Processed and extracted {len(orders_list)} orders from emails for email: {tasksPayload.email}")
-                status = aiManager.saveOrders(orders_list)
-                logger.info(f"AI Manager orders database sync status: {status}")
-
-            # Update lastSyncedAt to the latest email timestamp
-            if processed_messages:
-                if not latest_email_time:
-                    latest_email_time = processed_messages[0].receivedAt
-                for msg in processed_messages:
-                    if msg.receivedAt:
-                        latest_email_time = max(msg.receivedAt, latest_email_time)
-            if not next_page_token:
-                break
-        # while loop ends
-
-        if latest_email_time:
-            update_last_synced_at(tasksPayload.accountId, latest_email_time.isoformat())
+        # A checkpoint means the previous task stopped mid-sync, continue its listing instead of starting over
+        if ENV_SETTINGS.SYNC_CHECKPOINT_ENABLED:
+            checkpoint = SyncCheckpoint.load(BACKEND_CLIENT, tasksPayload.accountId)
+
+        if checkpoint:
+            query = checkpoint.query
+            start_history_id = checkpoint.start_history_id
+            sync_history_id = checkpoint.sync_history_id
+            logger.info(f"Resuming sync from checkpoint, Gmail query: {query}, start historyId: {start_history_id}")
+        else:
+            # Build query based on lastSyncedAt
+            query = emailManager.build_gmail_query(last_synced_at)
+
+            # Use the stored history cursor to list only messages added since the last sync.
+            # The mailbox historyId is captured before listing so nothing arriving mid-sync is skipped next time.
+            start_history_id = None
+            if ENV_SETTINGS.GMAIL_SYNC_MODE == "history":
+                start_history_id = accountDetails.get('historyId')
+
+            # Restrict the search to senders that produced transactions or orders before,
+            # history listing does not take a query so only query listings are narrowed
+            if not start_history_id:
+                query = narrow_query_to_financial_senders(tasksPayload.accountId, query)
+            logger.info(f"Gmail query: {query}")
+            sync_history_id = emailManager.get_initial_history_id()
+            logger.info(f"Gmail start historyId: {start_history_id}, current historyId: {sync_history_id}")
+            if ENV_SETTINGS.SYNC_CHECKPOINT_ENABLED:
+                checkpoint = SyncCheckpoint(
+                    BACKEND_CLIENT,
+                    tasksPayload.accountId,
+                    query=query,
+                    start_history_id=start_history_id,
+                    sync_history_id=sync_history_id,
+                )
+        if checkpoint:
+            register_checkpoint(checkpoint)
+
+        # Process LLM through Gemini and update the database
+        aiManager: AIManager = AIManager(
+            email=tasksPayload.email,
+            userId=tasksPayload.userId,
+            accountId=tasksPayload.accountId,
+        )
+
+        # Fetch, parse, extract and persist pages as overlapping pipeline stages
+        syncManager = SyncManager(
+            emailManager=emailManager,
+            aiManager=aiManager,
+            query=query,
+            start_history_id=start_history_id,
+            checkpoint=checkpoint,
+        )
+        # Raises when a page was not stored: lastSyncedAt stays put and the checkpoint keeps its ids for the retry
+        latest_email_time = await run_in_threadpool(syncManager.run)
+        logger.info(f"LLM dispatcher stats: {LLM_DISPATCHER.stats()}")
+        if MICRO_BATCHER:
+            logger.info(f"LLM micro batcher stats: {MICRO_BATCHER.stats()}")
+        logger.info(f"LLM model tier stats: {MODEL_ROUTER.stats()}")
+
+        if is_narrowed_query(query):
+            # Mail of unknown senders in this window was not listed, the next exploration run lists it
+            logger.info(f"Narrowed sync, lastSyncedAt and the history cursor stay at {last_synced_at}")
+        elif latest_email_time:
+            update_last_synced_at(tasksPayload.accountId, latest_email_time.isoformat(), sync_history_id)
             logger.info(f"Updated lastSyncedAt to {latest_email_time.isoformat()}")
+        else:
+            # keep the history cursor fresh even when nothing new arrived, Gmail expires old history ids
+            update_last_synced_at(tasksPayload.accountId, history_id=sync_history_id)
+
+        # lastSyncedAt only moves once the whole window is stored, Gmail lists newest first
+        if checkpoint:
+            checkpoint.clear()
+            unregister_checkpoint(checkpoint)
+            checkpoint = None
 
         return {"status": "done"}
     
@@ -228,10 +361,212 @@ async def processTask(request: Request):
         logger.error(f"Error processing job: {str(e)}")
         raise HTTPException(status_code=500, detail="Internal server error")
     finally:
+        # An interrupted sync keeps its checkpoint so the retried task resumes from the last stored page
+        if checkpoint:
+            checkpoint.flush()
+            unregister_checkpoint(checkpoint)
         # TODO: figure out way to unlock user if user id is not present
         if accountId:
             release_sync_lock(account_id=accountId)
 
+@app.post("/tasks/replay-failed")
+async def processReplay(request: Request):
+    '''
+    Reprocess only the emails whose extraction failed earlier, instead of re-syncing their window.
+    1. take the account given in input and authenticate gmail
+    2. fetch the ids of the failed emails from the dead letter store
+    3. download, parse and extract them through the sync pipeline
+    4. store transactions, orders and the new extraction status of each email
+    lastSyncedAt and the history cursor are left untouched.
+    '''
+    accountId = None
+    try:
+        logger.info("Received dead letter replay request")
+        payload = await request.body()
+        payload = base64.b64decode(payload).decode("utf-8")
+        payload = json.loads(payload)
+        accountId = payload.get("accountId")
+        tasksPayload: TaskQueuePayload = TaskQueuePayload(**payload)
+
+        accountDetails = fetch_account_details(tasksPayload.accountId)
+        if not accountDetails:
+            raise Exception("Failed to fetch account details")
+
+        message_ids = fetch_failed_email_ids(tasksPayload.accountId)
+        logger.info(f"Replaying {len(message_ids)} failed emails for account {tasksPayload.accountId}")
+        if not message_ids:
+            return {"status": "no failed emails"}
+
+        try:
+            gmailService = authenticateGmail(tasksPayload.token)
+        except TokenExpiredError as e:
+            logger.error(f"Token expired for account {tasksPayload.accountId}: {str(e)}")
+            invalidate_account_token(tasksPayload.accountId)
+            raise HTTPException(
+                status_code=401,
+                detail="Gmail refresh token has expired or been revoked. Please re-authenticate your Gmail account."
+            )
+
+        emailManager = EmailManager(
+            gmail_service=gmailService,
+            email=tasksPayload.email,
+            userId=accountDetails.get('userId'),
+            accountId=tasksPayload.accountId,
+        )
+        aiManager: AIManager = AIManager(
+            email=tasksPayload.email,
+            userId=tasksPayload.userId,
+            accountId=tasksPayload.accountId,
+        )
+        syncManager = SyncManager(
+            emailManager=emailManager,
+            aiManager=aiManager,
+            query="",
+            message_ids=message_ids,
+        )
+        await run_in_threadpool(syncManager.run)
+        return {"status": "done", "replayed": len(message_ids)}
+
+    except HTTPException:
+        raise
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.exception(e)
+        logger.error(f"Invalid JSON or base64 payload: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid payload format")
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f"Error replaying failed emails: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+    finally:
+        if accountId:
+            release_sync_lock(account_id=accountId)
+
+@app.post("/tasks/backfill")
+async def processBackfill(request: Request):
+    '''
+    Backfill the mailbox history of a newly onboarded account through offline batch prediction.
+    1. take the account given in input and claim its backfill, a second backfill task of the account is dropped
+    2. authenticate gmail and shard the history before the first sync window by month
+    3. submit one batch prediction job per month, each recorded in mb-backend once submitted
+    4. enqueue the task polling the jobs
+    The jobs take minutes to hours, they are ingested by /tasks/backfill-poll instead of being waited for here.
+    '''
+    try:
+        logger.info("Received backfill request")
+        payload = await request.body()
+        payload = base64.b64decode(payload).decode("utf-8")
+        payload = json.loads(payload)
+        tasksPayload: TaskQueuePayload = TaskQueuePayload(**payload)
+
+        accountDetails = fetch_account_details(tasksPayload.accountId)
+        if not accountDetails:
+            raise Exception("Failed to fetch account details")
+
+        # Cloud Tasks keeps the task name across retries, a retried task resumes the months it submitted
+        owner = request.headers.get("X-CloudTasks-TaskName") or str(uuid.uuid4())
+        state = BackfillState.claim(BACKEND_CLIENT, tasksPayload.accountId, owner, ENV_SETTINGS.BACKFILL_LEASE_SECONDS)
+        if not state:
+            logger.info(f"Backfill already started for account {tasksPayload.accountId}")
+            return {"status": "already started"}
+
+        try:
+            gmailService = authenticateGmail(tasksPayload.token)
+        except TokenExpiredError as e:
+            logger.error(f"Token expired for account {tasksPayload.accountId}: {str(e)}")
+            invalidate_account_token(tasksPayload.accountId)
+            raise HTTPException(
+                status_code=401,
+                detail="Gmail refresh token has expired or been revoked. Please re-authenticate your Gmail account."
+            )
+
+        emailManager = EmailManager(
+            gmail_service=gmailService,
+            email=tasksPayload.email,
+            userId=accountDetails.get('userId'),
+            accountId=tasksPayload.accountId,
+        )
+        aiManager: AIManager = AIManager(
+            email=tasksPayload.email,
+            userId=tasksPayload.userId,
+            accountId=tasksPayload.accountId,
+        )
+        backfillManager = BackfillManager(
+            aiManager=aiManager,
+            backend=BACKFILL_BACKEND,
+            state=state,
+            settings=ENV_SETTINGS,
+            emailManager=emailManager,
+            prompt=PROMPT_REGISTRY.get("combined"),
+            # never narrowed, a new account has no senders of its own and older mail is never listed again
+            base_query="",
+            # the first interactive sync covers the days after this
+            before=datetime.now() - timedelta(days=INITIAL_SYNC_LOOKBACK_DAYS),
+        )
+        pending = await run_in_threadpool(backfillManager.submit)
+        if pending:
+            enqueue_worker_task(tasksPayload.model_dump(), "/tasks/backfill-poll", ENV_SETTINGS.BACKFILL_POLL_SECONDS)
+        return {"status": "submitted", "pending": pending}
+
+    except HTTPException:
+        raise
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.exception(e)
+        logger.error(f"Invalid JSON or base64 payload: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid payload format")
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f"Error starting backfill job: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
+@app.post("/tasks/backfill-poll")
+async def processBackfillPoll(request: Request):
+    '''
+    Ingest the batch prediction jobs of a backfill, enqueued by /tasks/backfill and again by itself until every job is ingested.
+    1. load the backfill of the account given in input from mb-backend
+    2. store the transactions and orders of one month whose job has completed
+    3. enqueue the next poll, right away when a month was ingested and after BACKFILL_POLL_SECONDS otherwise
+    A failed poll is retried by Cloud Tasks, months already ingested are skipped.
+    '''
+    try:
+        logger.info("Received backfill poll request")
+        payload = await request.body()
+        payload = base64.b64decode(payload).decode("utf-8")
+        payload = json.loads(payload)
+        tasksPayload: TaskQueuePayload = TaskQueuePayload(**payload)
+
+        state = BackfillState.load(BACKEND_CLIENT, tasksPayload.accountId)
+        if not state or state.state == BACKFILL_COMPLETED:
+            return {"status": "done"}
+
+        aiManager: AIManager = AIManager(
+            email=tasksPayload.email,
+            userId=tasksPayload.userId,
+            accountId=tasksPayload.accountId,
+        )
+        backfillManager = BackfillManager(
+            aiManager=aiManager,
+            backend=BACKFILL_BACKEND,
+            state=state,
+            settings=ENV_SETTINGS,
+        )
+        job = await run_in_threadpool(backfillManager.poll)
+        pending = len(state.pending_jobs())
+        if pending:
+            # another month may have completed while this one was ingested
+            enqueue_worker_task(tasksPayload.model_dump(), "/tasks/backfill-poll", 0 if job else ENV_SETTINGS.BACKFILL_POLL_SECONDS)
+        return {"status": "ingested" if job else "waiting", "pending": pending}
+
+    except HTTPException:
+        raise
+    except (json.JSONDecodeError, ValueError) as e:
+        logger.exception(e)
+        logger.error(f"Invalid JSON or base64 payload: {str(e)}")
+        raise HTTPException(status_code=400, detail="Invalid payload format")
+    except Exception as e:
+        logger.exception(e)
+        logger.error(f"Error polling backfill jobs: {str(e)}")
+        raise HTTPException(status_code=500, detail="Internal server error")
+
 @app.post("/tasks/co-relate-orders")
 async def processOrders(request: Request):
     '''
@@ -0,0 +1,164 @@
+import re
+import threading
+from typing import Callable
+
+from worker.batch_packer import estimate_tokens
+from worker.stream_parser import ItemParseError
+
+# Every message sent to the llm starts with "ID <message id>:"
+MESSAGE_HEADER_PATTERN = re.compile(r"^ID ([^:\n]+):")
+
+
+class Submission:
+    '''The messages one account sync added to a shared batch, keyed by the tag they were sent under.'''
+    def __init__(self, account_id: str, messages: list[str]):
+        self.account_id = account_id
+        self.messages = messages
+        self.message_ids: dict[str, str] = {}
+
+
+class PendingBatch:
+    '''Submissions collected for one prompt during one window.'''
+    def __init__(self):
+        self.submissions: list[Submission] = []
+        self.messages: list[str] = []
+        self.tokens = 0
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.response: dict | None = None
+        self.error: Exception | None = None
+
+
+class MicroBatcher:
+    '''
+    This class is supposed to do the following actions:
+    1. Collect the messages of every account sync calling the same prompt within a short window
+    2. Tag each message with its submission and message id, so ids from different mailboxes never clash
+    3. Send them as one llm request once the window ends or the batch reaches its item or token cap
+    4. Route the extracted items back to the caller that submitted each message
+    The first caller of a window is the leader and sends the request on its own thread, the others wait.
+    A leader with no other request for the prompt open or in flight sends at once, the window only
+    opens under concurrency so a lone sync does not pay its latency on every call.
+    The caps sit above the per-sync batch size, a batch the sync packer filled still has room for others.
+    '''
+    def __init__(self, window_seconds: float = 0.2, max_items: int = 100, max_tokens: int = 32000):
+        self.window_seconds = window_seconds
+        self.max_items = max(1, max_items)
+        self.max_tokens = max_tokens
+        self.lock = threading.Lock()
+        self.open_batches: dict[str, PendingBatch] = {}
+        # batches per prompt from their first submission until their response arrived
+        self.active: dict[str, int] = {}
+        self.requests = 0
+        self.submissions = 0
+        self.items = 0
+
+    def submit(
+        self,
+        key: str,
+        account_id: str,
+        messages: list[str],
+        send: Callable[[list[str]], dict],
+        parse: Callable[[dict], tuple[list, bool]],
+        id_field: str = "id",
+    ) -> dict:
+        """
+        Add messages to the open batch for `key` (the prompt) and block until its response arrives.
+        `send` makes the llm call for a list of messages and `parse` turns its response into
+        (items, complete). Returns the caller's own items in the same shape.
+        """
+        tokens = sum(estimate_tokens(message) for message in messages)
+        leader = False
+        concurrent = False
+        with self.lock:
+            batch = self.open_batches.get(key)
+            if batch and (
+                len(batch.messages) + len(messages) > self.max_items or batch.tokens + tokens > self.max_tokens
+            ):
+                self.close(key, batch)
+                batch = None
+            if batch is None:
+                batch = PendingBatch()
+                self.open_batches[key] = batch
+                leader = True
+                concurrent = self.active.get(key, 0) > 0
+                self.active[key] = self.active.get(key, 0) + 1
+            submission = self.add(batch, account_id, messages, tokens)
+            if len(batch.messages) >= self.max_items or batch.tokens >= self.max_tokens:
+                self.close(key, batch)
+
+        if leader:
+            if concurrent:
+                batch.full.wait(self.window_seconds)
+            with self.lock:
+                self.close(key, batch)
+                self.requests += 1
+                self.items += len(batch.messages)
+            try:
+                batch.response = send(batch.messages)
+            except Exception as e:
+                batch.error = e
+            finally:
+                with self.lock:
+                    self.active[key] -= 1
+                    if not self.active[key]:
+                        del self.active[key]
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        return self.route(batch, submission, parse, id_field)
+
+    def add(self, batch: PendingBatch, account_id: str, messages: list[str], tokens: int) -> Submission:
+        """Tag the messages and append them to the batch. Caller holds the lock."""
+        submission = Submission(account_id, messages)
+        index = len(batch.submissions)
+        for message in messages:
+            match = MESSAGE_HEADER_PATTERN.match(message)
+            if not match:
+                batch.messages.append(message)
+                continue
+            tag = f"{index}.{match.group(1)}"
+            submission.message_ids[tag] = match.group(1)
+            batch.messages.append(f"ID {tag}:" + message[match.end():])
+        batch.submissions.append(submission)
+        batch.tokens += tokens
+        self.submissions += 1
+        return submission
+
+    def close(self, key: str, batch: PendingBatch):
+        """Stop adding to the batch and wake its leader. Caller holds the lock."""
+        if self.open_batches.get(key) is batch:
+            del self.open_batches[key]
+        batch.full.set()
+
+    def route(self, batch: PendingBatch, submission: Submission, parse, id_field: str) -> dict:
+        items, complete = parse(batch.response)
+        own_items = []
+        for item in items:
+            if isinstance(item, ItemParseError):
+                match = re.search(rf'"{id_field}"\s*:\s*"([^"]+)"', item.raw)
+                tag = match.group(1) if match else None
+                if tag is None:
+                    # a broken item that cannot be routed could belong to anyone, let every caller retry
+                    complete = False
+                elif tag in submission.message_ids:
+                    own_items.append(ItemParseError(item.raw.replace(tag, submission.message_ids[tag]), item.error))
+            elif isinstance(item, dict) and item.get(id_field) in submission.message_ids:
+                own_items.append({**item, id_field: submission.message_ids[item[id_field]]})
+        return {
+            "input_messages": submission.messages,
+            "items": own_items,
+            "complete": complete,
+            "batched_with": len(batch.submissions) - 1,
+        }
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "submissions": self.submissions,
+                "items_per_request": self.items / self.requests if self.requests else 0.0,
+            }
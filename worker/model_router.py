@@ -0,0 +1,135 @@
+import re
+import threading
+from collections import Counter, defaultdict
+
+from packages.models import EmailSanitized
+from worker.receipt_classifier import AMOUNT_PATTERN, is_order_sender, sender_domain
+from worker.template_parsers import DEFAULT_REGISTRY
+
+LIGHT_TIER = "light"
+STANDARD_TIER = "standard"
+
+# Text lengths (snippet plus body) above which a message counts as long and very long
+LONG_MESSAGE_CHARS = 800
+VERY_LONG_MESSAGE_CHARS = 4000
+# Rows with at least two " | " cell separators, which html_to_text emits for table cells
+TABLE_CELL_SEPARATOR = " | "
+MIN_TABLE_ROWS = 3
+
+# Wording of a money movement, an amount without it (offers, price drops) is not a missed transaction
+TRANSACTION_WORDS_PATTERN = re.compile(
+    r"\b(debited|credited|spent|withdrawn|transferred|paid|sent to|received from|txn|transaction|upi|neft|imps|rtgs|a/c)\b",
+    re.IGNORECASE,
+)
+PROMOTION_WORDS_PATTERN = re.compile(
+    r"(\boff\b|\boffers?\b|\bsale\b|\bdiscount|\bcoupon|\bvoucher|\bdeals?\b|\bsave\b|\bcashback\b|\bwin\b)",
+    re.IGNORECASE,
+)
+
+
+def count_table_rows(text: str) -> int:
+    return sum(1 for line in text.splitlines() if line.count(TABLE_CELL_SEPARATOR) >= 2)
+
+
+class ModelRouter:
+    '''
+    This class is supposed to do the following actions:
+    1. Score how hard a message is to extract from its length, sender class and line item tables
+    2. Route low scoring messages (short bank and UPI alerts) to the light model and the rest to the standard model
+    3. Flag light tier results that look wrong, so they are escalated to the standard model
+    4. Record latency, token and escalation metrics per tier
+    '''
+    def __init__(self, light_model: str, standard_model: str, max_light_score: int = 0, enabled: bool = True):
+        self.models = {LIGHT_TIER: light_model, STANDARD_TIER: standard_model}
+        self.max_light_score = max_light_score
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.calls: Counter = Counter()
+        self.messages: Counter = Counter()
+        self.seconds: defaultdict[str, float] = defaultdict(float)
+        self.input_tokens: Counter = Counter()
+        self.output_tokens: Counter = Counter()
+        self.escalations = 0
+
+    def model_for(self, tier: str) -> str:
+        return self.models[tier]
+
+    def score(self, email: EmailSanitized) -> int:
+        text_length = len(email.snippet or "") + len(email.body or "")
+        score = 0
+        if text_length > LONG_MESSAGE_CHARS:
+            score += 1
+        if text_length > VERY_LONG_MESSAGE_CHARS:
+            score += 1
+        if email.body and count_table_rows(email.body) >= MIN_TABLE_ROWS:
+            score += 2
+        if is_order_sender(email.emailId):
+            score += 2
+        elif DEFAULT_REGISTRY.templates_for(sender_domain(email.emailId)):
+            # banks and UPI apps with known alert wording
+            score -= 1
+        return score
+
+    def tier_for(self, email: EmailSanitized) -> str:
+        if self.enabled and self.score(email) <= self.max_light_score:
+            return LIGHT_TIER
+        return STANDARD_TIER
+
+    def split(self, message_ids: list[str], emails_by_id: dict[str, EmailSanitized]) -> tuple[list[str], list[str]]:
+        """Return the message ids for the light tier and for the standard tier."""
+        light_ids, standard_ids = [], []
+        for message_id in message_ids:
+            if self.tier_for(emails_by_id[message_id]) == LIGHT_TIER:
+                light_ids.append(message_id)
+            else:
+                standard_ids.append(message_id)
+        return light_ids, standard_ids
+
+    def low_confidence_ids(self, message_ids: list[str], items: list[dict], emails_by_id: dict[str, EmailSanitized], id_field: str) -> set[str]:
+        """
+        Messages the light model found nothing in although their snippet reads like a transaction alert:
+        an amount together with money movement wording (debited, credited, UPI) and no promotion wording.
+        An offer mail with a rupee amount is a plausible "other", escalating it would pay for two calls.
+        """
+        extracted = {item.get(id_field) for item in items if item.get("kind", "transaction") != "other"}
+        return {
+            message_id for message_id in message_ids
+            if message_id not in extracted and self.reads_like_transaction(emails_by_id[message_id].snippet or "")
+        }
+
+    def reads_like_transaction(self, snippet: str) -> bool:
+        return bool(
+            AMOUNT_PATTERN.search(snippet)
+            and TRANSACTION_WORDS_PATTERN.search(snippet)
+            and not PROMOTION_WORDS_PATTERN.search(snippet)
+        )
+
+    def record_call(self, model: str, seconds: float, messages: int, usage_metadata):
+        tier = next((tier for tier, tier_model in self.models.items() if tier_model == model), model)
+        with self.lock:
+            self.calls[tier] += 1
+            self.messages[tier] += messages
+            self.seconds[tier] += seconds
+            self.input_tokens[tier] += getattr(usage_metadata, "prompt_token_count", None) or 0
+            self.output_tokens[tier] += getattr(usage_metadata, "candidates_token_count", None) or 0
+
+    def record_escalations(self, count: int):
+        with self.lock:
+            self.escalations += count
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "escalations": self.escalations,
+                "tiers": {
+                    tier: {
+                        "model": self.models.get(tier, tier),
+                        "calls": self.calls[tier],
+                        "messages": self.messages[tier],
+                        "avg_latency_seconds": self.seconds[tier] / self.calls[tier] if self.calls[tier] else 0.0,
+                        "input_tokens": self.input_tokens[tier],
+                        "output_tokens": self.output_tokens[tier],
+                    }
+                    for tier in self.calls
+                },
+            }
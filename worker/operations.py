@@ -1,20 +1,76 @@
 from datetime import datetime, timedelta, timezone
-import re
-import base64
+import time
+import random
+import threading
 from email.utils import parseaddr
 from email.header import decode_header
 import json
 from langsmith import traceable
-import requests
 from langsmith.run_helpers import get_current_run_tree
 from googleapiclient.discovery import Resource
-from packages.models import EmailSanitized, OrdersListIntentModel, Transaction
-from packages.enums import TransactionCategory
-from worker.connectors import ENV_SETTINGS, VERTEXT_CLIENT
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+from google_auth_httplib2 import AuthorizedHttp
+from google.genai.types import GenerateContentConfig
+from packages.models import (
+    EmailSanitized,
+    ExtractionListIntentModel,
+    MessageExtractionIntentModel,
+    OrdersIntentModel,
+    OrdersListIntentModel,
+    Transaction,
+)
+from worker.connectors import BACKEND_CLIENT, DB_PERSISTENCE, ENV_SETTINGS, EXTRACTION_CACHE, LLM_DISPATCHER, MICRO_BATCHER, MODEL_ROUTER, PROMPT_REGISTRY
+from worker.extraction_cache import CachedBatch
+from worker.llm_dispatcher import PartialStreamError
+from worker.model_router import LIGHT_TIER, STANDARD_TIER
+from worker.prompts import PromptRequest
+from worker.template_parsers import DEFAULT_REGISTRY
+from worker.item_extraction import extract_items_with_retries, response_items
+from worker.stream_parser import StreamedItems
+from worker.receipt_classifier import is_likely_order_receipt
+from worker.body_extraction import decode_base64url, decode_part, extract_body_text, find_body_parts, html_to_text
 from worker.log import setup_logger
 
 logger = setup_logger(__name__)
 
+# Gmail rejects batches with more than 100 sub-requests
+GMAIL_MAX_BATCH_SIZE = 100
+GMAIL_RETRY_BASE_DELAY_SECONDS = 0.5
+GMAIL_RETRY_MAX_DELAY_SECONDS = 8
+# The date query excludes spam and trash, keep history deltas consistent with it
+HISTORY_SKIPPED_LABELS = {"SPAM", "TRASH", "DRAFT"}
+# Partial response for the metadata phase of two-phase fetching
+METADATA_HEADERS = ["From", "Subject"]
+METADATA_FIELDS = "id,threadId,snippet,internalDate,payload/headers"
+# Stored emails in these states need no new extraction during a sync
+KNOWN_EXTRACTION_STATUSES = {"parsed", "failed"}
+# The first sync of an account looks back this far, older mail is left to the onboarding backfill
+INITIAL_SYNC_LOOKBACK_DAYS = 7
+
+
+def persistence_status(counts) -> int:
+    """Map a direct database write to the status code the http path returns, so callers handle both alike."""
+    return 200 if counts is not None else 500
+
+
+class PersistError(Exception):
+    """Raised when a page could not be stored, its emails must not count as synced."""
+    pass
+
+
+class HistoryCursorExpiredError(Exception):
+    """Raised when the stored Gmail historyId is too old to list changes from."""
+    pass
+
+
+class MessageFetchError(Exception):
+    """Raised when messages still fail to download after the retries, their page must not count as synced."""
+    def __init__(self, message: str, message_ids: list[str]):
+        super().__init__(message)
+        self.message_ids = message_ids
+
+
 class EmailManager:
     '''
     This class is supposed to do the following actions:
@@ -27,6 +83,22 @@ class EmailManager:
         self.email = email
         self.userId = userId
         self.accountId = accountId
+        self.thread_local = threading.local()
+
+    def get_http(self):
+        """
+        httplib2 connections are not thread safe, so every thread that talks to Gmail
+        gets its own connection authorized with the service credentials.
+        """
+        http = getattr(self.thread_local, "http", None)
+        if http is None:
+            service_http = self.gmail_service._http
+            if isinstance(service_http, AuthorizedHttp):
+                http = AuthorizedHttp(service_http.credentials, http=build_http())
+            else:
+                http = build_http()
+            self.thread_local.http = http
+        return http
 
     def build_gmail_query(self, last_synced_at: str = None) -> str:
         """Build Gmail search query based on lastSyncedAt."""
@@ -41,47 +113,213 @@ class EmailManager:
                 logger.error(f"Error parsing lastSyncedAt: {e}")
     
         # If no lastSyncedAt, use today - 7 days
-        seven_days_ago = datetime.now() - timedelta(days=7)
+        seven_days_ago = datetime.now() - timedelta(days=INITIAL_SYNC_LOOKBACK_DAYS)
         timestamp = int(seven_days_ago.timestamp())
         return f"after:{timestamp}"
 
-    def get_initial_history_id(service):
-        profile = service.users().getProfile(userId="me").execute()
+    def get_initial_history_id(self) -> str:
+        profile = self.gmail_service.users().getProfile(userId="me").execute(http=self.get_http())
         return profile["historyId"]
 
-    def fetch_emails_messages_list(self, query, next_page_token=None, max_results=1) -> tuple:
+    def list_history_message_ids(self, start_history_id: str, next_page_token=None, max_results=1) -> tuple[list[str], str | None]:
+        """
+        List ids of messages added to the mailbox since start_history_id.
+        Raises HistoryCursorExpiredError when Gmail no longer holds history that far back.
+        """
+        try:
+            results = self.gmail_service.users().history().list(
+                userId='me',
+                startHistoryId=start_history_id,
+                historyTypes=['messageAdded'],
+                maxResults=max_results,
+                pageToken=next_page_token,
+            ).execute(http=self.get_http())
+        except HttpError as e:
+            if e.resp.status == 404:
+                raise HistoryCursorExpiredError(f"History id {start_history_id} is no longer available") from e
+            raise
+
+        message_ids = []
+        for record in results.get('history', []):
+            for added in record.get('messagesAdded', []):
+                message = added.get('message', {})
+                labels = set(message.get('labelIds', []))
+                if labels & HISTORY_SKIPPED_LABELS:
+                    continue
+                if message.get('id') and message['id'] not in message_ids:
+                    message_ids.append(message['id'])
+        return message_ids, results.get('nextPageToken')
+
+    def fetch_history_messages_list(self, start_history_id: str, next_page_token=None, max_results=1) -> tuple:
+        message_ids, next_page_token = self.list_history_message_ids(start_history_id, next_page_token, max_results)
+        return self.fetch_messages_by_ids(message_ids), next_page_token
+
+    def list_message_ids(self, query, next_page_token=None, max_results=1) -> tuple[list[str], str | None]:
         results = self.gmail_service.users().messages().list(
-            userId='me', 
-            maxResults=max_results, 
+            userId='me',
+            maxResults=max_results,
             q=query,
             pageToken=next_page_token,
             includeSpamTrash=False,
-        ).execute()
-        messages = results.get('messages', [])
+        ).execute(http=self.get_http())
+        message_ids = [msg['id'] for msg in results.get('messages', [])]
+        return message_ids, results.get('nextPageToken')
+
+    def fetch_emails_messages_list(self, query, next_page_token=None, max_results=1) -> tuple:
+        message_ids, next_page_token = self.list_message_ids(query, next_page_token, max_results)
+        return self.fetch_messages_by_ids(message_ids), next_page_token
+
+    def build_get_request(self, message_id: str, message_format: str = "full"):
+        if message_format == "metadata":
+            return self.gmail_service.users().messages().get(
+                userId='me',
+                id=message_id,
+                format='metadata',
+                metadataHeaders=METADATA_HEADERS,
+                fields=METADATA_FIELDS,
+            )
+        return self.gmail_service.users().messages().get(userId='me', id=message_id)
+
+    def fetch_messages_by_ids(self, message_ids: list[str], message_format: str = "full") -> list[dict]:
+        """Fetch Gmail messages for the given ids, preserving the input order."""
+        if ENV_SETTINGS.GMAIL_FETCH_MODE == "batch":
+            return self.fetch_messages_batch(message_ids, message_format)
+
         message_list = []
-        for msg in messages:
-            msg_data = self.gmail_service.users().messages().get(userId='me', id=msg['id']).execute()
+        for message_id in message_ids:
+            msg_data = self.build_get_request(message_id, message_format).execute(
+                http=self.get_http(),
+                num_retries=ENV_SETTINGS.GMAIL_FETCH_MAX_RETRIES,
+            )
             message_list.append(msg_data)
-        return message_list, results.get('nextPageToken')
+        return message_list
+
+    def fetch_messages_two_phase(self, message_ids: list[str]) -> list[dict]:
+        """
+        Phase one fetches only headers and snippet for every message.
+        Phase two downloads the full MIME tree only for likely order receipts,
+        the only messages whose body is used for extraction.
+        """
+        messages = self.fetch_messages_by_ids(message_ids, message_format="metadata")
+
+        receipt_ids = []
+        for msg in messages:
+            header_data = self.extract_headers(msg.get("payload", {}).get("headers", []))
+            if is_likely_order_receipt(header_data.get("sender_email"), header_data.get("subject"), msg.get("snippet")):
+                receipt_ids.append(msg["id"])
+
+        logger.info(f"Downloading full body for {len(receipt_ids)} of {len(messages)} messages")
+        if not receipt_ids:
+            return messages
+
+        full_messages = {msg["id"]: msg for msg in self.fetch_messages_by_ids(receipt_ids)}
+        return [full_messages.get(msg["id"], msg) for msg in messages]
+
+    def is_retryable_fetch_error(self, error: Exception) -> bool:
+        if isinstance(error, HttpError):
+            return error.resp.status == 429 or error.resp.status >= 500
+        return True
+
+    def fetch_messages_batch(self, message_ids: list[str], message_format: str = "full") -> list[dict]:
+        """
+        Fetch messages through the Gmail batch endpoint.
+        Each batch carries up to GMAIL_BATCH_SIZE (max 100) sub-requests. Sub-requests that fail
+        with a rate limit or server error are retried individually with exponential backoff, and
+        MessageFetchError is raised for those still failing after the retries. Messages that fail
+        permanently (e.g. deleted in the meantime) are skipped.
+        """
+        batch_size = max(1, min(ENV_SETTINGS.GMAIL_BATCH_SIZE, GMAIL_MAX_BATCH_SIZE))
+        max_retries = ENV_SETTINGS.GMAIL_FETCH_MAX_RETRIES
+
+        fetched: dict[str, dict] = {}
+        pending = list(dict.fromkeys(message_ids))
+
+        for attempt in range(max_retries + 1):
+            # dict as an ordered set, a chunk whose execute raised may already have ids failed by its callbacks
+            failed: dict[str, None] = {}
+
+            def on_response(request_id, response, exception):
+                if exception is None:
+                    fetched[request_id] = response
+                elif self.is_retryable_fetch_error(exception):
+                    failed[request_id] = None
+                else:
+                    logger.warning(f"Skipping message {request_id}, fetch failed permanently: {exception}")
+
+            for start in range(0, len(pending), batch_size):
+                chunk = pending[start:start + batch_size]
+                batch = self.gmail_service.new_batch_http_request(callback=on_response)
+                for message_id in chunk:
+                    batch.add(self.build_get_request(message_id, message_format), request_id=message_id)
+                try:
+                    batch.execute(http=self.get_http())
+                except Exception as e:
+                    logger.warning(f"Gmail batch request for {len(chunk)} messages failed: {e}")
+                    failed.update(dict.fromkeys(message_id for message_id in chunk if message_id not in fetched))
+
+            if not failed:
+                break
+
+            if attempt == max_retries:
+                logger.error(f"Giving up on {len(failed)} messages after {max_retries} retries: {list(failed)}")
+                raise MessageFetchError(f"Failed to fetch {len(failed)} messages after {max_retries} retries", list(failed))
+
+            delay = min(GMAIL_RETRY_MAX_DELAY_SECONDS, GMAIL_RETRY_BASE_DELAY_SECONDS * (2 ** attempt))
+            delay = delay + random.uniform(0, delay)
+            logger.warning(f"Retrying {len(failed)} failed message fetches in {delay:.2f}s (attempt {attempt + 1}/{max_retries})")
+            time.sleep(delay)
+            pending = list(failed)
+
+        return [fetched[message_id] for message_id in message_ids if message_id in fetched]
+
+    def filter_known_message_ids(self, message_ids: list[str]) -> list[str]:
+        '''
+        Drop the messages mb-backend already holds as parsed or failed, before their bodies are fetched.
+        Failed messages are left to the dead letter replay, pending ones (stored by a crashed sync) are kept.
+        If the check fails every message is kept, processing twice is safe but skipping is not.
+        '''
+        if not message_ids:
+            return message_ids
+        try:
+            response = BACKEND_CLIENT.post(
+                'api/v1/emails/existing',
+                json={'accountId': self.accountId, 'ids': message_ids},
+            )
+            if response.status_code != 200:
+                logger.error(f"Failed to check existing emails: {response.text}")
+                return message_ids
+            known = {
+                email['id'] for email in response.json().get('emails', [])
+                if email.get('extraction_status') in KNOWN_EXTRACTION_STATUSES
+            }
+        except Exception as e:
+            logger.error(f"Error checking existing emails for account {self.accountId}: {e}")
+            return message_ids
+        if known:
+            logger.info(f"Skipping {len(known)}/{len(message_ids)} already processed emails for accountId: {self.accountId}")
+        return [id for id in message_ids if id not in known]
 
     def sync_database(self, processed_messages: list[EmailSanitized]):
         '''
         Send the list of emails to mb-backend api to insert into db
         Send in batch of 50
         '''
+        if DB_PERSISTENCE:
+            return persistence_status(DB_PERSISTENCE.save(self.userId, self.accountId, emails=processed_messages))
+
         formatted_email_list = []
         for email in processed_messages:
-            formatted_email_list.append(json.loads(email.model_dump_json()))
+            formatted_email_list.append(email.model_dump(mode='json'))
 
-        response = requests.post(
-            ENV_SETTINGS.MB_BACKEND_API_URL + 'api/v1/emails/insert-bulk',
-            headers={'Content-Type': 'application/json'},
+        response = BACKEND_CLIENT.post(
+            'api/v1/emails/insert-bulk',
             json={
                 'emails': formatted_email_list,
                 'userId': self.userId,
                 'emailId': self.email,
                 'accountId': self.accountId,
-            }
+            },
+            binary=True,
         )
         if response.status_code != 200:
             logger.error(f"Failed to insert batch starting at index : {response.text}")
@@ -101,9 +339,7 @@ class EmailManager:
             tz=timezone.utc
         )
     def decode_base64url(self, data: str) -> str:
-        if not data:
-            return ""
-        return base64.urlsafe_b64decode(data).decode("utf-8", errors="replace")
+        return decode_base64url(data).decode("utf-8", errors="replace")
 
 
     def decode_sender_name(self, raw_name: str) -> str | None:
@@ -160,59 +396,22 @@ class EmailManager:
 
     def extract_body_from_payload(self, payload: dict) -> dict:
         """
-        Recursively walk MIME tree.
+        Walk MIME tree.
         Returns dict with keys: text, html
         """
-        result = {"text": None, "html": None}
-
-        mime_type = payload.get("mimeType", "")
-        body = payload.get("body", {})
-        data = body.get("data")
-
-        # Direct body
-        if mime_type == "text/plain" and data:
-            result["text"] = self.decode_base64url(data)
-            return result
-
-        if mime_type == "text/html" and data:
-            result["html"] = self.decode_base64url(data)
-            return result
-
-        # Multipart
-        for part in payload.get("parts", []):
-            sub = self.extract_body_from_payload(part)
-
-            if sub["text"] and not result["text"]:
-                result["text"] = sub["text"]
-
-            if sub["html"] and not result["html"]:
-                result["html"] = sub["html"]
-
-            if result["text"]:
-                break
-
-        return result
+        text_part, html_part = find_body_parts(payload)
+        return {
+            "text": decode_part(text_part) if text_part else None,
+            "html": decode_part(html_part) if html_part else None,
+        }
 
 
     def html_to_text(self, html: str) -> str:
-        text = re.sub(r"<script.*?>.*?</script>", " ", html, flags=re.S)
-        text = re.sub(r"<style.*?>.*?</style>", " ", html, flags=re.S)
-        text = re.sub(r"<[^>]+>", " ", text)
-        text = re.sub(r"\s+", " ", text)
-        return text.strip()
+        return html_to_text(html)
 
 
     def extract_email_body(self, msg: dict) -> str:
-        payload = msg.get("payload", {})
-        bodies = self.extract_body_from_payload(payload)
-
-        if bodies["text"]:
-            return bodies["text"].strip()
-
-        if bodies["html"]:
-            return self.html_to_text(bodies["html"])
-
-        return ""
+        return extract_body_text(msg.get("payload", {}))
 
     def process_gmail_message(self, msg: dict) -> EmailSanitized:
         headers = msg.get("payload", {}).get("headers", [])
@@ -255,90 +454,133 @@ class AIManager:
         self.email = email
         self.userId = userId
         self.accountId = accountId
+        # Last extraction error of each email that failed, reported to mb-backend as its dead letter
+        self.status_lock = threading.Lock()
+        self.extraction_errors: dict[str, str] = {}
+
+    def set_run_usage(self, run, response):
+        # No run tree when langsmith tracing is disabled
+        if run is None:
+            return
+        if hasattr(response, "usage_metadata") and response.usage_metadata:
+            token_usage = {
+                "input_tokens": response.usage_metadata.prompt_token_count,
+                "output_tokens": response.usage_metadata.candidates_token_count,
+                "total_tokens": response.usage_metadata.total_token_count,
+                "input_token_details": {
+                    "cache_read": response.usage_metadata.cached_content_token_count,
+                },
+            }
+            run.set(usage_metadata=token_usage)
+
+        run.metadata["user_id"] = self.userId
+        run.metadata["email"] = self.email
+        run.metadata["account_id"] = self.accountId
+
+    def stream_structured_items(self, request: PromptRequest, response_schema, run) -> dict:
+        """
+        Call Gemini in json mode with a response schema and parse the array items as the chunks arrive.
+        A stream that breaks after some items returns them with `complete` False, so only the
+        messages that were not covered need another call.
+        """
+        streamed: StreamedItems = self.dispatch_with_prompt(
+            request,
+            lambda **kwargs: LLM_DISPATCHER.generate_content_stream(consumer=StreamedItems, **kwargs),
+            lambda request: GenerateContentConfig(
+                response_mime_type="application/json",
+                response_schema=response_schema,
+                cached_content=request.cached_content,
+            ),
+        )
+
+        usage_metadata = None
+        if streamed.responses:
+            usage_metadata = streamed.responses[-1].usage_metadata
+            self.set_run_usage(run, streamed.responses[-1])
+            PROMPT_REGISTRY.record_usage(request, usage_metadata)
+        return {
+            "raw_model_output": "".join(streamed.chunks),
+            "items": streamed.items,
+            "complete": streamed.complete,
+            "usage_metadata": usage_metadata,
+        }
+
+    def dispatch_with_prompt(self, request: PromptRequest, send, build_config):
+        """
+        Send a prompt request through the llm dispatcher, which retries transient errors with backoff.
+        A rejected cached content handle is recreated once, and a broken stream returns what arrived.
+        """
+        for attempt in range(2):
+            try:
+                return send(model=request.model, contents=request.contents, config=build_config(request))
+            except PartialStreamError as e:
+                logger.warning(f"Stream broke after {len(e.responses)} chunks: {str(e.error)}")
+                return e.result
+            except Exception as e:
+                refreshed = self.refresh_prompt_request(request, e)
+                if attempt == 1 or refreshed is request:
+                    logger.error(f"LLM request failed for prompt {request.name}: {str(e)}")
+                    raise
+                logger.warning(f"Cached content for prompt {request.name} was rejected, recreating it: {str(e)}")
+                request = refreshed
+
+    def refresh_prompt_request(self, request: PromptRequest, error: Exception) -> PromptRequest:
+        """Rebuild a request whose cached content was rejected (deleted or expired), other errors keep it."""
+        if request.cached_content and "cache" in str(error).lower():
+            PROMPT_REGISTRY.invalidate(request.name, request.model)
+            return PROMPT_REGISTRY.build_request(request.name, request.payload, request.model)
+        return request
+
+    def generate_from_prompt(self, prompt_name: str, message_to_parse_list: list[str], response_schema, run, model: str = None) -> dict:
+        """Extract from the messages with a registered prompt, sharing the request with other account syncs when micro batching is on."""
+        model = model or MODEL_ROUTER.model_for(STANDARD_TIER)
+        if run is not None:
+            run.metadata["ls_model_name"] = model
+        if MICRO_BATCHER is None:
+            return self.send_prompt(prompt_name, message_to_parse_list, response_schema, run, model)
+        return MICRO_BATCHER.submit(
+            f"{prompt_name}:{model}",
+            self.accountId,
+            message_to_parse_list,
+            send=lambda messages: self.send_prompt(prompt_name, messages, response_schema, run, model),
+            parse=self.response_items,
+            id_field=PROMPT_REGISTRY.get(prompt_name).id_field,
+        )
+
+    def send_prompt(self, prompt_name: str, message_to_parse_list: list[str], response_schema, run, model: str) -> dict:
+        """Send the messages after a registered prompt, referencing its cached content when there is one."""
+        request = PROMPT_REGISTRY.build_request(prompt_name, "\n\n".join(message_to_parse_list), model)
+        start = time.monotonic()
+
+        if ENV_SETTINGS.LLM_STRUCTURED_OUTPUT:
+            result = self.stream_structured_items(request, response_schema, run)
+            MODEL_ROUTER.record_call(model, time.monotonic() - start, len(message_to_parse_list), result.pop("usage_metadata"))
+            result["input_messages"] = message_to_parse_list
+            return result
+
+        response = self.dispatch_with_prompt(
+            request,
+            LLM_DISPATCHER.generate_content,
+            lambda request: GenerateContentConfig(cached_content=request.cached_content),
+        )
+        self.set_run_usage(run, response)
+        PROMPT_REGISTRY.record_usage(request, response.usage_metadata)
+        MODEL_ROUTER.record_call(model, time.monotonic() - start, len(message_to_parse_list), response.usage_metadata)
+        return {
+            "input_messages": message_to_parse_list,
+            "raw_model_output": response.text
+        }
 
     @traceable(
         name="generate_transactions",
         run_type="llm",
         metadata={"ls_provider": "Gemini", "ls_model_name": "gemini-2.5-flash"}
     )
-    def generate_transactions_list_from_emails(self, message_to_parse_list: list[str]) -> list:
+    def generate_transactions_list_from_emails(self, message_to_parse_list: list[str], model: str = None) -> list:
 
         run = get_current_run_tree()
-        BASE_PROMPT = """You are an expert data extraction assistant specialized in financial transaction alert messages from banks, credit cards, or UPI platforms.
-
-        **Your Goal:** Extract the specified data fields from the provided message(s) and return **ONLY** a valid JSON list. Each item in the list must be a JSON object representing one transaction.
-
-        **Strict Output Requirements:**
-        * **Absolutely no conversational text, explanations, or markdown formatting (e.g., ```json) outside the JSON list itself.**
-        * The response must begin with `[` and end with `]`.
-
-        **Extracted Fields and Constraints:**
-        * `id` (string): Unique identifier for the message. This maps to the "ID" in the message.
-        * `amount` (number): Numeric value of the transaction. Do not include currency symbols.
-        * `transaction_type` (string): **Strictly** one of: "debit" or "credit".
-        * `source_identifier` (string): Account number, card number, or UPI ID from which money was deducted or into which money was received.
-        * `destination` (string): Name, UPI ID, merchant, or platform that is the recipient or sender.
-        * `reference_number` (string): UPI or bank transaction reference number. Can be an empty string if not found.
-        * `mode` (string): **Strictly** one of: "UPI", "Credit Card", "Bank Transfer", "ATM", "POS", or "Unknown".
-        * `reason` (string): Description or reason for the transaction. Can be an empty string if not found.
-        * `date` (string): The transaction date in 'YYYY-MM-DD' format. If the year is not explicitly mentioned, assume the current year (2025). If the date is not found, return `null`.
-
-        Rules:
-        1. Exclude any emails that is for OTPs, promotional offers, or non-transactional alerts.
-
-        **Example Message and Expected Output:**
-
-        Message: "Dear Customer, Rs.65.00 has been debited from account 1531 to VPA Q285361434@ybl MADHU SUDHAN S on 04-07-25. Your UPI transaction reference number is 254342617978. Thread-ID: 1234567890abcdef"
-
-        Expected Output:
-        ```json
-        [
-        {
-            "id": "1234567890abcdef",
-            "amount": 65.00,
-            "transaction_type": "debit",
-            "source_identifier": "1531",
-            "destination": "Q285361434@ybl MADHU SUDHAN S",
-            "reference_number": "254342617978",
-            "mode": "UPI",
-            "reason": "Payment to VPA Q285361434@ybl MADHU SUDHAN S",
-            "date": "2025-07-04"
-        }
-        ]"""
-        final_prompt = BASE_PROMPT + "\n\n" + "\n\n".join(message_to_parse_list)
-        
-        # Add retry logic for timeout errors
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = VERTEXT_CLIENT.models.generate_content(
-                    model='gemini-2.5-flash', 
-                    contents=final_prompt,
-                )
-
-                if hasattr(response, "usage_metadata") and response.usage_metadata:
-                    token_usage = {
-                        "input_tokens": response.usage_metadata.prompt_token_count,
-                        "output_tokens": response.usage_metadata.candidates_token_count,
-                        "total_tokens": response.usage_metadata.total_token_count,
-                        "input_token_details": {
-                            "cache_read": response.usage_metadata.cached_content_token_count,
-                        },
-                    }
-                    run.set(usage_metadata=token_usage)
-                
-                run.metadata["user_id"] = self.userId
-                run.metadata["email"] = self.email
-                run.metadata["account_id"] = self.accountId
-                return {
-                    "input_messages": message_to_parse_list,
-                    "raw_model_output": response.text
-                }
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-                if attempt == max_retries - 1:
-                    logger.error(f"All retry attempts failed for generate_content: {str(e)}")
-                    raise
+        return self.generate_from_prompt("transactions", message_to_parse_list, list[Transaction], run, model)
+
     @traceable(
         name="generate_orders",
         run_type="llm",
@@ -355,124 +597,269 @@ class AIManager:
             message_to_parse_list.append(body)
         
         run = get_current_run_tree()
-        category_list = ',\n        '.join([cat.value for cat in TransactionCategory])
-        BASE_PROMPT = f"""
-        You are an expert data extraction assistant specialized in order confirmation emails from e-commerce platforms.
-
-
-        You will be given MULTIPLE emails.
-
-        For EACH email:
-        - `messageId` (string): Unique identifier for the message. This maps to the "ID" in the message.
-        - Extract AT MOST ONE order
-        - If the email is not a purchase receipt, then skip it
-        - Do NOT merge information across emails
-        - Do NOT infer missing data from other emails
-        - Maintain the SAME ORDER as input
-
-        Additional task:
-        - For EACH item in the items table, determine a transaction category.
-
-        Category rules:
-        - Categories must be chosen ONLY from the following fixed list:
-        {category_list}
-        - Categorization must be done ONLY at the item level.
-        - Use the item name, description, and merchant context to determine the category.
-        - Do NOT infer categories beyond the information present in the email.
-        - If the category is unclear or ambiguous, use OTHER.
-        - Do NOT invent new categories.
-
-        Strict Output Requirements:
-        - Absolutely no conversational text, explanations, or markdown formatting outside the JSON list itself.
-        - The response must begin with `[` and end with `]`.
-
-        Rules:
-        - Output ONLY valid JSON
-        - Do NOT include explanations or markdown
-        - Do NOT guess missing values (use null)
-        - Represent ALL monetary components as lineItems
-        - Discounts must have NEGATIVE totals
-        - Do not invent items or prices
-
-        OutputSchema:
-        {OrdersListIntentModel.model_json_schema()}
+        return self.generate_from_prompt("orders", message_to_parse_list, OrdersListIntentModel, run)
+
+    @traceable(
+        name="generate_combined_extraction",
+        run_type="llm",
+        metadata={"ls_provider": "Gemini", "ls_model_name": "gemini-2.5-flash"}
+    )
+    def generate_combined_extraction(self, message_to_parse_list: list[str], model: str = None) -> dict:
 
+        run = get_current_run_tree()
+        return self.generate_from_prompt("combined", message_to_parse_list, ExtractionListIntentModel, run, model)
+
+    def combined_message_content(self, email: EmailSanitized) -> str:
+        """The text the combined prompt sees for a message, without its per mailbox id so it can be a cache key."""
+        content = f"Snippet: {email.snippet}"
+        if email.body:
+            content += f"\nBody:\n{email.body}"
+        return content
+
+    def format_combined_message(self, email: EmailSanitized) -> str:
+        return f"ID {email.id}:\n{self.combined_message_content(email)}"
+
+    def validate_combined_item(self, item: dict, message_ids: list[str]) -> str | None:
+        """A result is valid when its message is in the batch and its transactions and order are."""
+        try:
+            result = MessageExtractionIntentModel(**item)
+        except Exception as e:
+            return str(e)
+        if result.messageId not in message_ids:
+            return f"unknown message id {result.messageId}"
+        if result.kind not in ("transaction", "order", "other"):
+            return f"invalid kind {result.kind}"
+        for transaction in item.get("transactions") or []:
+            error = self.validate_transaction_item({**transaction, "id": result.messageId}, message_ids)
+            if error:
+                return error
+        if item.get("order"):
+            return self.validate_order_item({**item["order"], "messageId": result.messageId}, message_ids)
+        return None
+
+    def extract_combined_from_emails(self, emails_list: list[EmailSanitized]) -> tuple[list[dict], list[dict]]:
         """
-        final_prompt = BASE_PROMPT + "\n\n" + "\n\n".join(message_to_parse_list)
-        
-        # Add retry logic for timeout errors
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                response = VERTEXT_CLIENT.models.generate_content(
-                    model='gemini-2.5-flash', 
-                    contents=final_prompt,
-                )
-
-                if hasattr(response, "usage_metadata") and response.usage_metadata:
-                    token_usage = {
-                        "input_tokens": response.usage_metadata.prompt_token_count,
-                        "output_tokens": response.usage_metadata.candidates_token_count,
-                        "total_tokens": response.usage_metadata.total_token_count,
-                        "input_token_details": {
-                            "cache_read": response.usage_metadata.cached_content_token_count,
-                        },
-                    }
-                    run.set(usage_metadata=token_usage)
-                
-                run.metadata["user_id"] = self.userId
-                run.metadata["email"] = self.email
-                run.metadata["account_id"] = self.accountId
-                return {
-                    "input_messages": message_to_parse_list,
-                    "raw_model_output": response.text
-                }
-            except Exception as e:
-                logger.warning(f"Attempt {attempt + 1}/{max_retries} failed: {str(e)}")
-                if attempt == max_retries - 1:
-                    logger.error(f"All retry attempts failed for generate_content: {str(e)}")
-                    raise
+        Extract transactions and orders with a single llm call per batch.
+        Each message is classified and its result routed to the transactions or orders list.
+        """
+        message_dict_list = {msg.id: msg for msg in emails_list}
 
+        template_transactions = []
+        llm_emails_list = emails_list
+        if ENV_SETTINGS.TEMPLATE_PARSERS_ENABLED:
+            template_transactions, llm_emails_list = DEFAULT_REGISTRY.split(emails_list)
+            logger.info(
+                f"Template parsers matched {len(template_transactions)}/{len(emails_list)} emails",
+                extra={"template_stats": DEFAULT_REGISTRY.stats()},
+            )
+
+        batch = CachedBatch(
+            EXTRACTION_CACHE,
+            [(msg.id, self.combined_message_content(msg)) for msg in llm_emails_list if msg.snippet or msg.body],
+            PROMPT_REGISTRY.get("combined").version,
+            id_field="messageId",
+        )
 
-    def extract_json_from_response(self, response: str) -> dict | None:
-        """Extract JSON content from LLM response, handling code blocks."""
+        llm_results = None
+        failed_ids = {}
+        if batch.miss_ids:
+            llm_results, failed_ids = self.extract_with_model_tiers(
+                batch.miss_ids,
+                message_dict_list,
+                lambda message_ids, model: self.generate_combined_extraction(
+                    [self.format_combined_message(message_dict_list[id]) for id in message_ids], model
+                ),
+                self.validate_combined_item,
+                id_field="messageId",
+            )
+        results = batch.resolve(llm_results, uncached_ids=failed_ids)
+        self.mark_emails_as_failed(failed_ids)
+        if EXTRACTION_CACHE:
+            logger.info(f"Combined extraction cache: {batch.hit_count} hits, {len(batch.miss_ids)} sent to llm", extra={"cache_stats": EXTRACTION_CACHE.stats()})
+
+        transactions_json_list, orders_list = self.route_combined_results(results)
+        transactions_json_list = [txn.model_dump(exclude_none=True) for txn in template_transactions] + transactions_json_list
+
+        return self.build_transactions(transactions_json_list, message_dict_list), orders_list
+
+    def route_combined_results(self, results: list[dict]) -> tuple[list[dict], list[dict]]:
+        """Split per message combined results into transaction and order items keyed by their message id."""
+        transactions_json_list = []
+        orders_list = []
+        for result in results:
+            message_id = result["messageId"]
+            for transaction in result.get("transactions") or []:
+                transactions_json_list.append({**transaction, "id": message_id})
+            if result.get("order"):
+                orders_list.append({**result["order"], "messageId": message_id})
+        return transactions_json_list, orders_list
+
+    def extract_orders_from_emails(self, sanitized_emails: list[EmailSanitized]) -> list[dict]:
+        """Extract orders through the llm for emails whose body is not in the extraction cache."""
+        emails_by_id = {email.id: email for email in sanitized_emails}
+        batch = CachedBatch(
+            EXTRACTION_CACHE,
+            [(email.id, email.body) for email in sanitized_emails if email.body],
+            PROMPT_REGISTRY.get("orders").version,
+            id_field="messageId",
+        )
+
+        llm_orders_list = None
+        failed_ids = {}
+        if batch.miss_ids:
+            llm_orders_list, failed_ids = self.extract_items_with_retries(
+                batch.miss_ids,
+                lambda message_ids: self.extract_order_from_emails([emails_by_id[id] for id in message_ids]),
+                self.validate_order_item,
+                id_field="messageId",
+            )
+        orders_list = batch.resolve(llm_orders_list, uncached_ids=failed_ids)
+        self.mark_emails_as_failed(failed_ids)
+        if EXTRACTION_CACHE:
+            logger.info(f"Orders cache: {batch.hit_count} hits, {len(batch.miss_ids)} sent to llm", extra={"cache_stats": EXTRACTION_CACHE.stats()})
+        return orders_list
+
+    def validate_transaction_item(self, item: dict, message_ids: list[str]) -> str | None:
+        """Return why an extracted transaction is unusable, or None when it is valid."""
         try:
-            cleaned = re.sub(r"^```[a-zA-Z]*\n|\n```$", "", response)
-            return json.loads(cleaned)
+            txn = Transaction(**item)
         except Exception as e:
-            # logger.error("Failed to extract JSON from LLM response: %s", e)
-            print(f"Failed to extract JSON from LLM response: {e}")
-            return None
-    
+            return str(e)
+        if txn.id not in message_ids:
+            return f"unknown message id {txn.id}"
+        if txn.amount is None:
+            return "missing amount"
+        if txn.transaction_type not in ("debit", "credit"):
+            return f"invalid transaction_type {txn.transaction_type}"
+        return None
+
+    def validate_order_item(self, item: dict, message_ids: list[str]) -> str | None:
+        try:
+            order = OrdersIntentModel(**item)
+        except Exception as e:
+            return str(e)
+        if order.messageId not in message_ids:
+            return f"unknown message id {order.messageId}"
+        return None
+
+    def extract_with_model_tiers(
+        self,
+        message_ids: list[str],
+        emails_by_id: dict[str, EmailSanitized],
+        generate,
+        validate,
+        id_field: str = "id",
+    ) -> tuple[list[dict], dict[str, str]]:
+        """
+        Route each message to a model tier by complexity. The light tier runs first without retries,
+        and messages that fail validation there, or come back empty although they read like a transaction alert,
+        are escalated to the standard model together with the messages routed to it.
+        `generate` takes the message ids and the model to use.
+        """
+        light_ids, standard_ids = MODEL_ROUTER.split(message_ids, emails_by_id)
+        valid_items = []
+        if light_ids:
+            light_model = MODEL_ROUTER.model_for(LIGHT_TIER)
+            light_items, failed_ids = self.extract_items_with_retries(
+                light_ids,
+                lambda ids: generate(ids, light_model),
+                validate,
+                id_field=id_field,
+                max_retries=0,
+            )
+            escalated_ids = set(failed_ids) | MODEL_ROUTER.low_confidence_ids(light_ids, light_items, emails_by_id, id_field)
+            valid_items = [item for item in light_items if item.get(id_field) not in escalated_ids]
+            standard_ids += [id for id in light_ids if id in escalated_ids]
+            if escalated_ids:
+                MODEL_ROUTER.record_escalations(len(escalated_ids))
+                logger.info(f"Escalating {len(escalated_ids)}/{len(light_ids)} messages from {light_model} to the standard model")
+
+        failed_ids = {}
+        if standard_ids:
+            standard_model = MODEL_ROUTER.model_for(STANDARD_TIER)
+            standard_items, failed_ids = self.extract_items_with_retries(
+                standard_ids,
+                lambda ids: generate(ids, standard_model),
+                validate,
+                id_field=id_field,
+            )
+            valid_items += standard_items
+        return valid_items, failed_ids
+
+    def extract_items_with_retries(self, message_ids: list[str], generate, validate, id_field: str = "id", max_retries: int = None) -> tuple[list[dict], dict[str, str]]:
+        """Validated extraction with per message retries, LLM_ITEM_MAX_RETRIES by default. See item_extraction."""
+        if max_retries is None:
+            max_retries = ENV_SETTINGS.LLM_ITEM_MAX_RETRIES
+        return extract_items_with_retries(message_ids, generate, validate, id_field=id_field, max_retries=max_retries)
+
+    def response_items(self, response: dict) -> tuple[list, bool]:
+        return response_items(response)
+
     def mark_email_as_gemini_parsed(self, email_id: str):
-        pass
+        """A successful extraction supersedes an earlier failure of the same email."""
+        with self.status_lock:
+            self.extraction_errors.pop(email_id, None)
+
+    def mark_emails_as_failed(self, errors: dict[str, str]):
+        if not errors:
+            return
+        with self.status_lock:
+            self.extraction_errors.update(errors)
+        logger.warning(f"Extraction failed for {len(errors)} emails, sending them to the dead letter store")
 
     def extract_transactions_from_emails(self, emails_list: list[EmailSanitized]) -> list[dict]:
 
         message_dict_list = {msg.id: msg for msg in emails_list}
-        message_to_parse_list = []
 
-        # Prepare messages for parsing
-        for msg in emails_list:
-            id = msg.id
-            snippet = msg.snippet
+        # Alerts with known wording are parsed by templates, only the rest needs the llm
+        template_transactions = []
+        llm_emails_list = emails_list
+        if ENV_SETTINGS.TEMPLATE_PARSERS_ENABLED:
+            template_transactions, llm_emails_list = DEFAULT_REGISTRY.split(emails_list)
+            logger.info(
+                f"Template parsers matched {len(template_transactions)}/{len(emails_list)} emails",
+                extra={"template_stats": DEFAULT_REGISTRY.stats()},
+            )
+
+        batch = CachedBatch(
+            EXTRACTION_CACHE,
+            [(msg.id, msg.snippet) for msg in llm_emails_list if msg.snippet],
+            PROMPT_REGISTRY.get("transactions").version,
+        )
 
-            if not snippet:
-                continue
-            logger.info(f"Preparing email ID {id} for parsing. Snippet: {snippet}")
-            snippet = f"ID {id}:\n{snippet}"
-            message_to_parse_list.append(snippet)
+        # Prepare messages for parsing, only cache misses go to the llm
+        for id in batch.miss_ids:
+            logger.info(f"Preparing email ID {id} for parsing. Snippet: {message_dict_list[id].snippet}")
             # mark_email_as_gemini_parsed(msg.thread_id)
 
-        model_response = self.generate_transactions_list_from_emails(message_to_parse_list).get("raw_model_output", "")
-        transactions_json_list = self.extract_json_from_response(model_response)
+        llm_transactions_list = None
+        failed_ids = {}
+        if batch.miss_ids:
+            llm_transactions_list, failed_ids = self.extract_with_model_tiers(
+                batch.miss_ids,
+                message_dict_list,
+                lambda message_ids, model: self.generate_transactions_list_from_emails(
+                    [f"ID {id}:\n{message_dict_list[id].snippet}" for id in message_ids], model
+                ),
+                self.validate_transaction_item,
+            )
+        transactions_json_list = [txn.model_dump(exclude_none=True) for txn in template_transactions]
+        transactions_json_list += batch.resolve(llm_transactions_list, uncached_ids=failed_ids)
+        self.mark_emails_as_failed(failed_ids)
+        if EXTRACTION_CACHE:
+            logger.info(f"Transactions cache: {batch.hit_count} hits, {len(batch.miss_ids)} sent to llm", extra={"cache_stats": EXTRACTION_CACHE.stats()})
 
         if not transactions_json_list:
-            print("No valid transactions found.")
+            logger.info("No valid transactions found.")
             for msg in emails_list:
-                self.mark_email_as_gemini_parsed(msg.id)
-            return
+                if msg.id not in failed_ids:
+                    self.mark_email_as_gemini_parsed(msg.id)
+            return []
 
+        return self.build_transactions(transactions_json_list, message_dict_list)
+
+    def build_transactions(self, transactions_json_list: list[dict], message_dict_list: dict[str, EmailSanitized]) -> list[dict]:
+        """Attach sender and received time of the source email to each extracted transaction."""
         transactions_list = []
         for transaction in transactions_json_list:
             try:
@@ -487,11 +874,10 @@ class AIManager:
                 txn.date_time = email_details.receivedAt.isoformat() if email_details else None
 
                 transactions_list.append(json.loads(txn.model_dump_json(exclude_none=True)))
+                self.mark_email_as_gemini_parsed(txn.id)
             except Exception as e:
                 logger.exception(e)
-            finally:
-                # Mark the email as a transaction
-                self.mark_email_as_gemini_parsed(transaction.get('id'))
+                self.mark_emails_as_failed({transaction.get('id'): str(e)})
         
         return transactions_list
 
@@ -500,15 +886,18 @@ class AIManager:
         Send the list of transactions to mb-backend api to insert into db
         Send in batch of 50
         '''
-        response = requests.post(
-            ENV_SETTINGS.MB_BACKEND_API_URL + 'api/v1/transactions/bulk-insert',
-            headers={'Content-Type': 'application/json'},
+        if DB_PERSISTENCE:
+            return persistence_status(DB_PERSISTENCE.save(self.userId, self.accountId, transactions_list=transactions_list))
+
+        response = BACKEND_CLIENT.post(
+            'api/v1/transactions/bulk-insert',
             json={
                 'transactions': transactions_list,
                 'userId': self.userId,
                 'emailId': self.email,
                 'accountId': self.accountId,
-            }
+            },
+            binary=True,
         )
         if response.status_code != 200:
             logger.error(f"Failed to insert batch starting at index : {response.text}")
@@ -517,19 +906,101 @@ class AIManager:
         
         return response.status_code
 
+    def saveExtractionStatus(self, email_ids: list[str]):
+        '''
+        Send the extraction outcome of the emails to mb-backend api
+        Emails with a recorded error are stored as failed for replay, the rest as parsed
+        '''
+        with self.status_lock:
+            failed = [{'id': id, 'error': self.extraction_errors.pop(id)} for id in email_ids if id in self.extraction_errors]
+        failed_ids = {item['id'] for item in failed}
+        parsed = [id for id in email_ids if id not in failed_ids]
+        if DB_PERSISTENCE:
+            status = persistence_status(DB_PERSISTENCE.save(self.userId, self.accountId, parsed=parsed, failed=failed))
+            if status != 200:
+                self.restore_extraction_errors(failed)
+            return status
+
+        response = BACKEND_CLIENT.post(
+            'api/v1/emails/extraction-status',
+            json={
+                'accountId': self.accountId,
+                'parsed': parsed,
+                'failed': failed,
+            }
+        )
+        if response.status_code != 200:
+            logger.error(f"Failed to update extraction status: {response.text}")
+            self.restore_extraction_errors(failed)
+        else:
+            logger.info(f"Updated extraction status, {len(failed)}/{len(email_ids)} emails failed")
+
+        return response.status_code
+
+    def saveBatch(self, emails: list[EmailSanitized], transactions_list: list[dict], orders_list: list[dict]):
+        '''
+        Send the emails, transactions, orders and extraction status of a page to mb-backend in one call
+        The backend stores all of it in a single transaction. A failed call (after the client's retries) stores nothing
+        and raises PersistError, so the page never counts as synced and its emails are synced again
+        '''
+        email_ids = [email.id for email in emails]
+        with self.status_lock:
+            failed = [{'id': id, 'error': self.extraction_errors.pop(id)} for id in email_ids if id in self.extraction_errors]
+        failed_ids = {item['id'] for item in failed}
+        parsed = [id for id in email_ids if id not in failed_ids]
+        if DB_PERSISTENCE:
+            status = persistence_status(DB_PERSISTENCE.save(
+                self.userId, self.accountId, emails, transactions_list, orders_list, parsed=parsed, failed=failed
+            ))
+            if status != 200:
+                self.restore_extraction_errors(failed)
+                raise PersistError(f"Failed to store batch of {len(emails)} emails in the database")
+            return status
+
+        response = BACKEND_CLIENT.post(
+            'api/v1/ingest/batch',
+            json={
+                'userId': self.userId,
+                'accountId': self.accountId,
+                'emailId': self.email,
+                'emails': [email.model_dump(mode='json') for email in emails],
+                'transactions': transactions_list,
+                'orders': orders_list,
+                'parsed': parsed,
+                'failed': failed,
+            },
+            binary=True,
+        )
+        if response.status_code != 200:
+            logger.error(f"Failed to ingest batch of {len(emails)} emails: {response.text}")
+            self.restore_extraction_errors(failed)
+            raise PersistError(f"Failed to ingest batch of {len(emails)} emails, status {response.status_code}")
+        logger.info(f"Ingested batch of {len(emails)} emails", extra={"ingest_counts": response.json()})
+
+        return response.status_code
+
+    def restore_extraction_errors(self, failed: list[dict]):
+        """Put back the errors of a page that was not stored, its dead letter state is sent with the next attempt."""
+        with self.status_lock:
+            for item in failed:
+                self.extraction_errors.setdefault(item['id'], item['error'])
+
     def saveOrders(self, orders_list: list[dict]):
         '''
         Send the list of orders to mb-backend api to insert into db
         Send in batch of 50
         '''
-        response = requests.post(
-            ENV_SETTINGS.MB_BACKEND_API_URL + f'api/v1/users/{self.userId}/orders/bulk-insert',
-            headers={'Content-Type': 'application/json'},
+        if DB_PERSISTENCE:
+            return persistence_status(DB_PERSISTENCE.save(self.userId, self.accountId, orders_list=orders_list))
+
+        response = BACKEND_CLIENT.post(
+            f'api/v1/users/{self.userId}/orders/bulk-insert',
             json={
                 'orders': orders_list,
                 'userId': self.userId,
                 'accountId': self.accountId,
-            }
+            },
+            binary=True,
         )
         if response.status_code != 200:
             logger.error(f"Failed to insert orders batch starting at index : {response.text}")
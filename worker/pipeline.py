@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+from typing import Callable, Iterable, Optional
+
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Marks the end of the stream on a stage queue
+END_OF_STREAM = object()
+# How often blocked producers and consumers re-check for cancellation
+POLL_INTERVAL_SECONDS = 0.1
+
+
+class Stage:
+    '''
+    One step of a pipeline.
+    The handler takes one item and returns a list of items for the next stage (or None to drop it).
+    Items wait in a bounded queue in front of the stage, so a slow stage blocks its producers
+    instead of buffering the whole mailbox in memory.
+    The optional flush is called once after the last item and may return trailing items.
+    '''
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[object], Optional[list]],
+        concurrency: int = 1,
+        queue_size: int = 2,
+        flush: Callable[[], Optional[list]] = None,
+    ):
+        self.name = name
+        self.handler = handler
+        self.concurrency = max(1, concurrency)
+        self.queue_size = max(1, queue_size)
+        self.flush = flush
+        self.processed = 0
+        self.busy_seconds = 0.0
+
+
+class PipelineCancelled(Exception):
+    pass
+
+
+class Pipeline:
+    '''
+    Runs items from a source through a chain of stages, each on its own worker threads.
+    Stages overlap, so total time approaches the time of the slowest stage instead of the sum.
+    The first exception raised by the source or any stage cancels the pipeline and is re-raised by run().
+    '''
+    def __init__(self, source: Iterable, stages: list[Stage], name: str = "pipeline"):
+        self.source = source
+        self.stages = stages
+        self.name = name
+        self.queues = [queue.Queue(maxsize=stage.queue_size) for stage in stages]
+        self.cancelled = threading.Event()
+        self.error: Exception | None = None
+        self.lock = threading.Lock()
+
+    def fail(self, error: Exception):
+        with self.lock:
+            if self.error is None:
+                self.error = error
+        self.cancelled.set()
+
+    def put(self, index: int, item):
+        """Put an item on a stage queue, blocking while it is full unless the pipeline is cancelled."""
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                self.queues[index].put(item, timeout=POLL_INTERVAL_SECONDS)
+                return
+            except queue.Full:
+                continue
+
+    def get(self, index: int):
+        while True:
+            if self.cancelled.is_set():
+                raise PipelineCancelled()
+            try:
+                return self.queues[index].get(timeout=POLL_INTERVAL_SECONDS)
+            except queue.Empty:
+                continue
+
+    def emit(self, index: int, outputs: Optional[list]):
+        """Forward handler outputs to the stage after `index`."""
+        if not outputs or index + 1 >= len(self.stages):
+            return
+        for output in outputs:
+            self.put(index + 1, output)
+
+    def run_worker(self, index: int, remaining: list[int]):
+        stage = self.stages[index]
+        try:
+            while True:
+                item = self.get(index)
+                if item is END_OF_STREAM:
+                    break
+                started = time.perf_counter()
+                outputs = stage.handler(item)
+                with self.lock:
+                    stage.processed += 1
+                    stage.busy_seconds += time.perf_counter() - started
+                self.emit(index, outputs)
+
+            with self.lock:
+                remaining[index] -= 1
+                is_last_worker = remaining[index] == 0
+            if not is_last_worker:
+                return
+
+            # The last worker of a stage flushes it and closes the next stage
+            if stage.flush:
+                self.emit(index, stage.flush())
+            if index + 1 < len(self.stages):
+                for _ in range(self.stages[index + 1].concurrency):
+                    self.put(index + 1, END_OF_STREAM)
+        except PipelineCancelled:
+            return
+        except Exception as e:
+            logger.exception(f"{self.name} stage '{stage.name}' failed: {e}")
+            self.fail(e)
+
+    def run(self) -> dict:
+        """Run the pipeline to completion and return per-stage statistics."""
+        remaining = [stage.concurrency for stage in self.stages]
+        threads = []
+        for index, stage in enumerate(self.stages):
+            for worker_number in range(stage.concurrency):
+                thread = threading.Thread(
+                    target=self.run_worker,
+                    args=(index, remaining),
+                    name=f"{self.name}-{stage.name}-{worker_number}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        started = time.perf_counter()
+        try:
+            for item in self.source:
+                self.put(0, item)
+            for _ in range(self.stages[0].concurrency):
+                self.put(0, END_OF_STREAM)
+        except PipelineCancelled:
+            pass
+        except Exception as e:
+            logger.exception(f"{self.name} source failed: {e}")
+            self.fail(e)
+
+        for thread in threads:
+            thread.join()
+
+        if self.error is not None:
+            raise self.error
+
+        stats = {
+            "total_seconds": round(time.perf_counter() - started, 3),
+            "stages": {},
+        }
+        for stage in self.stages:
+            stats["stages"][stage.name] = {
+                "processed": stage.processed,
+                "busy_seconds": round(stage.busy_seconds, 3),
+                "concurrency": stage.concurrency,
+            }
+        return stats
@@ -0,0 +1,332 @@
+import hashlib
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from google.genai.types import CreateCachedContentConfig
+from packages.enums import TransactionCategory
+from packages.models import ExtractionListIntentModel, OrdersListIntentModel
+from worker.batch_packer import CHARS_PER_TOKEN
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+# Vertex rejects cached content below this size, smaller prompts are always sent inline
+MIN_CACHED_TOKENS = 1024
+# Caches are recreated this long before they expire so a call never references a dead handle
+CACHE_REFRESH_MARGIN_SECONDS = 300
+
+
+class Prompt:
+    '''
+    A fixed instruction prefix sent ahead of the message payload.
+    `id_field` is the field of each output item that carries the message id.
+    The version is derived from the text, so any change to the wording, the category list or
+    the output schema gets a new context cache and new extraction cache keys on its own.
+    '''
+    def __init__(self, name: str, text: str, id_field: str = "id"):
+        self.name = name
+        self.text = text
+        self.id_field = id_field
+        self.version = f"{name}-{hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]}"
+        self.tokens = len(text) // CHARS_PER_TOKEN
+
+
+class LocalContextCache:
+    '''
+    In-process stand-in for `client.caches` when Vertex context caching is not used (local runs and tests).
+    It accepts the same create and delete calls and keeps the prefix in memory. Requests still
+    carry the full prompt, and `PromptRegistry` reports the prefix tokens as cache reads so the
+    hit accounting can be checked without a Vertex project.
+    '''
+    inline = True
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.contents: dict[str, str] = {}
+        self.created = 0
+
+    def create(self, model: str, config: CreateCachedContentConfig):
+        with self.lock:
+            self.created += 1
+            name = f"local/cachedContents/{self.created}"
+            self.contents[name] = config.system_instruction
+        ttl_seconds = int(str(config.ttl).rstrip("s"))
+        return CachedContentHandle(name, model, datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds))
+
+    def delete(self, name: str):
+        with self.lock:
+            self.contents.pop(name, None)
+
+
+class CachedContentHandle:
+    '''The fields of a Vertex `CachedContent` the registry reads, returned by the local stand-in.'''
+    def __init__(self, name: str, model: str, expire_time: datetime):
+        self.name = name
+        self.model = model
+        self.expire_time = expire_time
+
+
+class PromptRequest:
+    '''The contents of one llm call and the cached content it references, if any.'''
+    def __init__(self, name: str, model: str, payload: str, contents: str, cached_content: str | None, uses_cache: bool):
+        self.name = name
+        self.model = model
+        self.payload = payload
+        self.contents = contents
+        self.cached_content = cached_content
+        self.uses_cache = uses_cache
+
+
+class PromptRegistry:
+    '''
+    This class is supposed to do the following actions:
+    1. Build and version the extraction prompts once, when the worker starts
+    2. Register prompts large enough to qualify as cached content, per model, and refresh them before they expire
+    3. Build requests that reference the cache handle and carry only the message payload
+    4. Track prompt and cached token counts from usage metadata to confirm the cache is hit
+    Without a cache backend, or when creating the cache fails, prompts are sent inline as before.
+    '''
+    def __init__(self, caches=None, model: str = "gemini-2.5-flash", ttl_seconds: int = 3600, min_cached_tokens: int = MIN_CACHED_TOKENS):
+        self.caches = caches
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.min_cached_tokens = min_cached_tokens
+        self.prompts: dict[str, Prompt] = {}
+        self.lock = threading.Lock()
+        # (prompt name, model) -> (cache name, unix time after which it is recreated)
+        self.handles: dict[tuple[str, str], tuple[str, float]] = {}
+        self.calls: Counter = Counter()
+        self.cached_calls: Counter = Counter()
+        self.prompt_tokens: Counter = Counter()
+        self.cached_tokens: Counter = Counter()
+        self.cache_errors = 0
+
+    def register(self, prompt: Prompt):
+        self.prompts[prompt.name] = prompt
+
+    def get(self, name: str) -> Prompt:
+        return self.prompts[name]
+
+    def is_cacheable(self, prompt: Prompt) -> bool:
+        return self.caches is not None and prompt.tokens >= self.min_cached_tokens
+
+    def warm(self, models: list[str] = None):
+        """Create the cached contents for every cacheable prompt and model, called once at startup."""
+        for model in models or [self.model]:
+            for name in self.prompts:
+                self.cached_content_name(name, model)
+
+    def cached_content_name(self, name: str, model: str = None) -> str | None:
+        """Return the cache handle for a prompt, creating or refreshing it when needed."""
+        prompt = self.get(name)
+        if not self.is_cacheable(prompt):
+            return None
+        model = model or self.model
+        key = (name, model)
+        with self.lock:
+            handle = self.handles.get(key)
+            if handle and handle[1] > time.time():
+                return handle[0]
+            try:
+                cached_content = self.caches.create(
+                    model=model,
+                    config=CreateCachedContentConfig(
+                        system_instruction=prompt.text,
+                        display_name=prompt.version,
+                        ttl=f"{self.ttl_seconds}s",
+                    ),
+                )
+            except Exception as e:
+                self.cache_errors += 1
+                logger.warning(f"Could not create cached content for {prompt.version} on {model}, sending it inline: {str(e)}")
+                return None
+            refresh_at = time.time() + self.ttl_seconds - CACHE_REFRESH_MARGIN_SECONDS
+            if cached_content.expire_time:
+                refresh_at = min(refresh_at, cached_content.expire_time.timestamp() - CACHE_REFRESH_MARGIN_SECONDS)
+            self.handles[key] = (cached_content.name, refresh_at)
+            return cached_content.name
+
+    def invalidate(self, name: str, model: str = None):
+        """Forget a handle the backend no longer knows (deleted or expired early), the next call recreates it."""
+        with self.lock:
+            self.handles.pop((name, model or self.model), None)
+
+    def build_request(self, name: str, payload: str, model: str = None) -> PromptRequest:
+        """Return what to send for a prompt and payload: only the payload when the prompt is cached."""
+        prompt = self.get(name)
+        model = model or self.model
+        cached_content = self.cached_content_name(name, model)
+        if cached_content is None:
+            return PromptRequest(name, model, payload, prompt.text + "\n\n" + payload, None, False)
+        if getattr(self.caches, "inline", False):
+            return PromptRequest(name, model, payload, prompt.text + "\n\n" + payload, None, True)
+        return PromptRequest(name, model, payload, payload, cached_content, True)
+
+    def record_usage(self, request: PromptRequest, usage_metadata):
+        """Count the prompt and cached tokens of a response to confirm cached requests hit the cache."""
+        prompt = self.get(request.name)
+        prompt_tokens = getattr(usage_metadata, "prompt_token_count", None) or 0
+        cached_tokens = getattr(usage_metadata, "cached_content_token_count", None) or 0
+        if request.uses_cache and getattr(self.caches, "inline", False):
+            cached_tokens = max(cached_tokens, prompt.tokens)
+        if request.uses_cache and not cached_tokens:
+            logger.warning(f"Request for {prompt.version} referenced {request.cached_content} but read no cached tokens")
+        with self.lock:
+            self.calls[request.name] += 1
+            self.prompt_tokens[request.name] += prompt_tokens
+            self.cached_tokens[request.name] += cached_tokens
+            if cached_tokens:
+                self.cached_calls[request.name] += 1
+
+    def stats(self) -> dict:
+        with self.lock:
+            cached_names = {name for name, _ in self.handles}
+            return {
+                "cache_errors": self.cache_errors,
+                "prompts": {
+                    name: {
+                        "version": prompt.version,
+                        "cached": name in cached_names,
+                        "calls": self.calls[name],
+                        "cache_hits": self.cached_calls[name],
+                        "prompt_tokens": self.prompt_tokens[name],
+                        "cached_tokens": self.cached_tokens[name],
+                    }
+                    for name, prompt in self.prompts.items()
+                },
+            }
+
+
+def category_list() -> str:
+    return ",\n".join(cat.value for cat in TransactionCategory)
+
+
+TRANSACTIONS_PROMPT = """You are an expert data extraction assistant specialized in financial transaction alert messages from banks, credit cards, or UPI platforms.
+
+**Your Goal:** Extract the specified data fields from the provided message(s) and return **ONLY** a valid JSON list. Each item in the list must be a JSON object representing one transaction.
+
+**Strict Output Requirements:**
+* **Absolutely no conversational text, explanations, or markdown formatting (e.g., ```json) outside the JSON list itself.**
+* The response must begin with `[` and end with `]`.
+
+**Extracted Fields and Constraints:**
+* `id` (string): Unique identifier for the message. This maps to the "ID" in the message.
+* `amount` (number): Numeric value of the transaction. Do not include currency symbols.
+* `transaction_type` (string): **Strictly** one of: "debit" or "credit".
+* `source_identifier` (string): Account number, card number, or UPI ID from which money was deducted or into which money was received.
+* `destination` (string): Name, UPI ID, merchant, or platform that is the recipient or sender.
+* `reference_number` (string): UPI or bank transaction reference number. Can be an empty string if not found.
+* `mode` (string): **Strictly** one of: "UPI", "Credit Card", "Bank Transfer", "ATM", "POS", or "Unknown".
+* `reason` (string): Description or reason for the transaction. Can be an empty string if not found.
+* `date` (string): The transaction date in 'YYYY-MM-DD' format. If the year is not explicitly mentioned, assume the current year (2025). If the date is not found, return `null`.
+
+Rules:
+1. Exclude any emails that is for OTPs, promotional offers, or non-transactional alerts.
+
+**Example Message and Expected Output:**
+
+Message: "Dear Customer, Rs.65.00 has been debited from account 1531 to VPA Q285361434@ybl MADHU SUDHAN S on 04-07-25. Your UPI transaction reference number is 254342617978. Thread-ID: 1234567890abcdef"
+
+Expected Output:
+```json
+[
+{
+    "id": "1234567890abcdef",
+    "amount": 65.00,
+    "transaction_type": "debit",
+    "source_identifier": "1531",
+    "destination": "Q285361434@ybl MADHU SUDHAN S",
+    "reference_number": "254342617978",
+    "mode": "UPI",
+    "reason": "Payment to VPA Q285361434@ybl MADHU SUDHAN S",
+    "date": "2025-07-04"
+}
+]"""
+
+
+def build_orders_prompt() -> str:
+    return f"""You are an expert data extraction assistant specialized in order confirmation emails from e-commerce platforms.
+
+You will be given MULTIPLE emails.
+
+For EACH email:
+- `messageId` (string): Unique identifier for the message. This maps to the "ID" in the message.
+- Extract AT MOST ONE order
+- If the email is not a purchase receipt, then skip it
+- Do NOT merge information across emails
+- Do NOT infer missing data from other emails
+- Maintain the SAME ORDER as input
+
+Additional task:
+- For EACH item in the items table, determine a transaction category.
+
+Category rules:
+- Categories must be chosen ONLY from the following fixed list:
+{category_list()}
+- Categorization must be done ONLY at the item level.
+- Use the item name, description, and merchant context to determine the category.
+- Do NOT infer categories beyond the information present in the email.
+- If the category is unclear or ambiguous, use OTHER.
+- Do NOT invent new categories.
+
+Strict Output Requirements:
+- Absolutely no conversational text, explanations, or markdown formatting outside the JSON list itself.
+- The response must begin with `[` and end with `]`.
+
+Rules:
+- Output ONLY valid JSON
+- Do NOT include explanations or markdown
+- Do NOT guess missing values (use null)
+- Represent ALL monetary components as lineItems
+- Discounts must have NEGATIVE totals
+- Do not invent items or prices
+
+OutputSchema:
+{OrdersListIntentModel.model_json_schema()}"""
+
+
+def build_combined_prompt() -> str:
+    return f"""You are an expert data extraction assistant for personal finance emails: transaction alerts from banks,
+credit cards or UPI platforms, and order confirmation emails from e-commerce platforms.
+
+You will be given MULTIPLE emails. Each one has an ID, a snippet and, for likely receipts, the body.
+
+For EACH email return exactly one result, in the SAME ORDER as input:
+- `messageId` (string): This maps to the "ID" in the message.
+- `kind` (string): **Strictly** one of:
+    * "transaction": a bank, card or UPI alert about money debited or credited
+    * "order": a purchase receipt or order confirmation
+    * "other": anything else, including OTPs, promotional offers and non-transactional alerts
+- `transactions`: only when kind is "transaction", otherwise an empty list.
+- `order`: only when kind is "order", otherwise null.
+
+Transaction fields:
+* `id` (string): The message ID.
+* `amount` (number): Numeric value of the transaction. Do not include currency symbols.
+* `transaction_type` (string): **Strictly** one of: "debit" or "credit".
+* `source_identifier` (string): Account number, card number, or UPI ID from which money was deducted or into which money was received.
+* `destination` (string): Name, UPI ID, merchant, or platform that is the recipient or sender.
+* `reference_number` (string): UPI or bank transaction reference number. Can be an empty string if not found.
+* `mode` (string): **Strictly** one of: "UPI", "Credit Card", "Bank Transfer", "ATM", "POS", or "Unknown".
+
+Order rules:
+- `messageId` is the message ID. Extract AT MOST ONE order per email.
+- Do NOT merge information across emails and do NOT infer missing data from other emails.
+- Represent ALL monetary components as items. Discounts must have NEGATIVE totals.
+- Do NOT guess missing values (use null). Do not invent items or prices.
+- For EACH item determine a category ONLY from the following fixed list:
+{category_list()}
+- If the category is unclear or ambiguous, use OTHER. Do NOT invent new categories.
+
+Output ONLY valid JSON matching this schema, no explanations or markdown:
+{ExtractionListIntentModel.model_json_schema()}"""
+
+
+def build_registry(caches=None, model: str = "gemini-2.5-flash", ttl_seconds: int = 3600) -> PromptRegistry:
+    registry = PromptRegistry(caches, model=model, ttl_seconds=ttl_seconds)
+    registry.register(Prompt("transactions", TRANSACTIONS_PROMPT))
+    registry.register(Prompt("orders", build_orders_prompt(), id_field="messageId"))
+    registry.register(Prompt("combined", build_combined_prompt(), id_field="messageId"))
+    return registry
@@ -0,0 +1,59 @@
+import re
+
+# Senders whose mails are usually order confirmations or invoices
+ORDER_SENDER_DOMAINS = (
+    "amazon.in", "amazon.com", "flipkart.com", "swiggy.in", "zomato.com", "zeptonow.com",
+    "blinkit.com", "bigbasket.com", "myntra.com", "ajio.com", "nykaa.com", "meesho.com",
+    "jiomart.com", "dunzo.in", "uber.com", "olacabs.com", "rapido.bike", "bookmyshow.com",
+    "makemytrip.com", "goibibo.com", "irctc.co.in", "tatacliq.com", "croma.com", "dominos.co.in",
+)
+
+ORDER_KEYWORDS_PATTERN = re.compile(
+    r"\b(order(?:ed)?|receipt|invoice|purchase|booking|booked|bill|shipped|delivered|"
+    r"your trip|payment (?:successful|received|confirmation)|tax invoice)\b",
+    re.IGNORECASE,
+)
+
+AMOUNT_PATTERN = re.compile(r"(₹|\brs\.?\s?\d|\binr\s?\d)", re.IGNORECASE)
+
+NOT_ORDER_PATTERN = re.compile(
+    r"\b(otp|one time password|verification code|newsletter|webinar|sale ends|% off|cashback offer)\b",
+    re.IGNORECASE,
+)
+
+
+def sender_domain(sender_email: str | None) -> str:
+    if not sender_email or "@" not in sender_email:
+        return ""
+    return sender_email.rsplit("@", 1)[1].lower()
+
+
+def is_order_sender(sender_email: str | None) -> bool:
+    domain = sender_domain(sender_email)
+    if not domain:
+        return False
+    for order_domain in ORDER_SENDER_DOMAINS:
+        if domain == order_domain or domain.endswith("." + order_domain):
+            return True
+    return False
+
+
+def is_likely_order_receipt(sender_email: str | None, subject: str | None, snippet: str | None) -> bool:
+    """
+    Cheap header and snippet heuristic deciding whether a mail is worth downloading in full
+    for order extraction. It favours recall, a false positive only costs one extra body download.
+    """
+    subject = subject or ""
+    snippet = snippet or ""
+    text = f"{subject}\n{snippet}"
+
+    if NOT_ORDER_PATTERN.search(subject):
+        return False
+
+    if is_order_sender(sender_email):
+        return True
+
+    if ORDER_KEYWORDS_PATTERN.search(text) and AMOUNT_PATTERN.search(text):
+        return True
+
+    return bool(ORDER_KEYWORDS_PATTERN.search(subject))
@@ -0,0 +1,83 @@
+import random
+import re
+
+# Gmail starts rejecting very long search strings, keep the compiled clause well below that
+MAX_QUERY_LENGTH = 1500
+# Words that still let mail from senders outside the allowlist through, so new banks and shops are discovered
+DISCOVERY_TERMS = [
+    "debited", "credited", "upi", "transaction", "receipt", "invoice", '"order confirmed"', '"your order"',
+]
+
+SAFE_TERM_PATTERN = re.compile(r"^[\w.@+-]+$")
+
+
+def format_sender_term(sender: str) -> str:
+    """Addresses and single words go in as-is, names with spaces or symbols are quoted."""
+    sender = sender.strip().replace('"', "")
+    if SAFE_TERM_PATTERN.match(sender):
+        return sender
+    return f'"{sender}"'
+
+
+def is_narrowed_query(query: str) -> bool:
+    """Whether the query was restricted by narrow_query, also for a query read back from a sync checkpoint."""
+    return "{from:(" in (query or "")
+
+
+class SenderAllowlist:
+    '''
+    Narrows the Gmail search to senders that produced transactions or orders before,
+    for this account and across all accounts, so non-financial mail is never fetched.
+
+    With probability `exploration_rate` a sync runs the unrestricted query instead, which
+    keeps discovering senders the allowlist and discovery terms do not cover yet.
+    A narrowed sync leaves lastSyncedAt in place, so the next exploration run lists every window it skipped.
+    '''
+    def __init__(
+        self,
+        account_senders: list[str],
+        global_senders: list[str],
+        exploration_rate: float = 0.1,
+        max_query_length: int = MAX_QUERY_LENGTH,
+    ):
+        self.senders: list[str] = []
+        for sender in account_senders + global_senders:
+            term = format_sender_term(sender)
+            if term and term != '""' and term not in self.senders:
+                self.senders.append(term)
+        self.exploration_rate = exploration_rate
+        self.max_query_length = max_query_length
+
+    def should_explore(self) -> bool:
+        if not self.senders:
+            return True
+        return random.random() < self.exploration_rate
+
+    def build_from_clause(self, budget: int) -> str:
+        """OR together as many senders as fit in `budget` characters, account senders first."""
+        terms = []
+        length = len("from:()")
+        for term in self.senders:
+            extra = len(term) + (len(" OR ") if terms else 0)
+            if length + extra > budget:
+                break
+            terms.append(term)
+            length += extra
+        if not terms:
+            return ""
+        return "from:(" + " OR ".join(terms) + ")"
+
+    def narrow_query(self, base_query: str) -> tuple[str, bool]:
+        """
+        Returns the query to run and whether this sync is an exploration run.
+        The narrowed query matches known senders OR mails containing discovery terms.
+        """
+        if self.should_explore():
+            return base_query, True
+
+        discovery = " ".join(DISCOVERY_TERMS)
+        budget = self.max_query_length - len(base_query) - len(discovery) - len(" {  }")
+        from_clause = self.build_from_clause(budget)
+        if not from_clause:
+            return base_query, True
+        return f"{base_query} {{{from_clause} {discovery}}}", False
@@ -0,0 +1,92 @@
+import json
+
+
+class ItemParseError:
+    '''An array element that is complete but is not valid json, kept with its raw text.'''
+    def __init__(self, raw: str, error: Exception):
+        self.raw = raw
+        self.error = error
+
+
+class JsonArrayItemParser:
+    '''
+    Incremental parser for llm json output.
+    Text is fed as it streams in, and every object element of the first json array in the
+    document is returned as soon as its closing brace arrives. That covers a top level list
+    (`[{...}, {...}]`) as well as a wrapper object (`{"orders": [{...}]}`). Anything before the
+    array, like a code fence, is ignored, and a broken element never affects the ones after it.
+    '''
+    def __init__(self):
+        self.depth = 0
+        self.array_depth: int | None = None
+        self.in_string = False
+        self.escaped = False
+        self.element: list[str] | None = None
+        self.complete = False
+
+    def feed(self, chunk: str) -> list[dict | ItemParseError]:
+        items = []
+        if self.complete or not chunk:
+            return items
+        start = 0 if self.element is not None else None
+        for index, char in enumerate(chunk):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                if char == "{" and self.depth == self.array_depth and self.element is None:
+                    self.element = []
+                    start = index
+                self.depth += 1
+                if char == "[" and self.array_depth is None:
+                    self.array_depth = self.depth
+            elif char in "}]":
+                self.depth -= 1
+                if char == "}" and self.depth == self.array_depth and self.element is not None:
+                    self.element.append(chunk[start:index + 1])
+                    items.append(self.load("".join(self.element)))
+                    self.element = None
+                    start = None
+                elif char == "]" and self.array_depth is not None and self.depth == self.array_depth - 1:
+                    self.complete = True
+                    return items
+
+        if self.element is not None and start is not None:
+            self.element.append(chunk[start:])
+        return items
+
+    def load(self, raw: str) -> dict | ItemParseError:
+        try:
+            return json.loads(raw)
+        except ValueError as e:
+            return ItemParseError(raw, e)
+
+
+class StreamedItems:
+    '''
+    Stream consumer for the llm dispatcher: parses each response chunk as it arrives,
+    so items are validated while the rest of the response is still streaming.
+    '''
+    def __init__(self):
+        self.parser = JsonArrayItemParser()
+        self.responses = []
+        self.chunks: list[str] = []
+        self.items: list[dict | ItemParseError] = []
+
+    def feed(self, response):
+        text = response.text or ""
+        self.responses.append(response)
+        self.chunks.append(text)
+        self.items.extend(self.parser.feed(text))
+
+    @property
+    def complete(self) -> bool:
+        return self.parser.complete
@@ -0,0 +1,301 @@
+import threading
+from datetime import datetime
+from typing import Iterator, Optional
+from googleapiclient.errors import HttpError
+from pydantic import BaseModel
+
+from packages.models import EmailSanitized
+from worker.connectors import ENV_SETTINGS
+from worker.operations import AIManager, EmailManager, HistoryCursorExpiredError, MessageFetchError, PersistError
+from worker.pipeline import Pipeline, Stage
+from worker.batch_packer import BatchPacker, estimate_tokens
+from worker.checkpoint import SyncCheckpoint
+from worker.log import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class SyncIncompleteError(Exception):
+    """Raised at the end of a sync that left pages unfetched or unstored, lastSyncedAt must not move past them."""
+    pass
+
+
+class SyncPage(BaseModel):
+    '''One Gmail listing page as it moves through the sync pipeline.'''
+    index: int
+    message_ids: list[str]
+    messages: list[dict] = []
+    emails: list[EmailSanitized] = []
+    transactions: list[dict] = []
+    orders: list[dict] = []
+
+
+class SyncManager:
+    '''
+    This class is supposed to do the following actions:
+    1. List new Gmail messages page by page (history cursor or date query)
+    2. Download the message bodies
+    3. Parse them into sanitized emails
+    4. Pack the emails of consecutive pages into llm batches by token budget
+    5. Extract transactions and orders through the llm
+    6. Store emails, transactions, orders and the extraction status of each email through mb-backend
+    Each step is a pipeline stage with its own concurrency and bounded queue,
+    so page N+1 is downloaded while page N is with Gemini.
+    With a checkpoint, progress is written after every stored page and a resumed sync continues where it stopped.
+    '''
+    def __init__(
+        self,
+        emailManager: EmailManager,
+        aiManager: AIManager,
+        query: str,
+        start_history_id: Optional[str] = None,
+        page_size: int = None,
+        message_ids: Optional[list[str]] = None,
+        checkpoint: Optional[SyncCheckpoint] = None,
+    ):
+        self.emailManager = emailManager
+        self.aiManager = aiManager
+        self.query = query
+        self.start_history_id = start_history_id
+        # Known message ids (a dead letter replay) are paged directly instead of listed
+        self.message_ids = message_ids
+        self.page_size = page_size or ENV_SETTINGS.SYNC_PAGE_SIZE
+        self.checkpoint = checkpoint
+        # A resumed sync already stored the newest emails of its first attempt
+        self.latest_email_time: Optional[datetime] = checkpoint.watermark if checkpoint else None
+        self.failed_pages = 0
+        self.lock = threading.Lock()
+        self.packer: BatchPacker[EmailSanitized] = BatchPacker(
+            ENV_SETTINGS.LLM_BATCH_MAX_INPUT_TOKENS, ENV_SETTINGS.LLM_BATCH_MAX_ITEMS
+        )
+        self.batch_index = 0
+
+    def iter_pages(self) -> Iterator[SyncPage]:
+        """List message ids page by page. Listing is sequential because of page tokens."""
+        if self.message_ids is not None:
+            for index, start in enumerate(range(0, len(self.message_ids), self.page_size)):
+                yield SyncPage(index=index, message_ids=self.message_ids[start:start + self.page_size])
+            return
+        start_history_id = self.start_history_id
+        next_page_token = None
+        index = 0
+        if self.checkpoint and self.checkpoint.resumed:
+            # Listed before the interruption but never stored, already stored ones are skipped by fetch_page
+            in_flight_ids = self.checkpoint.in_flight_ids()
+            logger.info(
+                f"Resuming sync after {self.checkpoint.pages_committed} stored pages with {len(in_flight_ids)} in flight emails for accountId: {self.emailManager.accountId}"
+            )
+            for start in range(0, len(in_flight_ids), self.page_size):
+                yield SyncPage(index=index, message_ids=in_flight_ids[start:start + self.page_size])
+                index += 1
+            if self.checkpoint.listing_complete:
+                return
+            next_page_token = self.checkpoint.page_token
+        resumed_page_token = next_page_token
+        while True:
+            try:
+                if start_history_id:
+                    try:
+                        message_ids, next_page_token = self.emailManager.list_history_message_ids(
+                            start_history_id, next_page_token, max_results=self.page_size
+                        )
+                    except HistoryCursorExpiredError as e:
+                        logger.warning(f"{e}, falling back to query: {self.query}")
+                        start_history_id = None
+                        next_page_token = None
+                        if self.checkpoint:
+                            self.checkpoint.restart_listing(None)
+                        continue
+                else:
+                    message_ids, next_page_token = self.emailManager.list_message_ids(
+                        self.query, next_page_token, max_results=self.page_size
+                    )
+            except HttpError as e:
+                # The page token of an interrupted sync can expire, listing again is cheap as stored emails are skipped
+                if resumed_page_token and next_page_token == resumed_page_token and e.resp.status == 400:
+                    logger.warning(f"Stored page token is no longer valid, listing from the start: {e}")
+                    next_page_token = None
+                    resumed_page_token = None
+                    self.checkpoint.restart_listing(start_history_id)
+                    continue
+                raise
+            resumed_page_token = None
+            if self.checkpoint:
+                self.checkpoint.listed(message_ids, next_page_token)
+
+            logger.info(f"Listed {len(message_ids)} emails on page {index} for accountId: {self.emailManager.accountId}")
+            if message_ids:
+                yield SyncPage(index=index, message_ids=message_ids)
+                index += 1
+            if not next_page_token:
+                break
+
+    def fetch_page(self, page: SyncPage) -> list[SyncPage]:
+        # A replay sends known messages on purpose, any other run skips what a previous attempt stored
+        if ENV_SETTINGS.SYNC_SKIP_KNOWN_MESSAGES and self.message_ids is None:
+            listed_ids = page.message_ids
+            page.message_ids = self.emailManager.filter_known_message_ids(listed_ids)
+            if self.checkpoint:
+                remaining = set(page.message_ids)
+                self.checkpoint.commit([id for id in listed_ids if id not in remaining])
+            if not page.message_ids:
+                return None
+        try:
+            if ENV_SETTINGS.GMAIL_FETCH_FORMAT == "two_phase":
+                page.messages = self.emailManager.fetch_messages_two_phase(page.message_ids)
+            else:
+                page.messages = self.emailManager.fetch_messages_by_ids(page.message_ids)
+        except MessageFetchError as e:
+            # Like a page that was not stored, its ids stay in flight and run() fails the sync at the end
+            logger.error(f"Page {page.index} was not fetched, {len(e.message_ids)} messages failed: {e}")
+            with self.lock:
+                self.failed_pages += 1
+            return None
+        if self.checkpoint:
+            # Only messages that fail permanently (deleted since listing) are missing, they can never be fetched
+            fetched_ids = {msg["id"] for msg in page.messages}
+            self.checkpoint.commit([id for id in page.message_ids if id not in fetched_ids])
+        logger.info(f"Fetched {len(page.messages)} emails on page {page.index} for accountId: {self.emailManager.accountId}")
+        return [page]
+
+    def parse_page(self, page: SyncPage) -> list[SyncPage]:
+        fetched_ids = [msg["id"] for msg in page.messages]
+        page.emails = self.emailManager.fetch_messages_details_list(page.messages)
+        page.messages = []
+        if self.checkpoint:
+            # Downloaded messages that cannot be parsed are not retried by a resumed sync either
+            parsed_ids = {email.id for email in page.emails}
+            self.checkpoint.commit([id for id in fetched_ids if id not in parsed_ids])
+        logger.info(f"Processed {len(page.emails)} emails on page {page.index} for accountId: {self.emailManager.accountId}")
+        if not page.emails:
+            return None
+        return [page]
+
+    def pack_page(self, page: SyncPage) -> list[SyncPage]:
+        """Re-batch parsed emails by llm token budget, independent of the Gmail page size."""
+        batches = []
+        for email in page.emails:
+            if ENV_SETTINGS.LLM_EXTRACTION_MODE == "combined":
+                costs = (estimate_tokens(email.snippet) + estimate_tokens(email.body),)
+            else:
+                # Snippets go to the transactions prompt, bodies to the orders prompt
+                costs = (estimate_tokens(email.snippet), estimate_tokens(email.body))
+            batches.extend(self.packer.add(email, costs))
+        return self.build_batches(batches)
+
+    def flush_batches(self) -> list[SyncPage]:
+        return self.build_batches(self.packer.flush())
+
+    def build_batches(self, batches: list[list[EmailSanitized]]) -> list[SyncPage]:
+        pages = []
+        for emails in batches:
+            with self.lock:
+                index = self.batch_index
+                self.batch_index += 1
+            logger.info(f"Packed llm batch {index} with {len(emails)} emails for accountId: {self.emailManager.accountId}")
+            pages.append(SyncPage(index=index, message_ids=[email.id for email in emails], emails=emails))
+        return pages
+
+    def extract_page(self, page: SyncPage) -> list[SyncPage]:
+        try:
+            if ENV_SETTINGS.LLM_EXTRACTION_MODE == "combined":
+                transactions_list, orders_list = self.aiManager.extract_combined_from_emails(page.emails)
+            else:
+                transactions_list = self.aiManager.extract_transactions_from_emails(page.emails)
+                orders_list = self.aiManager.extract_orders_from_emails(page.emails)
+        except Exception as e:
+            # The emails are still stored, as failed, and replayed later instead of failing the whole sync
+            logger.exception(f"Extraction failed for llm batch {page.index}: {e}")
+            self.aiManager.mark_emails_as_failed({email.id: f"{type(e).__name__}: {e}" for email in page.emails})
+            return [page]
+
+        if transactions_list:
+            page.transactions = transactions_list
+        if orders_list:
+            page.orders = orders_list
+        return [page]
+
+    def persist_page(self, page: SyncPage) -> None:
+        # TODO: if userDetails.get("has_allowed_analytics", False) is True:
+        if ENV_SETTINGS.SYNC_PERSIST_MODE == "batch":
+            logger.info(
+                f"Storing {len(page.emails)} emails, {len(page.transactions)} transactions and {len(page.orders)} orders for email: {self.aiManager.email}"
+            )
+            try:
+                status = self.aiManager.saveBatch(page.emails, page.transactions, page.orders)
+                logger.info(f"Ingest batch sync status: {status}")
+                stored = True
+            except PersistError as e:
+                logger.error(f"Llm batch {page.index} was not stored: {e}")
+                stored = False
+        else:
+            stored = self.persist_page_separately(page)
+
+        if not stored:
+            # The other pages are still stored, run() fails the sync at the end so lastSyncedAt stays put
+            # and the page's ids stay in flight for the retried task
+            with self.lock:
+                self.failed_pages += 1
+            return None
+
+        if self.checkpoint:
+            self.checkpoint.commit(page.message_ids, [email.receivedAt for email in page.emails], stored=True)
+            self.checkpoint.flush()
+
+        with self.lock:
+            for msg in page.emails:
+                if not msg.receivedAt:
+                    continue
+                if not self.latest_email_time or msg.receivedAt > self.latest_email_time:
+                    self.latest_email_time = msg.receivedAt
+        return None
+
+    def persist_page_separately(self, page: SyncPage) -> bool:
+        """Store the page with one call per kind. Returns True when every call succeeded."""
+        statuses = []
+        statusCode: int = self.emailManager.sync_database(page.emails)
+        statuses.append(statusCode)
+        logger.info(f"Database sync status code: {statusCode}")
+
+        if page.transactions:
+            logger.info(f"Processed and extracted {len(page.transactions)} transactions from emails for email: {self.aiManager.email}")
+            status = self.aiManager.saveTransactions(page.transactions)
+            statuses.append(status)
+            logger.info(f"AI Manager database sync status: {status}")
+        else:
+            logger.info("No transactions extracted from emails, skipping database sync")
+
+        if page.orders:
+            logger.info(f"Processed and extracted {len(page.orders)} orders from emails for email: {self.aiManager.email}")
+            status = self.aiManager.saveOrders(page.orders)
+            statuses.append(status)
+            logger.info(f"AI Manager orders database sync status: {status}")
+
+        status = self.aiManager.saveExtractionStatus([email.id for email in page.emails])
+        statuses.append(status)
+        logger.info(f"Extraction status sync status: {status}")
+        return all(status == 200 for status in statuses)
+
+    def build_pipeline(self) -> Pipeline:
+        stages = [
+            Stage("fetch", self.fetch_page, ENV_SETTINGS.SYNC_FETCH_CONCURRENCY, ENV_SETTINGS.SYNC_FETCH_QUEUE_SIZE),
+            Stage("parse", self.parse_page, ENV_SETTINGS.SYNC_PARSE_CONCURRENCY, ENV_SETTINGS.SYNC_PARSE_QUEUE_SIZE),
+            Stage("pack", self.pack_page, concurrency=1, queue_size=ENV_SETTINGS.SYNC_PACK_QUEUE_SIZE, flush=self.flush_batches),
+            Stage("llm", self.extract_page, ENV_SETTINGS.SYNC_LLM_CONCURRENCY, ENV_SETTINGS.SYNC_LLM_QUEUE_SIZE),
+            Stage("persist", self.persist_page, ENV_SETTINGS.SYNC_PERSIST_CONCURRENCY, ENV_SETTINGS.SYNC_PERSIST_QUEUE_SIZE),
+        ]
+        return Pipeline(self.iter_pages(), stages, name=f"sync-{self.emailManager.accountId}")
+
+    def run(self) -> Optional[datetime]:
+        """
+        Run the sync and return the latest received time of the stored emails.
+        Raises SyncIncompleteError when a page was not fetched or stored, or a checkpointed id was never committed.
+        """
+        stats = self.build_pipeline().run()
+        logger.info(f"Sync pipeline finished for accountId: {self.emailManager.accountId}", extra={"pipeline_stats": stats})
+        in_flight_ids = self.checkpoint.in_flight_ids() if self.checkpoint else []
+        if self.failed_pages or in_flight_ids:
+            raise SyncIncompleteError(
+                f"{self.failed_pages} pages or llm batches were not fetched or stored and {len(in_flight_ids)} emails are still in flight for accountId: {self.emailManager.accountId}"
+            )
+        return self.latest_email_time
@@ -0,0 +1,210 @@
+import re
+import threading
+from collections import Counter
+
+from packages.models import EmailSanitized, Transaction
+from worker.receipt_classifier import sender_domain
+
+AMOUNT = r"(?:rs\.?|inr|₹)\s?(?P<amount>\d[\d,]*(?:\.\d{1,2})?)"
+
+
+def parse_amount(value: str) -> float:
+    return float(value.replace(",", ""))
+
+
+class TransactionTemplate:
+    '''
+    A fixed-wording alert from one sender, matched with a precompiled regex.
+    The pattern must capture `amount` and may capture `source`, `destination` and `reference`.
+    `transaction_type` and `mode` are fixed for the template because the wording decides them.
+    '''
+    def __init__(
+        self,
+        name: str,
+        sender_domains: tuple[str, ...],
+        pattern: str,
+        transaction_type: str,
+        mode: str,
+    ):
+        self.name = name
+        self.sender_domains = sender_domains
+        self.pattern = re.compile(pattern, re.IGNORECASE | re.DOTALL)
+        self.transaction_type = transaction_type
+        self.mode = mode
+
+    def parse(self, email: EmailSanitized, text: str) -> Transaction | None:
+        match = self.pattern.search(text)
+        if not match:
+            return None
+        groups = match.groupdict()
+        return Transaction(
+            id=email.id,
+            amount=parse_amount(groups["amount"]),
+            transaction_type=self.transaction_type,
+            source_identifier=clean_field(groups.get("source")),
+            destination=clean_field(groups.get("destination")),
+            reference_number=clean_field(groups.get("reference")) or "",
+            mode=self.mode,
+        )
+
+
+def clean_field(value: str | None) -> str | None:
+    if value is None:
+        return None
+    return " ".join(value.split()).strip(" .,;:-") or None
+
+
+class TemplateRegistry:
+    '''
+    This class is supposed to do the following actions:
+    1. Keep the transaction templates keyed by sender domain
+    2. Parse an email with the templates of its sender, snippet first and then body
+    3. Count hits per template and misses per sender, so senders that still need rules show up
+    Emails no template matches go to the llm as before.
+    '''
+    def __init__(self, templates: list[TransactionTemplate] = None):
+        self.templates_by_sender: dict[str, list[TransactionTemplate]] = {}
+        self.lock = threading.Lock()
+        self.template_hits: Counter = Counter()
+        self.sender_misses: Counter = Counter()
+        for template in templates or []:
+            self.register(template)
+
+    def register(self, template: TransactionTemplate):
+        for domain in template.sender_domains:
+            self.templates_by_sender.setdefault(domain, []).append(template)
+
+    def templates_for(self, domain: str) -> list[TransactionTemplate]:
+        """Templates registered for the domain or any parent domain (alerts.sbi.co.in -> sbi.co.in)."""
+        templates = []
+        labels = domain.split(".")
+        for index in range(len(labels) - 1):
+            templates.extend(self.templates_by_sender.get(".".join(labels[index:]), []))
+        return templates
+
+    def parse(self, email: EmailSanitized) -> Transaction | None:
+        domain = sender_domain(email.emailId)
+        templates = self.templates_for(domain) if domain else []
+        for text in (email.snippet, email.body):
+            if not text:
+                continue
+            for template in templates:
+                transaction = template.parse(email, text)
+                if transaction is not None:
+                    with self.lock:
+                        self.template_hits[template.name] += 1
+                    return transaction
+        with self.lock:
+            self.sender_misses[domain or "unknown"] += 1
+        return None
+
+    def split(self, emails: list[EmailSanitized]) -> tuple[list[Transaction], list[EmailSanitized]]:
+        """Return the transactions parsed by templates and the emails left for the llm."""
+        transactions = []
+        unmatched = []
+        for email in emails:
+            transaction = self.parse(email)
+            if transaction is None:
+                unmatched.append(email)
+            else:
+                transactions.append(transaction)
+        return transactions, unmatched
+
+    def stats(self) -> dict:
+        with self.lock:
+            hits = sum(self.template_hits.values())
+            misses = sum(self.sender_misses.values())
+            return {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+                "template_hits": dict(self.template_hits),
+                "sender_misses": dict(self.sender_misses.most_common(20)),
+            }
+
+
+HDFC = ("hdfcbank.net", "hdfcbank.com")
+ICICI = ("icicibank.com",)
+SBI = ("sbi.co.in",)
+AXIS = ("axisbank.com",)
+PHONEPE = ("phonepe.com",)
+PAYTM = ("paytm.com",)
+
+DEFAULT_TEMPLATES = [
+    # Rs.65.00 has been debited from account 1531 to VPA q285@ybl MADHU S on 04-07-25. Your UPI transaction reference number is 254342617978.
+    TransactionTemplate(
+        "hdfc_upi_debit", HDFC,
+        AMOUNT + r" has been debited from (?:account|a/c) \**(?P<source>\w+) to (?:vpa )?(?P<destination>.+?) on \d{2}-\d{2}-\d{2}\."
+        r".*?reference number is (?P<reference>\d+)",
+        "debit", "UPI",
+    ),
+    # Rs. 500.00 is successfully credited to your account **1531 by VPA abc@okaxis ABC on 04-07-25. Your UPI transaction reference number is 518512345678.
+    TransactionTemplate(
+        "hdfc_upi_credit", HDFC,
+        AMOUNT + r" is successfully credited to your (?:account|a/c) \**(?P<source>\w+) by (?:vpa )?(?P<destination>.+?) on \d{2}-\d{2}-\d{2}\."
+        r".*?reference number is (?P<reference>\d+)",
+        "credit", "UPI",
+    ),
+    # Rs.1,299.00 spent on HDFC Bank Card x4321 at AMAZON PAY INDIA on 2025-07-04:10:15:22.
+    TransactionTemplate(
+        "hdfc_card_spend", HDFC,
+        AMOUNT + r" (?:was )?spent (?:on|using) hdfc bank (?:credit |debit )?card (?:x|ending )?(?P<source>\d{4}) at (?P<destination>.+?) on \d",
+        "debit", "Credit Card",
+    ),
+    # ICICI Bank Acct XX123 debited for Rs 500.00 on 04-Jul-25; MADHU S credited. UPI:518512345678.
+    TransactionTemplate(
+        "icici_upi_debit", ICICI,
+        r"icici bank acc(?:oun)?t (?P<source>\w+) debited (?:for|with) " + AMOUNT + r" on [\w-]+;? (?P<destination>.+?) credited\. upi:? ?(?P<reference>\d+)",
+        "debit", "UPI",
+    ),
+    # Your ICICI Bank Credit Card XX4321 has been used for a transaction of INR 799.00 on Jul 04, 2025 at 10:15:22. Info: SWIGGY.
+    TransactionTemplate(
+        "icici_card_spend", ICICI,
+        r"icici bank credit card (?P<source>\w+) has been used for a transaction of " + AMOUNT + r" on .+? info:? (?P<destination>[^.]+)",
+        "debit", "Credit Card",
+    ),
+    # Dear UPI user A/C X1234 debited by 500.0 on date 04Jul25 trf to MADHU S Refno 518512345678.
+    TransactionTemplate(
+        "sbi_upi_debit", SBI,
+        r"a/c (?P<source>\w+) debited by (?P<amount>\d[\d,]*(?:\.\d{1,2})?) on date \w+ trf to (?P<destination>.+?) ref ?no (?P<reference>\d+)",
+        "debit", "UPI",
+    ),
+    # Dear SBI User, your A/c X1234-credited by Rs.500 on 04Jul25 transfer from MADHU S Ref No 518512345678
+    TransactionTemplate(
+        "sbi_upi_credit", SBI,
+        r"a/c (?P<source>\w+)[- ]credited by " + AMOUNT + r" on \w+ transfer from (?P<destination>.+?) ref ?no (?P<reference>\d+)",
+        "credit", "UPI",
+    ),
+    # INR 500.00 debited A/c no. XX1234 04-07-25, 10:15:22 UPI/P2M/518512345678/SWIGGY
+    TransactionTemplate(
+        "axis_upi_debit", AXIS,
+        AMOUNT + r" debited\s+a/c no\. (?P<source>\w+)\s+[\d-]+,? [\d:]+\s+upi/p2[ma]/(?P<reference>\d+)/(?P<destination>[^\n/]+)",
+        "debit", "UPI",
+    ),
+    # INR 500.00 credited A/c no. XX1234 04-07-25, 10:15:22 IST UPI/P2A/518512345678/MADHU S
+    TransactionTemplate(
+        "axis_upi_credit", AXIS,
+        AMOUNT + r" credited\s+a/c no\. (?P<source>\w+)\s+[\d-]+,? [\d:]+(?: ist)?\s+upi/p2[ma]/(?P<reference>\d+)/(?P<destination>[^\n/]+)",
+        "credit", "UPI",
+    ),
+    # Paid ₹500 to Swiggy ... Transaction ID T2507041015221234567890 ... Debited from XXXXXX1234
+    TransactionTemplate(
+        "phonepe_paid", PHONEPE,
+        r"paid " + AMOUNT + r" to (?P<destination>.+?)\s+(?:txn\.? id|transaction id):? ?(?P<reference>\w+).*?debited from:? ?(?P<source>\w+)",
+        "debit", "UPI",
+    ),
+    # Received ₹500 from MADHU S ... Transaction ID T2507041015221234567890 ... Credited to XXXXXX1234
+    TransactionTemplate(
+        "phonepe_received", PHONEPE,
+        r"received " + AMOUNT + r" from (?P<destination>.+?)\s+(?:txn\.? id|transaction id):? ?(?P<reference>\w+).*?credited to:? ?(?P<source>\w+)",
+        "credit", "UPI",
+    ),
+    # Paid Rs.500 to Swiggy from Paytm Balance ... UPI Ref No: 518512345678
+    TransactionTemplate(
+        "paytm_paid", PAYTM,
+        r"paid " + AMOUNT + r" to (?P<destination>.+?) from (?P<source>.+?)\.?\s+(?:upi )?ref(?:erence)? no:? ?(?P<reference>\d+)",
+        "debit", "UPI",
+    ),
+]
+
+DEFAULT_REGISTRY = TemplateRegistry(DEFAULT_TEMPLATES)